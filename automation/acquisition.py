@@ -0,0 +1,290 @@
+"""
+Helpers shared by the acquisition loops of the device drivers and the measurement scripts.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class GrowableArray:
+    def __init__(self, capacity=1024, columns=None, dtype=float):
+        """
+        A numpy array that can be appended to in amortized constant time. The storage doubles every time it is full,
+        so collecting N points copies the data about log2(N) times, instead of N times like np.append() does. If the
+        number of points is known in advance, use it as the capacity and no copies are made.
+
+        Parameters
+        ----------
+        capacity : int
+            number of points to allocate at the start.
+        columns : int, None
+            If None, every point is a single value and the array is 1D. Else, every point is a row with this many
+            values and the array is 2D.
+        dtype : numpy dtype
+        """
+        capacity = max(int(capacity), 1)
+        shape = (capacity,) if columns is None else (capacity, columns)
+        self._buffer = np.empty(shape, dtype=dtype)
+        self._size = 0
+
+    def _grow(self, min_capacity):
+        capacity = len(self._buffer)
+        while capacity < min_capacity:
+            capacity *= 2
+        new = np.empty((capacity,) + self._buffer.shape[1:], dtype=self._buffer.dtype)
+        new[:self._size] = self._buffer[:self._size]
+        self._buffer = new
+
+    def append(self, value):
+        """
+        Parameters
+        ----------
+        value : float or array of float
+            a single value, or a row with one value per column.
+        """
+        if self._size == len(self._buffer):
+            self._grow(self._size + 1)
+        self._buffer[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        """
+        Parameters
+        ----------
+        values : array of float
+            several values, or several rows.
+        """
+        values = np.asarray(values, dtype=self._buffer.dtype)
+        n = len(values)
+        if self._size + n > len(self._buffer):
+            self._grow(self._size + n)
+        self._buffer[self._size:self._size + n] = values
+        self._size += n
+
+    def clear(self):
+        self._size = 0
+
+    def to_array(self):
+        """
+        Returns
+        -------
+        numpy array
+            copy of the points collected so far.
+        """
+        return self._buffer[:self._size].copy()
+
+    @property
+    def data(self):
+        """
+        View of the points collected so far. The view is only valid until the next append() or extend().
+        """
+        return self._buffer[:self._size]
+
+    @property
+    def capacity(self):
+        return len(self._buffer)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, item):
+        return self.data[item]
+
+
+class RunningStats:
+    def __init__(self):
+        """
+        Mean and variance of a stream of values, updated one value at a time with Welford's algorithm. Nothing is
+        stored, and the result does not lose precision when the values are large compared to their spread, like a
+        field of 2 G read to 0.0001 G.
+        """
+        self.reset()
+
+    def reset(self):
+        self._n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, value):
+        self._n += 1
+        delta = value - self._mean
+        self._mean += delta / self._n
+        self._m2 += delta * (value - self._mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def count(self):
+        return self._n
+
+    @property
+    def mean(self):
+        return self._mean if self._n else np.nan
+
+    @property
+    def variance(self):
+        """
+        Sample variance, with n - 1 in the denominator. nan for less than two values.
+        """
+        return self._m2 / (self._n - 1) if self._n > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """
+        Standard error of the mean.
+        """
+        return self.std / np.sqrt(self._n) if self._n > 1 else np.nan
+
+
+def trimmed_mean(values, trim=2):
+    """
+    Mean of the values without the trim lowest and the trim highest ones. Used to ignore a few spikes in the readings.
+
+    Parameters
+    ----------
+    values : array of float
+    trim : int
+        number of values to drop from each end.
+
+    Returns
+    -------
+    tuple of float
+        (mean, standard error of the mean). The error is the standard deviation of the kept values divided by the square
+        root of their number, like Series9550.get_avg_zfield() always did.
+    """
+    values = np.sort(np.asarray(values, dtype=float))
+    if trim:
+        values = values[trim:-trim]
+    if len(values) == 0:
+        return np.nan, np.nan
+    return np.mean(values), np.std(values) / np.sqrt(len(values))
+
+
+def median_sem(values):
+    """
+    Returns
+    -------
+    tuple of float
+        (median, standard error of the median). The spread is estimated with the median absolute deviation, so a few
+        spikes do not inflate the error. For normal noise, the error of the median is sqrt(pi / 2) times the error of
+        the mean.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return np.nan, np.nan
+    median = np.median(values)
+    if len(values) < 2:
+        return median, np.nan
+    std = 1.4826 * np.median(np.abs(values - median))  # same as the standard deviation for normal noise
+    return median, np.sqrt(np.pi / 2) * std / np.sqrt(len(values))
+
+
+def average_readings(
+        read,
+        n=10,
+        estimator='trimmed',
+        trim=2,
+        target_sem=None,
+        max_n=None,
+        interval=0.0,
+        clock=time,
+        block=False
+):
+    """
+    Take readings with read() and average them. Shared by the get_avg_zfield() methods of the gaussmeters.
+
+    If target_sem is None, exactly n readings are averaged. Otherwise, the readings continue after the first n until
+    the standard error is below target_sem, or max_n readings were taken, so a quiet signal is averaged for less time
+    than a noisy one. For the trimmed estimator, 2 * trim more readings are taken, since they are dropped.
+
+    Parameters
+    ----------
+    read : callable
+        takes no arguments and returns a reading. Readings that are not numbers, like error strings, are skipped. If
+        block is True, read(k) returns an array of k readings instead.
+    n : int
+        number of readings to average, or smallest number of readings if target_sem is given.
+    estimator : {'mean', 'trimmed', 'median'}
+        'mean' uses RunningStats, 'trimmed' uses trimmed_mean(), and 'median' uses median_sem().
+    trim : int
+        readings dropped from each end by the trimmed estimator.
+    target_sem : float, None
+        stop as soon as the standard error is at most this value.
+    max_n : int, None
+        largest number of readings when target_sem is given, not counting the trimmed ones. Defaults to 10 * n.
+    interval : float
+        seconds between readings.
+    clock : module or object with a sleep(seconds) method
+    block : bool
+        If True, readings are requested in blocks: first all the readings needed without target_sem, then n at a time
+        until target_sem or max_n is reached. Used by instruments that can buffer readings.
+
+    Returns
+    -------
+    tuple
+        (average, standard error, number of readings taken)
+    """
+    if estimator not in ('mean', 'trimmed', 'median'):
+        raise ValueError('estimator must be mean, trimmed, or median')
+    extra = 2 * trim if estimator == 'trimmed' else 0
+    n_min = n + extra
+    n_max = n_min if target_sem is None else (max_n if max_n is not None else 10 * n) + extra
+    n_max = max(n_max, n_min)
+
+    stats = RunningStats()
+    values = GrowableArray(capacity=n_max)
+    average, sem = np.nan, np.nan
+    taken = 0
+    while taken < n_max:
+        if taken and interval:
+            clock.sleep(interval)
+        try:
+            if block:
+                k = n_min - taken if taken < n_min else min(max(n, 1), n_max - taken)
+                taken += k
+                new = np.asarray(read(k), dtype=float).ravel()
+            else:
+                taken += 1
+                new = np.array([float(read())])
+        except (TypeError, ValueError):
+            continue
+        for value in new[np.isfinite(new)]:
+            values.append(value)
+            stats.add(value)
+
+        if len(values) < n_min and taken < n_max:
+            continue
+        if estimator == 'mean':
+            average, sem = stats.mean, stats.sem
+        elif estimator == 'trimmed':
+            average, sem = trimmed_mean(values.data, trim)
+        else:
+            average, sem = median_sem(values.data)
+        if target_sem is None or sem <= target_sem:
+            break
+
+    return average, sem, taken
+
+
+def run_in_background(function, *args, **kwargs):
+    """
+    Call function(*args, **kwargs) in a new thread and return right away, so the caller can do something else while
+    an instrument is busy.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        result() waits for the call to finish and returns its value, or raises its exception. done() tells if it
+        finished without waiting.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(function, *args, **kwargs)
+    executor.shutdown(wait=False)
+    return future
@@ -0,0 +1,349 @@
+"""
+Closed loop alignment. A few motor channels, usually picomotors of a Model8742 on the mounts of a mirror, are moved to
+maximize or minimize a measured signal, like the field read by a gaussmeter or a photodiode voltage read by a DAQ.
+
+An AlignmentProblem moves the channels and measures the signal. It keeps every measurement, so a point is never measured
+twice, and stops the search when its budget of measurements or motor steps is used up. The searches are nelder_mead(),
+coordinate_search(), and spsa(). All of them leave the motors at the best point found.
+"""
+import time
+
+import numpy as np
+from scipy.optimize import minimize
+
+try:
+    from acquisition import GrowableArray
+except ModuleNotFoundError:
+    from automation.acquisition import GrowableArray
+
+
+class _BudgetExhausted(Exception):
+    pass
+
+
+# ======================================================================================================================
+# Motors
+# ======================================================================================================================
+class PicomotorGroup:
+    def __init__(self, pm, channels):
+        """
+        Several channels of a Model8742 moved together. All the channels of a point are sent in one command line, so
+        a move takes as long as the slowest channel.
+
+        Parameters
+        ----------
+        pm : Model8742
+        channels : list of int
+        """
+        self._pm = pm
+        self.channels = list(channels)
+
+    def move_to(self, point):
+        out = self._pm.set_positions({c: int(p) for c, p in zip(self.channels, point)})
+        if isinstance(out, str):
+            print(out)
+
+    @property
+    def position(self):
+        return np.array([self._pm.get_position(c) for c in self.channels])
+
+
+class AxisGroup:
+    def __init__(self, axes):
+        """
+        Several scan axes from scans.py, like VxmAxis or PicomotorAxis, moved one after the other.
+
+        Parameters
+        ----------
+        axes : list of objects with move_to(position) and position
+        """
+        self._axes = list(axes)
+
+    def move_to(self, point):
+        for axis, p in zip(self._axes, point):
+            axis.move_to(int(p))
+
+    @property
+    def position(self):
+        return np.array([axis.position for axis in self._axes])
+
+
+# ======================================================================================================================
+# Problem
+# ======================================================================================================================
+class AlignmentProblem:
+    def __init__(
+            self,
+            motors,
+            readout,
+            maximize=True,
+            max_evaluations=100,
+            max_steps=None,
+            settle_time=0.0,
+            n_average=1,
+            reuse=True,
+            clock=time
+    ):
+        """
+        Parameters
+        ----------
+        motors : PicomotorGroup, AxisGroup, or any object with move_to(point) and position
+            positions are in motor steps, and are rounded to whole steps.
+        readout : callable, or readout from scans.py
+            function with no arguments that returns the signal, or an object whose read() returns a tuple that starts
+            with the signal, like GaussmeterReadout or FunctionReadout.
+        maximize : bool
+            If True, look for the largest signal. Else, the smallest.
+        max_evaluations : int
+            largest number of points to measure.
+        max_steps : int, None
+            largest number of motor steps to travel, summed over the channels. None for no limit.
+        settle_time : float
+            seconds to wait after every move before measuring.
+        n_average : int
+            number of readings averaged at every point.
+        reuse : bool
+            If True, a point that was already measured is not measured again. Turn off for signals that drift.
+        clock : module or object with a sleep(seconds) method
+        """
+        self._motors = motors
+        self._read = readout.read if hasattr(readout, 'read') else readout
+        self.maximize = maximize
+        self.max_evaluations = max_evaluations
+        self.max_steps = max_steps
+        self.settle_time = settle_time
+        self.n_average = n_average
+        self.reuse = reuse
+        self._clock = clock
+
+        self.start = np.round(np.asarray(motors.position, dtype=float)).astype(int)
+        self._position = self.start.copy()
+        self._cache = {}
+        self._history = GrowableArray(capacity=max_evaluations, columns=len(self.start) + 1)
+        self.evaluations = 0
+        self.steps = 0
+        self.best_point = None
+        self.best_value = None
+
+    def _measure(self):
+        values = []
+        for i in range(self.n_average):
+            out = self._read()
+            values.append(out[0] if isinstance(out, tuple) else out)
+        return float(np.mean(values))
+
+    def evaluate(self, point):
+        """
+        Move to point and measure the signal, unless it was measured already.
+
+        Parameters
+        ----------
+        point : array of float
+            position of every channel in steps.
+
+        Returns
+        -------
+        float
+            the signal.
+
+        Raises
+        ------
+        _BudgetExhausted
+            if the measurement would go over max_evaluations or max_steps. Caught by the searches.
+        """
+        point = np.round(np.asarray(point, dtype=float)).astype(int)
+        key = tuple(point)
+        if self.reuse and key in self._cache:
+            return self._cache[key]
+        steps = int(np.abs(point - self._position).sum())
+        if self.evaluations >= self.max_evaluations:
+            raise _BudgetExhausted
+        if self.max_steps is not None and self.steps + steps > self.max_steps:
+            raise _BudgetExhausted
+
+        self._motors.move_to(point)
+        self._position = point
+        self.steps += steps
+        if self.settle_time:
+            self._clock.sleep(self.settle_time)
+        value = self._measure()
+
+        self.evaluations += 1
+        self._cache[key] = value
+        self._history.append(np.r_[point, value])
+        if self.best_value is None or (value > self.best_value if self.maximize else value < self.best_value):
+            self.best_point, self.best_value = point, value
+        return value
+
+    def cost(self, point):
+        """
+        Signal to minimize: the signal, or minus the signal if maximize is True.
+        """
+        value = self.evaluate(point)
+        return -value if self.maximize else value
+
+    def move_to_best(self):
+        if self.best_point is not None and not np.array_equal(self.best_point, self._position):
+            self._motors.move_to(self.best_point)
+            self.steps += int(np.abs(self.best_point - self._position).sum())
+            self._position = self.best_point
+
+    @property
+    def position(self):
+        return self._position.copy()
+
+    @property
+    def history(self):
+        """
+        numpy array
+            one row per measured point: the position of every channel, and the signal.
+        """
+        return self._history.to_array()
+
+    def __repr__(self):
+        return 'AlignmentProblem(evaluations=' + str(self.evaluations) + ', steps=' + str(self.steps) + \
+            ', best_point=' + str(self.best_point) + ', best_value=' + str(self.best_value) + ')'
+
+
+# ======================================================================================================================
+# Searches
+# ======================================================================================================================
+def _start(problem, x0):
+    return problem.position.astype(float) if x0 is None else np.asarray(x0, dtype=float)
+
+
+def nelder_mead(problem, x0=None, step=100, xatol=1, fatol=0.0):
+    """
+    Nelder-Mead simplex search, with scipy.optimize.minimize(). Needs no gradient and handles coupled channels, like
+    the two axes of a mirror mount. Good for smooth signals with little noise.
+
+    Parameters
+    ----------
+    problem : AlignmentProblem
+    x0 : array of float, None
+        starting point. Defaults to the current position.
+    step : float or array of float
+        size of the starting simplex in steps, for all the channels or for each one.
+    xatol : float
+        stop when the simplex is smaller than this many steps.
+    fatol : float
+        stop when the signal changes less than this over the simplex.
+
+    Returns
+    -------
+    tuple
+        (best point, best signal).
+    """
+    x0 = _start(problem, x0)
+    step = np.broadcast_to(np.asarray(step, dtype=float), x0.shape)
+    simplex = np.vstack([x0] + [x0 + np.eye(len(x0))[i] * step[i] for i in range(len(x0))])
+    try:
+        minimize(problem.cost, x0, method='Nelder-Mead',
+                 options={'initial_simplex': simplex, 'xatol': xatol, 'fatol': fatol, 'maxfev': 100 * len(x0) *
+                          problem.max_evaluations})
+    except _BudgetExhausted:
+        pass
+    problem.move_to_best()
+    return problem.best_point, problem.best_value
+
+
+def coordinate_search(problem, x0=None, step=100, min_step=1, shrink=0.5):
+    """
+    Move one channel at a time. A channel keeps moving in a direction while the signal improves. When no channel
+    improves, the steps are multiplied by shrink, until they are smaller than min_step. Like aligning by hand, but
+    without overshooting. Good for channels that are not coupled.
+
+    Parameters
+    ----------
+    problem : AlignmentProblem
+    x0 : array of float, None
+        starting point. Defaults to the current position.
+    step : float or array of float
+        starting step in motor steps, for all the channels or for each one.
+    min_step : float
+        stop when the steps are smaller than this.
+    shrink : float
+        0 < shrink < 1.
+
+    Returns
+    -------
+    tuple
+        (best point, best signal).
+    """
+    if not 0 < shrink < 1:
+        raise ValueError('shrink must be between 0 and 1')
+    x = np.round(_start(problem, x0))
+    steps = np.array(np.broadcast_to(np.asarray(step, dtype=float), x.shape))
+    try:
+        fx = problem.cost(x)
+        while np.any(steps >= min_step):
+            improved = False
+            for i in np.flatnonzero(steps >= min_step):
+                for sign in (1, -1):
+                    trial = x.copy()
+                    trial[i] += sign * np.round(steps[i])
+                    ft = problem.cost(trial)
+                    if ft >= fx:
+                        continue
+                    while ft < fx:  # keep going while it improves
+                        x, fx = trial, ft
+                        trial = x.copy()
+                        trial[i] += sign * np.round(steps[i])
+                        ft = problem.cost(trial)
+                    improved = True
+                    break
+            if not improved:
+                steps *= shrink
+    except _BudgetExhausted:
+        pass
+    problem.move_to_best()
+    return problem.best_point, problem.best_value
+
+
+def spsa(problem, x0=None, step=100, perturbation=50, n_iter=50, alpha=0.602, gamma=0.101, seed=None):
+    """
+    Simultaneous perturbation stochastic approximation. Every iteration moves all the channels at once to two points,
+    x + c delta and x - c delta with random signs delta, and estimates the gradient from the two signals. It needs two
+    measurements per iteration for any number of channels, and averages out noise over the iterations, so it suits
+    noisy signals and many channels.
+
+    Parameters
+    ----------
+    problem : AlignmentProblem
+    x0 : array of float, None
+        starting point. Defaults to the current position.
+    step : float
+        steps moved by the largest channel in the first iteration. The gain is set from the first gradient, so the
+        units of the signal do not matter.
+    perturbation : float
+        c of the first iteration, in steps. At least one step is used.
+    n_iter : int
+        largest number of iterations.
+    alpha, gamma : float
+        decay of the gain and of the perturbation, with the usual values from Spall.
+    seed : int, None
+
+    Returns
+    -------
+    tuple
+        (best point, best signal).
+    """
+    rng = np.random.default_rng(seed)
+    x = _start(problem, x0)
+    big_a = 0.1 * n_iter
+    a = None
+    try:
+        for k in range(n_iter):
+            ck = max(perturbation / (k + 1) ** gamma, 1)
+            delta = rng.choice((-1, 1), len(x))
+            g = (problem.cost(x + ck * delta) - problem.cost(x - ck * delta)) / (2 * ck) * delta
+            if a is None:
+                if not np.any(g):
+                    continue
+                a = step * (big_a + 1) ** alpha / np.max(np.abs(g))
+            x = x - a / (k + 1 + big_a) ** alpha * g
+        problem.evaluate(x)
+    except _BudgetExhausted:
+        pass
+    problem.move_to_best()
+    return problem.best_point, problem.best_value
@@ -3,6 +3,7 @@ import time
 
 import matplotlib.pyplot as plt
 import matplotlib.animation as anim
+import numpy as np
 import simple_pid
 
 try:
@@ -19,6 +20,7 @@ class HeaterAssembly:
             supply_and_channel,
             daq_and_channel,
             heater=None,
+            clock=time,
     ):
         """
         A heater assembly composed of a heater, a temperature measuring device, and a power supply. This assembly
@@ -36,6 +38,10 @@ class HeaterAssembly:
         heater : Heater
             Object that contains the MAX temperature, MAX current, and MAX volts based on the physical heater
             hardware. If none is provided, the class will create an instance of the Heater class to use.
+        clock : module or object
+            Source of time for the PID calculations. Must have a monotonic() method returning seconds, so a change of
+            the system clock, e.g. by NTP, does not change the dt of the PID. Defaults to the time module. Simulations
+            use a virtual clock (see oven_simulation.VirtualClock) to run faster than real time.
         """
 
         self._supply_and_channel = supply_and_channel
@@ -43,11 +49,18 @@ class HeaterAssembly:
         self._heater = heater
         if self._heater is None:
             self._heater = Heater()
+        self._clock = clock
         self._pid = self._get_default_pid()
+        self._t_last_pid = self._clock.monotonic()
+        self._pid_resets = 0
         self._MAX_voltage = min(self._heater.MAX_volts, self._supply_and_channel[0].MAX_voltage)
         self._MAX_current = min(self._heater.MAX_current, self._supply_and_channel[0].MAX_current)
         self._MAX_temp_limit = self._heater.MAX_temp
         self._regulating = False
+        self._tuner = None
+        self._tuning_status = 'IDLE'
+        self._profile = None
+        self._profile_running = False
 
     # Assembly
     # --------
@@ -81,6 +94,8 @@ class HeaterAssembly:
         voltage.
         """
         self._pid = self._get_default_pid()
+        self._t_last_pid = self._clock.monotonic()
+        self._pid_resets += 1
 
     def reset_pid_limits(self):
         """
@@ -374,6 +389,8 @@ class HeaterAssembly:
         return self._pid.setpoint
 
     def set_pid_setpoint(self, new_set):
+        if self._profile_running:
+            return 'ERROR: a profile is running. Stop it before changing the setpoint'
         if self._MAX_temp_limit < new_set:
             return 'ERROR: new_temp value of', new_set, 'not allowed. Check temperature limits'
         self._pid.setpoint = new_set
@@ -396,6 +413,196 @@ class HeaterAssembly:
         if type(reg) is not int and type(reg) is not bool:
             return 'ERROR: type ' + str(type(reg)) + ' not supported'
         self._regulating = bool(reg)
+        if not self._regulating and self._tuner is not None:
+            self.stop_pid_tuning()
+        if not self._regulating:
+            self.stop_profile()
+
+    def start_pid_tuning(self, rule='ZN', high=None, low=0, hysteresis=0.2, cycles=4, max_time=4*3600):
+        """
+        Start a relay feedback experiment around the current PID setpoint. The experiment runs one step at a time from
+        update_supply(), so it does not block other assemblies. When it is done, the new gains are applied to the PID
+        and regulation continues with them.
+
+        Parameters
+        ----------
+        rule : {'ZN', 'TL'}
+            Ziegler-Nichols or Tyreus-Luyben.
+        high : float, None
+            relay output above the setpoint, in volts. Defaults to the upper PID output limit.
+        low : float
+            relay output below the setpoint, in volts.
+        hysteresis : float
+            degrees past the setpoint before the relay switches.
+        cycles : int
+            number of oscillations to measure.
+        max_time : float, None
+            seconds after which the experiment is stopped.
+
+        Returns
+        -------
+        None
+            If the experiment started.
+        str
+            Else, error string.
+        """
+        if rule not in ('ZN', 'TL'):
+            return 'ERROR: tuning rule ' + str(rule) + ' not supported. Use ZN or TL'
+        if self._pid.setpoint <= 0:
+            return 'ERROR: set the PID setpoint before tuning'
+
+        self.ready_assembly()
+        if high is None:
+            high = self._pid.output_limits[1]
+        self._tuner = RelayTuner(self._pid.setpoint, high, low, hysteresis, cycles, rule, max_time)
+        self._tuning_status = 'RUNNING 0/' + str(cycles)
+        self._regulating = True
+
+    def stop_pid_tuning(self):
+        """
+        Abort the relay feedback experiment. The PID keeps its previous gains, and starts again from a clean state, so
+        its first step does not integrate over the whole experiment.
+        """
+        if self._tuner is not None:
+            self._tuner = None
+            self._tuning_status = 'STOPPED'
+            self._pid.reset()
+            self._t_last_pid = self._clock.monotonic()
+            self._pid_resets += 1
+            self.set_supply_voltage(0)
+
+    def get_pid_tuning_status(self):
+        """
+        Returns
+        -------
+        str
+            IDLE, RUNNING n/cycles, DONE with the new gains, STOPPED, or FAILED.
+        """
+        return self._tuning_status
+
+    def _step_tuner(self):
+        t = self._clock.monotonic()
+        new_volts = self._tuner.step(round(self.temp, 2), t)
+        state = self._tuner.state
+        if state == 'RUNNING':
+            self._tuning_status = 'RUNNING ' + self._tuner.progress
+        elif state == 'DONE':
+            kp, ki, kd = self._tuner.gains()
+            self._pid.tunings = (kp, ki, kd)
+            self._pid.reset()
+            self._t_last_pid = t
+            self._pid_resets += 1
+            self._tuning_status = 'DONE kp=' + str(round(kp, 6)) + ' ki=' + str(round(ki, 6)) + ' kd=' + \
+                                  str(round(kd, 6))
+            self._tuner = None
+        else:
+            self._tuning_status = state
+            self._regulating = False
+            self._tuner = None
+        return new_volts
+
+    @property
+    def is_tuning(self):
+        return self._tuner is not None
+
+    @property
+    def pid_resets(self):
+        """
+        Number of times the state of the PID was cleared, by reset_pid() or by a relay tuning. Used by PidBank to
+        know when to clear its row of the assembly.
+        """
+        return self._pid_resets
+
+    # Setpoint profile
+    # ----------------
+    def load_profile(self, profile):
+        """
+        Load a ramp and soak profile. Check the docstring of SetpointProfile for the format.
+
+        Parameters
+        ----------
+        profile : str, list of tuple, or SetpointProfile
+
+        Returns
+        -------
+        None
+            If the profile was loaded.
+        str
+            Else, error string.
+        """
+        if self._profile_running:
+            return 'ERROR: a profile is running. Stop it before loading a new one'
+        try:
+            if type(profile) is str:
+                profile = SetpointProfile.from_string(profile)
+            elif type(profile) is not SetpointProfile:
+                profile = SetpointProfile(profile)
+        except (ValueError, TypeError, IndexError) as e:
+            return 'ERROR: ' + str(e)
+        if profile.max_setpoint is not None and profile.max_setpoint > self._MAX_temp_limit:
+            return 'ERROR: profile setpoint of ' + str(profile.max_setpoint) + ' not allowed. Check temperature limits'
+        self._profile = profile
+
+    def start_profile(self):
+        """
+        Start the loaded profile from the current temperature and turn on PID regulation. The setpoint is then updated
+        by update_supply() every sample time.
+        """
+        if self._profile is None:
+            return 'ERROR: no profile loaded'
+        self.ready_assembly()
+        self._profile.start(self._clock.monotonic(), round(self.temp, 2))
+        self._profile_running = True
+        self._pid.setpoint = self._profile.setpoint(self._clock.monotonic())
+        self._regulating = True
+
+    def stop_profile(self):
+        """
+        Stop the profile. The PID keeps regulating at the current setpoint.
+        """
+        if self._profile_running:
+            self._profile.stop(self._clock.monotonic())
+            self._profile_running = False
+
+    def get_profile_status(self):
+        """
+        Returns
+        -------
+        str
+            NONE if no profile is loaded. Else, IDLE, RUNNING, STOPPED, or DONE, followed by the current segment, the
+            number of segments, and the current setpoint.
+        """
+        if self._profile is None:
+            return 'NONE'
+        n = len(self._profile.segments)
+        if self._profile.duration is None:
+            return 'IDLE 0/' + str(n)
+
+        t = self._clock.monotonic()
+        if self._profile_running:
+            state = 'RUNNING'
+        elif self._profile.stop_time is not None:
+            state = 'STOPPED'
+            t = self._profile.stop_time
+        else:
+            state = 'DONE'
+        seg = min(self._profile.segment(t), n)
+        return state + ' ' + str(seg) + '/' + str(n) + ' setpoint=' + str(round(self._pid.setpoint, 3))
+
+    def update_profile(self):
+        """
+        Move the PID setpoint along the running profile. Called by update_supply() and by the vectorized server loop.
+        """
+        if not self._profile_running:
+            return
+        t = self._clock.monotonic()
+        self._pid.setpoint = self._profile.setpoint(t)
+        if self._profile.is_done(t):
+            self._profile_running = False
+
+    @property
+    def is_profile_running(self):
+        return self._profile_running
 
     @property
     def pid_settings(self):
@@ -480,7 +687,16 @@ class HeaterAssembly:
         """
         ps = self._supply_and_channel[0]
         ch = self._supply_and_channel[1]
-        new_volts = self._pid(round(self.temp, 2))
+
+        self.update_profile()
+        if self._tuner is not None:
+            new_volts = self._step_tuner()
+        else:
+            now = self._clock.monotonic()
+            dt = max(now - self._t_last_pid, 1e-16)
+            if dt >= self._pid.sample_time:  # the PID only calculates a new output once the sample time has passed
+                self._t_last_pid = now
+            new_volts = self._pid(round(self.temp, 2), dt=dt)
 
         err = ps.set_voltage(channel=ch, volts=new_volts)
         if err is not None:
@@ -523,6 +739,579 @@ class HeaterAssembly:
         plt.show()
 
 
+class PidBank:
+    def __init__(
+            self,
+            n,
+            Kp=0.4,
+            Ki=0.015,
+            Kd=0.005,
+            setpoint=0,
+            sample_time=2,
+            output_limits=(None, None),
+            differential_on_measurement=True,
+    ):
+        """
+        A bank of n PID controllers stored in numpy arrays. Every row of the bank behaves like a simple_pid.PID object
+        called with an explicit dt, but all the rows are updated with a single vectorized call to step(). Used to
+        regulate ovens with many HeaterAssembly objects, and for fast simulations of many PID controllers at once.
+
+        The rows of a bank loaded from assemblies are the PIDs that regulate. The simple_pid.PID of every assembly only
+        gets the state of its row back when store_assemblies() is called, which update_heaters_bank() does after every
+        step.
+
+        Parameters
+        ----------
+        n : int
+            number of PID controllers in the bank.
+        Kp, Ki, Kd : float or array of float
+            gains of the controllers. A float sets the same gain for all rows.
+        setpoint : float or array of float
+            setpoints of the controllers.
+        sample_time : float, array of float, or None
+            minimum time in seconds between two updates of a row. Same meaning as simple_pid.PID.sample_time. None
+            updates the rows on every call.
+        output_limits : two tuple of float or None
+            lower and upper output limits for all the rows. None means no limit in that direction. The integral term
+            is clamped to the same limits to avoid integral windup.
+        differential_on_measurement : bool
+            If True, the derivative term is calculated on the input instead of the error. Same as simple_pid.PID.
+        """
+        self._n = n
+        self.Kp = np.full(n, Kp, dtype=float)
+        self.Ki = np.full(n, Ki, dtype=float)
+        self.Kd = np.full(n, Kd, dtype=float)
+        self.setpoint = np.full(n, setpoint, dtype=float)
+        self.sample_time = np.full(n, 0 if sample_time is None else sample_time, dtype=float)
+        self.differential_on_measurement = differential_on_measurement
+
+        self._out_min = np.full(n, -np.inf)
+        self._out_max = np.full(n, np.inf)
+        self._integral = np.zeros(n)
+        self._last_input = np.full(n, np.nan)
+        self._last_error = np.full(n, np.nan)
+        self._last_output = np.full(n, np.nan)
+        self._proportional = np.zeros(n)
+        self._derivative = np.zeros(n)
+        self._pid_resets = [None] * n
+
+        self.set_output_limits(*output_limits)
+
+    @classmethod
+    def from_assemblies(cls, asm_list):
+        """
+        Create a bank with one row for each HeaterAssembly object, using the current PID settings of the assemblies.
+
+        Parameters
+        ----------
+        asm_list : list of HeaterAssembly
+
+        Returns
+        -------
+        PidBank
+        """
+        bank = cls(len(asm_list))
+        bank.load_assemblies(asm_list)
+        return bank
+
+    def load_assemblies(self, asm_list):
+        """
+        Copy the gains, setpoints, sample times, and output limits of every HeaterAssembly into its row of the bank.
+        Does not touch the integrators, unless the PID of the assembly was reset (for example with PD:RSET) since the
+        last load, in which case that row is reset too.
+
+        Parameters
+        ----------
+        asm_list : list of HeaterAssembly
+            must have the same length and order as the rows of the bank.
+        """
+        for i, asm in enumerate(asm_list):
+            self.Kp[i] = asm.pid_kp
+            self.Ki[i] = asm.pid_ki
+            self.Kd[i] = asm.pid_kd
+            self.setpoint[i] = asm.get_pid_setpoint()
+            self.sample_time[i] = asm.get_pid_sample_time()
+            lower, upper = asm.get_pid_limits()
+            self.set_output_limits(lower, upper, rows=i)
+
+            if self._pid_resets[i] != asm.pid_resets:
+                self._pid_resets[i] = asm.pid_resets
+                self.reset(rows=i)
+
+    def store_assemblies(self, asm_list, rows=None):
+        """
+        Copy the state of the selected rows back into the simple_pid.PID of their HeaterAssembly: the integral, the
+        last input, error, and output, and the components. The assemblies can then go back to regulating on their
+        own with update_supply(), without a jump.
+
+        Parameters
+        ----------
+        asm_list : list of HeaterAssembly
+            must have the same length and order as the rows of the bank.
+        rows : array of int, array of bool, or None
+            rows to copy. None copies all the rows.
+        """
+        rows = np.arange(self._n) if rows is None else np.arange(self._n)[rows]
+        for i in rows:
+            if np.isnan(self._last_output[i]):
+                continue
+            asm = asm_list[i]
+            pid = asm._pid
+            pid._integral = float(self._integral[i])
+            pid._proportional = float(self._proportional[i])
+            pid._derivative = float(self._derivative[i])
+            pid._last_input = float(self._last_input[i])
+            pid._last_error = float(self._last_error[i])
+            pid._last_output = float(self._last_output[i])
+            pid._last_time = pid.time_fn()
+            asm._t_last_pid = asm._clock.monotonic()
+
+    def set_output_limits(self, lower, upper, rows=None):
+        """
+        Set the output limits of the selected rows. As in simple_pid, the integral term and the last output are
+        clamped to the new limits.
+
+        Parameters
+        ----------
+        lower, upper : float or None
+            None means no limit in that direction.
+        rows : int, array of int, array of bool, or None
+            rows to change. None changes all the rows.
+        """
+        if rows is None:
+            rows = slice(None)
+        lower = -np.inf if lower is None else lower
+        upper = np.inf if upper is None else upper
+        if np.any(np.asarray(lower) > np.asarray(upper)):
+            raise ValueError('lower limit must be less than upper limit')
+
+        self._out_min[rows] = lower
+        self._out_max[rows] = upper
+        self._integral = np.clip(self._integral, self._out_min, self._out_max)
+        self._last_output = np.clip(self._last_output, self._out_min, self._out_max)
+
+    def reset(self, rows=None):
+        """
+        Clear the integrators and the stored inputs, errors, and outputs of the selected rows.
+
+        Parameters
+        ----------
+        rows : int, array of int, array of bool, or None
+            rows to reset. None resets all the rows.
+        """
+        if rows is None:
+            rows = slice(None)
+        self._integral[rows] = 0
+        self._last_input[rows] = np.nan
+        self._last_error[rows] = np.nan
+        self._last_output[rows] = np.nan
+        self._proportional[rows] = 0
+        self._derivative[rows] = 0
+
+    def step(self, inputs, dt, mask=None):
+        """
+        Update all the selected rows of the bank with one vectorized calculation. A row is only recalculated if its
+        dt is larger or equal to its sample time, or if it has never produced an output. This matches calling
+        simple_pid.PID(input_, dt=dt) on every row.
+
+        Parameters
+        ----------
+        inputs : array of float
+            batched snapshot of the measured values, one per row.
+        dt : float or array of float
+            time in seconds since the last update of each row. Must be positive for the selected rows.
+        mask : array of bool, None
+            rows to update. Rows that are not selected keep their state. None selects all the rows.
+
+        Returns
+        -------
+        numpy array
+            output of every row. Rows that were not recalculated return their last output, or nan if they never
+            produced one.
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        dt = np.broadcast_to(np.asarray(dt, dtype=float), (self._n,))
+        if mask is None:
+            mask = np.ones(self._n, dtype=bool)
+        else:
+            mask = np.asarray(mask, dtype=bool)
+
+        if np.any(dt[mask] <= 0):
+            raise ValueError('dt must be positive for all the updated rows')
+
+        has_output = ~np.isnan(self._last_output)
+        due = mask & ~(has_output & (dt < self.sample_time))
+        safe_dt = np.where(due, dt, 1)  # avoid dividing by zero on rows that are skipped
+
+        error = self.setpoint - inputs
+        last_input = np.where(np.isnan(self._last_input), inputs, self._last_input)
+        last_error = np.where(np.isnan(self._last_error), error, self._last_error)
+
+        proportional = self.Kp * error
+        integral = np.clip(self._integral + self.Ki * error * safe_dt, self._out_min, self._out_max)
+        if self.differential_on_measurement:
+            derivative = -self.Kd * (inputs - last_input) / safe_dt
+        else:
+            derivative = self.Kd * (error - last_error) / safe_dt
+
+        output = np.clip(proportional + integral + derivative, self._out_min, self._out_max)
+
+        self._integral = np.where(due, integral, self._integral)
+        self._last_input = np.where(due, inputs, self._last_input)
+        self._last_error = np.where(due, error, self._last_error)
+        self._last_output = np.where(due, output, self._last_output)
+        self._proportional = np.where(due, proportional, self._proportional)
+        self._derivative = np.where(due, derivative, self._derivative)
+
+        return self._last_output.copy()
+
+    @property
+    def n(self):
+        return self._n
+
+    @property
+    def integral(self):
+        return self._integral.copy()
+
+    @property
+    def last_output(self):
+        return self._last_output.copy()
+
+    @property
+    def output_limits(self):
+        return self._out_min.copy(), self._out_max.copy()
+
+
+class SetpointProfile:
+    def __init__(self, segments):
+        """
+        A ramp and soak profile for the setpoint of a PID. The profile is a list of segments that are executed in
+        order:
+
+            ('R', target, rate)     ramp the setpoint to target at rate degrees per minute.
+            ('S', target)           step the setpoint to target.
+            ('H', seconds)          hold the setpoint for a number of seconds.
+
+        Profiles are usually uploaded to the BeagleBone as text with the PF:LOAD command, and then run by the server
+        loop. In text form, the items of a segment are separated by commas and the segments by semicolons, with no
+        spaces. For example, R,100,2;H,600;R,25,1 ramps to 100 at 2 degrees per minute, holds for 10 minutes, and ramps
+        down to 25 at 1 degree per minute.
+
+        Parameters
+        ----------
+        segments : list of tuple
+            segments as described above.
+        """
+        self._segments = []
+        for seg in segments:
+            kind = str(seg[0]).upper()
+            if kind == 'R' and len(seg) == 3 and seg[2] > 0:
+                self._segments.append(('R', float(seg[1]), float(seg[2])))
+            elif kind == 'S' and len(seg) == 2:
+                self._segments.append(('S', float(seg[1])))
+            elif kind == 'H' and len(seg) == 2 and seg[1] >= 0:
+                self._segments.append(('H', float(seg[1])))
+            else:
+                raise ValueError('profile segment ' + str(seg) + ' not valid')
+        if not self._segments:
+            raise ValueError('profile has no segments')
+
+        self._durations = None
+        self._starts = None
+        self._t_start = None
+        self._t_stop = None
+
+    @classmethod
+    def from_string(cls, text):
+        """
+        Parameters
+        ----------
+        text : str
+            profile in text form, for example R,100,2;H,600.
+
+        Returns
+        -------
+        SetpointProfile
+        """
+        segments = []
+        for item in text.strip().strip(';').split(';'):
+            fields = item.split(',')
+            try:
+                segments.append((fields[0],) + tuple(float(f) for f in fields[1:]))
+            except ValueError:
+                raise ValueError('profile segment ' + item + ' not valid')
+        return cls(segments)
+
+    def to_string(self):
+        """
+        Returns
+        -------
+        str
+            profile in the text form used by the PF:LOAD command.
+        """
+        items = []
+        for seg in self._segments:
+            items.append(','.join([seg[0]] + [format(v, 'g') for v in seg[1:]]))
+        return ';'.join(items)
+
+    def start(self, t, start_setpoint):
+        """
+        Start the profile. The first ramp starts from start_setpoint.
+
+        Parameters
+        ----------
+        t : float
+            start time in seconds.
+        start_setpoint : float
+            setpoint at the start of the profile. Usually the current temperature.
+        """
+        self._starts = []
+        self._durations = []
+        sp = start_setpoint
+        for seg in self._segments:
+            self._starts.append(sp)
+            if seg[0] == 'R':
+                self._durations.append(abs(seg[1] - sp) / seg[2] * 60)
+                sp = seg[1]
+            elif seg[0] == 'S':
+                self._durations.append(0.0)
+                sp = seg[1]
+            else:
+                self._durations.append(seg[1])
+        self._end_setpoint = sp
+        self._t_start = t
+        self._t_stop = None
+
+    def stop(self, t):
+        """
+        Mark the profile as stopped at time t, before reaching its end.
+        """
+        self._t_stop = t
+
+    def setpoint(self, t):
+        """
+        Parameters
+        ----------
+        t : float
+            time in seconds.
+
+        Returns
+        -------
+        float
+            setpoint of the profile at time t. After the last segment, the final setpoint.
+        """
+        if self._t_start is None:
+            raise ValueError('profile not started')
+
+        elapsed = t - self._t_start
+        for seg, sp0, duration in zip(self._segments, self._starts, self._durations):
+            if elapsed < duration:
+                if seg[0] == 'R':
+                    return sp0 + (seg[1] - sp0) * elapsed / duration
+                return sp0
+            elapsed -= duration
+        return self._end_setpoint
+
+    def segment(self, t):
+        """
+        Returns
+        -------
+        int
+            index of the segment running at time t, or the number of segments if the profile is done.
+        """
+        elapsed = t - self._t_start
+        for i, duration in enumerate(self._durations):
+            if elapsed < duration:
+                return i
+            elapsed -= duration
+        return len(self._durations)
+
+    def is_done(self, t):
+        return self._t_start is not None and self.segment(t) == len(self._segments)
+
+    @property
+    def segments(self):
+        return list(self._segments)
+
+    @property
+    def stop_time(self):
+        return self._t_stop
+
+    @property
+    def max_setpoint(self):
+        """
+        Highest target of the ramps and steps, or None if the profile only holds the starting setpoint.
+        """
+        targets = [seg[1] for seg in self._segments if seg[0] != 'H']
+        if not targets:
+            return None
+        return max(targets)
+
+    @property
+    def duration(self):
+        """
+        Total duration in seconds. Only known once the profile has started.
+        """
+        if self._durations is None:
+            return None
+        return sum(self._durations)
+
+
+class RelayTuner:
+    def __init__(self, setpoint, high, low=0.0, hysteresis=0.2, cycles=4, rule='ZN', max_time=None):
+        """
+        Relay feedback autotuner (Astrom-Hagglund). The output switches between high and low every time the input
+        crosses the setpoint, which makes the process oscillate around the setpoint. The amplitude and period of the
+        oscillation give the ultimate gain and ultimate period, which are then turned into PID gains with the
+        Ziegler-Nichols or Tyreus-Luyben rules. Does not block: step() is called with every new measurement, usually
+        by HeaterAssembly.update_supply().
+
+        Parameters
+        ----------
+        setpoint : float
+            temperature to oscillate around.
+        high, low : float
+            outputs of the relay.
+        hysteresis : float
+            the output only switches once the input is hysteresis degrees past the setpoint. Avoids switching on noise.
+        cycles : int
+            number of full oscillations to measure. The first oscillation is ignored since it is still a transient.
+        rule : {'ZN', 'TL'}
+            ZN for Ziegler-Nichols, TL for Tyreus-Luyben. TL is more conservative.
+        max_time : float, None
+            seconds after which the experiment fails if it is not done.
+        """
+        if rule not in ('ZN', 'TL'):
+            raise ValueError('rule ' + str(rule) + ' not supported. Use ZN or TL')
+
+        self.setpoint = setpoint
+        self.high = high
+        self.low = low
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.rule = rule
+        self.max_time = max_time
+
+        self._state = 'RUNNING'
+        self._t_start = None
+        self._output = high
+        self._peak = None
+        self._maxima = []
+        self._minima = []
+        self._t_rising = []  # times where the output switches to high
+        self._ku = None
+        self._pu = None
+        self._a = None
+
+    def step(self, input_, t):
+        """
+        Parameters
+        ----------
+        input_ : float
+            measured temperature.
+        t : float
+            time of the measurement in seconds.
+
+        Returns
+        -------
+        float
+            new output. Once the experiment is done or has failed, returns low.
+        """
+        if self._state != 'RUNNING':
+            return self.low
+        if self._t_start is None:
+            self._t_start = t
+            self._output = self.high if input_ < self.setpoint else self.low
+
+        if self.max_time is not None and t - self._t_start > self.max_time:
+            self._state = 'FAILED'
+            return self.low
+
+        # with the lag of the oven, the input keeps rising after the output switches to low, and keeps falling after
+        # it switches to high. The maximum is found while the output is low, and the minimum while it is high.
+        if self._output == self.low:
+            self._peak = input_ if self._peak is None else max(self._peak, input_)
+            if input_ < self.setpoint - self.hysteresis:
+                self._output = self.high
+                self._maxima.append(self._peak)
+                self._peak = input_
+                self._t_rising.append(t)
+        else:
+            self._peak = input_ if self._peak is None else min(self._peak, input_)
+            if input_ > self.setpoint + self.hysteresis:
+                self._output = self.low
+                self._minima.append(self._peak)
+                self._peak = input_
+
+        if len(self._t_rising) > self.cycles:
+            self._finish()
+            return self.low
+
+        return self._output
+
+    def _finish(self):
+        n = self.cycles
+        periods = np.diff(self._t_rising[-n - 1:])
+        a = (np.mean(self._maxima[-n:]) - np.mean(self._minima[-n:])) / 2
+        d = (self.high - self.low) / 2
+        if a <= self.hysteresis:
+            self._state = 'FAILED'
+            return
+
+        self._a = float(a)
+        self._ku = 4 * d / (np.pi * np.sqrt(a ** 2 - self.hysteresis ** 2))
+        self._pu = float(np.mean(periods))
+        self._state = 'DONE'
+
+    def gains(self):
+        """
+        Returns
+        -------
+        three tuple of float
+            Kp, Ki, Kd calculated from the ultimate gain and period using the selected rule.
+        None
+            If the experiment is not done.
+        """
+        if self._state != 'DONE':
+            return None
+
+        if self.rule == 'ZN':
+            kp, ti, td = 0.6 * self._ku, self._pu / 2, self._pu / 8
+        else:
+            kp, ti, td = self._ku / 2.2, 2.2 * self._pu, self._pu / 6.3
+        return kp, kp / ti, kp * td
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def progress(self):
+        return str(max(len(self._t_rising) - 1, 0)) + '/' + str(self.cycles)
+
+    @property
+    def ultimate_gain(self):
+        return self._ku
+
+    @property
+    def ultimate_period(self):
+        return self._pu
+
+    @property
+    def amplitude(self):
+        """
+        Half of the peak to peak amplitude of the measured oscillation. None if the experiment is not done.
+        """
+        return self._a
+
+    @property
+    def switch_times(self):
+        """
+        Times where the output switched to high. The last cycles + 1 of them bound the measured oscillations.
+        """
+        return list(self._t_rising)
+
+
 class Oven(SocketEthernetDevice):
     """
     The Oven class refers to the combination of a BeagleBoneBlack rev C and a number of HeaterAssembly objects. A single
@@ -820,6 +1609,48 @@ class Oven(SocketEthernetDevice):
     def set_pid_regulation(self, asm_key, regt):
         return self._command_(asm_key, 'PD:REGT', int(regt))
 
+    def start_pid_tuning(self, asm_key, rule='ZN'):
+        return self._command_(asm_key, 'PD:TUNE', rule)
+
+    def stop_pid_tuning(self, asm_key):
+        return self._command_(asm_key, 'PD:TUNE', 'STOP')
+
+    def get_pid_tuning_status(self, asm_key):
+        return self._query_(asm_key, 'PD:TUNE ?')
+
+    # Setpoint profile
+    def load_profile(self, asm_key, profile):
+        """
+        Upload a ramp and soak profile to an assembly. The profile runs on the BeagleBone, so only one command is sent
+        instead of one setpoint per sample.
+
+        Parameters
+        ----------
+        asm_key : str or int
+        profile : str, list of tuple, or SetpointProfile
+            Check the docstring of SetpointProfile for the format. For example [('R', 100, 2), ('H', 600)].
+
+        Returns
+        -------
+        None or error string
+        """
+        if type(profile) is str:
+            text = profile
+        else:
+            if type(profile) is not SetpointProfile:
+                profile = SetpointProfile(profile)
+            text = profile.to_string()
+        return self._command_(asm_key, 'PF:LOAD', text)
+
+    def start_profile(self, asm_key):
+        return self._command_(asm_key, 'PF:STRT')
+
+    def stop_profile(self, asm_key):
+        return self._command_(asm_key, 'PF:STOP')
+
+    def get_profile_status(self, asm_key):
+        return self._query_(asm_key, 'PF:STAT ?')
+
     # Heater
     def get_heater_MAX_temp(self, asm_key):
         return self._query_(asm_key, 'HT:TMAX ?')
@@ -0,0 +1,497 @@
+"""
+Loaders for the text files written by measure_coil_field.py, like the ones in data_coils/. A file starts with a header
+block written by get_pos_b() (gaussmeter idn, average, V and A of the power supply, deltaX, starting position and
+notes), followed by comma separated rows that end at the first empty line. The header is parsed into a dictionary of
+metadata and the rows are parsed in one pass with numpy, instead of one float() per value.
+
+The same data can also be stored in a binary file (.cdat) that can be appended to during a scan and memory mapped for
+analysis. Check ColumnWriter.
+"""
+import datetime
+import glob
+import json
+import os
+import re
+import struct
+import warnings
+
+import numpy as np
+
+
+SCAN_COLUMNS = ('pos', 'b', 'berr')  # written by get_pos_b() and get_pos_b_adaptive()
+SWEEP_COLUMNS = ('volts', 'amps', 'b')  # current sweeps of the office measurements, header is only the gaussmeter
+
+_AVERAGE = re.compile(r'average for (\d+) data ?points')
+_SUPPLY = re.compile(r'V\s*=\s*([-+.\deE]+|nan)\s*,\s*A\s*=\s*([-+.\deE]+|nan)')
+_DELTA = re.compile(r'deltaX\s*=\s*(.*?)\s*steps?\.?\s*$')
+_ZERO = re.compile(r'Software zero\s*=\s*([-+.\deE]+)\s*G')
+_GLUED_ROW = re.compile(r'^(.*[A-Za-z)]\.)(-?\d[-+.\deE]*(,\s*[-+.\deEnaN]+)+)$')  # a row written after the notes
+_TIMESTAMP = '%y_%m_%d__%H_%M_%S'
+
+BINARY_EXTENSION = '.cdat'
+_MAGIC = b'CDAT0001'
+_ALIGN = 64  # the rows start at a multiple of this many bytes, so memory maps of the rows are aligned
+
+
+def _parse_row(line):
+    """
+    Returns
+    -------
+    list of float, None
+        None if the line is not a row of numbers.
+    """
+    try:
+        return [float(f) for f in line.split(',')]
+    except ValueError:
+        return None
+
+
+def _parse_header(lines, metadata):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        m_avg = _AVERAGE.search(line)
+        m_supply = _SUPPLY.search(line)
+        m_delta = _DELTA.search(line)
+        m_zero = _ZERO.search(line)
+        if metadata['idn'] is None:
+            metadata['idn'] = line
+        elif m_avg:
+            metadata['n_average'] = int(m_avg.group(1))
+        elif m_supply:
+            metadata['volts'] = float(m_supply.group(1))
+            metadata['amps'] = float(m_supply.group(2))
+        elif m_delta:
+            try:
+                metadata['delta_step'] = int(m_delta.group(1))
+            except ValueError:
+                metadata['delta_step'] = m_delta.group(1)  # adaptive scans write a description of the steps
+        elif m_zero:
+            metadata['zero_offset'] = float(m_zero.group(1))
+        elif line.startswith('Starting position:'):
+            metadata['start_position'] = line[len('Starting position:'):].strip()
+        else:
+            metadata['notes'] += line + '\n'
+
+
+def _parse_body(lines):
+    """
+    Parse the data rows in a single call to numpy. Files written by the current code always have the same number of
+    columns in every row, so the fast path almost always works. The slow path is for old files with missing or garbled
+    values, which are read as nan. Rows with a different number of columns are skipped.
+
+    Returns
+    -------
+    2D numpy array
+    """
+    if not lines:
+        return np.zeros((0, 0))
+    n_cols = lines[0].count(',') + 1
+    try:
+        with warnings.catch_warnings():  # numpy 1.x warns when it stops at a value it cannot parse, numpy 2 raises
+            warnings.simplefilter('ignore')
+            values = np.fromstring(','.join(lines), sep=',')
+        if values.size == n_cols * len(lines):
+            return values.reshape(len(lines), n_cols)
+    except ValueError:
+        pass
+    return np.atleast_2d(np.genfromtxt(lines, delimiter=',', invalid_raise=False))
+
+
+class CoilFile:
+    def __init__(self, path, metadata, data, columns):
+        """
+        A single file of data_coils. Created by load_coil_file().
+
+        Parameters
+        ----------
+        path : str
+        metadata : dictionary
+            idn, n_average, volts, amps, delta_step, zero_offset (software zero of a Gm3, in gauss), start_position,
+            notes, coilname, timestamp and kind (scan or sweep). Values missing from the header are None.
+        data : 2D numpy array
+            one row per point, one column per value.
+        columns : tuple of str
+            names of the columns of data.
+        """
+        self.path = path
+        self.metadata = metadata
+        self.data = data
+        self.columns = columns
+
+    def __getitem__(self, column):
+        """
+        Column by name, e.g. file['pos'].
+        """
+        if column not in self.columns:
+            raise KeyError(column + ' not in ' + str(self.columns))
+        return self.data[:, self.columns.index(column)]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return 'CoilFile(' + self.path + ', ' + str(len(self)) + ' points)'
+
+
+def load_coil_file(path):
+    """
+    Read a file written by get_pos_b() and friends. The header ends at the first row of numbers. The rows end at the
+    first empty line after them, or at the end of the file.
+
+    Parameters
+    ----------
+    path : str
+
+    Binary files (.cdat) are read with load_column_file().
+
+    Returns
+    -------
+    CoilFile
+    """
+    if path.endswith(BINARY_EXTENSION):
+        return load_column_file(path)
+
+    with open(path, 'r') as file:
+        lines = file.read().splitlines()
+
+    metadata = {
+        'idn': None, 'n_average': None, 'volts': None, 'amps': None, 'delta_step': None, 'zero_offset': None,
+        'start_position': None, 'notes': '', 'coilname': os.path.basename(os.path.dirname(os.path.abspath(path))),
+        'timestamp': None, 'kind': 'scan'
+    }
+    try:
+        metadata['timestamp'] = datetime.datetime.strptime(os.path.splitext(os.path.basename(path))[0], _TIMESTAMP)
+    except ValueError:
+        pass
+
+    start = 0
+    header = []
+    glued = []
+    while start < len(lines) and _parse_row(lines[start]) is None:
+        m = _GLUED_ROW.match(lines[start])
+        if m and start > 0:  # old files have no new line after the notes, so the first row is on the same line
+            header.append(m.group(1))
+            glued = [m.group(2)]
+            start += 1
+            break
+        header.append(lines[start])
+        start += 1
+    stop = start
+    while stop < len(lines) and lines[stop].strip():
+        stop += 1
+
+    _parse_header(header, metadata)
+    metadata['notes'] = metadata['notes'].strip()
+    data = _parse_body(glued + lines[start:stop])
+
+    idn = metadata['idn'] or ''
+    n_cols = data.shape[1]
+    if metadata['volts'] is None and idn.lower() in ('gm3', 'series9550') and n_cols == 3:
+        metadata['kind'] = 'sweep'
+        columns = SWEEP_COLUMNS
+    else:
+        columns = SCAN_COLUMNS[:n_cols] + tuple('col' + str(i) for i in range(len(SCAN_COLUMNS), n_cols))
+    return CoilFile(path, metadata, data, columns)
+
+
+class CoilDataset:
+    def __init__(self, files):
+        """
+        Many files of data_coils in a single table. The points of every file are stacked in one array with the columns
+        pos, b, berr (berr is nan for files that do not have it), and the run column says which file every point comes
+        from. Usually created with load_coil_dataset().
+
+        Parameters
+        ----------
+        files : list of CoilFile
+        """
+        self.files = list(files)
+
+        n_points = sum(len(f) for f in self.files)
+        self.data = np.full((n_points, len(SCAN_COLUMNS)), np.nan)
+        self.run = np.empty(n_points, dtype=int)
+        i = 0
+        for k, f in enumerate(self.files):
+            n = min(f.data.shape[1], len(SCAN_COLUMNS)) if len(f) else 0
+            self.data[i:i + len(f), :n] = f.data[:, :n]
+            self.run[i:i + len(f)] = k
+            i += len(f)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, item):
+        return self.files[item]
+
+    def column(self, name):
+        return self.data[:, SCAN_COLUMNS.index(name)]
+
+    def points(self, run):
+        """
+        Returns
+        -------
+        2D numpy array
+            the rows of data that belong to file number run.
+        """
+        return self.data[self.run == run]
+
+    def select(self, **criteria):
+        """
+        Files whose metadata match all the criteria, e.g. select(coilname='small2', amps=2.299).
+
+        Returns
+        -------
+        CoilDataset
+        """
+        return CoilDataset([f for f in self.files if all(f.metadata.get(k) == v for k, v in criteria.items())])
+
+    def table(self):
+        """
+        Returns
+        -------
+        str
+            one line of metadata per file.
+        """
+        lines = ['run  coil            timestamp            kind   points  volts   amps   delta']
+        for k, f in enumerate(self.files):
+            m = f.metadata
+            lines.append('{:<4} {:<15} {:<20} {:<6} {:<7} {:<7} {:<6} {}'.format(
+                k, m.get('coilname'), str(m.get('timestamp')), m.get('kind', 'scan'), len(f), str(m.get('volts')),
+                str(m.get('amps')), str(m.get('delta_step'))))
+        return '\n'.join(lines)
+
+
+def load_coil_dataset(root='data_coils', pattern='**/*.txt', kind='scan'):
+    """
+    Load every file under a directory. Files without any rows (empty files, aborted scans) are skipped, and so are
+    files that are not measurements, like the summaries in data_coils/officeMeasurements/.
+
+    Parameters
+    ----------
+    root : str
+    pattern : str
+        glob pattern relative to root. '**' matches any number of directories. Use '**/*.cdat' for binary files.
+    kind : str, None
+        only keep files of this kind, scan or sweep. None keeps both.
+
+    Returns
+    -------
+    CoilDataset
+        files sorted by timestamp.
+    """
+    files = []
+    for path in sorted(glob.glob(os.path.join(root, pattern), recursive=True)):
+        f = load_coil_file(path)
+        if len(f) == 0 or (kind is not None and f.metadata.get('kind', 'scan') != kind):
+            continue
+        files.append(f)
+
+    files.sort(key=lambda f: (f.metadata.get('timestamp') or datetime.datetime.min, f.path))
+    return CoilDataset(files)
+
+
+# ======================================================================================================================
+# Binary files
+# ======================================================================================================================
+def _read_binary_header(file):
+    """
+    Returns
+    -------
+    tuple
+        (dictionary of the header, offset in bytes of the first row)
+    """
+    start = file.read(len(_MAGIC) + 4)
+    if len(start) < len(_MAGIC) + 4 or start[:len(_MAGIC)] != _MAGIC:
+        raise ValueError(str(file.name) + ' is not a ' + BINARY_EXTENSION + ' file')
+    offset = struct.unpack('<I', start[len(_MAGIC):])[0]
+    header = json.loads(file.read(offset - len(_MAGIC) - 4).decode('utf-8'))
+    return header, offset
+
+
+def _metadata_from_json(metadata):
+    if isinstance(metadata.get('timestamp'), str):
+        metadata['timestamp'] = datetime.datetime.fromisoformat(metadata['timestamp'])
+    return metadata
+
+
+class ColumnWriter:
+    def __init__(self, filename, columns=SCAN_COLUMNS, metadata=None, append=False):
+        """
+        Writes rows of float64 to a binary file. The file is:
+
+            8 bytes     CDAT0001
+            4 bytes     little endian uint32, offset in bytes of the first row
+            JSON        {"columns": [...], "dtype": "<f8", "metadata": {...}}, padded with spaces to the offset
+            rows        one little endian float64 per column, one row after the other
+
+        The number of rows is not stored, it is given by the size of the file, so a row can be appended to the file at
+        any time and the file is always valid. A row that was only partly written when a scan was interrupted is
+        ignored when the file is read, and removed when the file is opened again with append=True. Columns of the
+        file are views of a memory map, check load_column_file().
+
+        Parameters
+        ----------
+        filename : str
+            usually ends in .cdat.
+        columns : tuple of str
+            names of the columns. Ignored if append is True and the file exists.
+        metadata : dictionary, None
+            anything that can be written as JSON, e.g. coilname, amps, volts, delta_step and idn, like the metadata of
+            load_coil_file(). datetime values are written as strings. Ignored if append is True and the file exists.
+        append : bool
+            If True and the file exists, new rows are added after the rows already in the file.
+        """
+        if append and os.path.exists(filename):
+            self._file = open(filename, 'rb+')
+            header, offset = _read_binary_header(self._file)
+            self.columns = tuple(header['columns'])
+            self.metadata = _metadata_from_json(header['metadata'])
+            row_size = 8 * len(self.columns)
+            size = self._file.seek(0, os.SEEK_END)
+            self._n_rows = (size - offset) // row_size
+            self._file.truncate(offset + self._n_rows * row_size)
+            self._file.seek(offset + self._n_rows * row_size)
+        else:
+            self.columns = tuple(columns)
+            self.metadata = dict(metadata) if metadata is not None else {}
+            self._file = open(filename, 'wb')
+            header = json.dumps({'columns': list(self.columns), 'dtype': '<f8', 'metadata': self.metadata},
+                                default=str).encode('utf-8')
+            offset = -(-(len(_MAGIC) + 4 + len(header)) // _ALIGN) * _ALIGN
+            self._file.write(_MAGIC + struct.pack('<I', offset) + header.ljust(offset - len(_MAGIC) - 4))
+            self._file.flush()
+            self._n_rows = 0
+        self.filename = filename
+
+    def append(self, row, flush=True):
+        """
+        Parameters
+        ----------
+        row : tuple of float
+            one value per column.
+        flush : bool
+            If True, the row is on disk when the method returns.
+        """
+        row = np.asarray(row, dtype='<f8')
+        if row.shape != (len(self.columns),):
+            raise ValueError('row must have ' + str(len(self.columns)) + ' values')
+        self._file.write(row.tobytes())
+        self._n_rows += 1
+        if flush:
+            self._file.flush()
+
+    def extend(self, rows, flush=True):
+        """
+        Parameters
+        ----------
+        rows : 2D array of float
+            one row per point, one column per column of the file.
+        flush : bool
+        """
+        rows = np.asarray(rows, dtype='<f8').reshape(-1, len(self.columns))
+        self._file.write(np.ascontiguousarray(rows).tobytes())
+        self._n_rows += len(rows)
+        if flush:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self._n_rows
+
+
+def load_column_file(path, mmap=True):
+    """
+    Read a file written by ColumnWriter.
+
+    Parameters
+    ----------
+    path : str
+    mmap : bool
+        If True, data is a read only memory map of the file, so only the parts that are used are read from disk.
+        Otherwise, the rows are copied into memory.
+
+    Returns
+    -------
+    CoilFile
+    """
+    with open(path, 'rb') as file:
+        header, offset = _read_binary_header(file)
+        size = file.seek(0, os.SEEK_END)
+
+    columns = tuple(header['columns'])
+    metadata = {'coilname': os.path.basename(os.path.dirname(os.path.abspath(path))), 'timestamp': None}
+    metadata.update(_metadata_from_json(header['metadata']))
+
+    n_rows = (size - offset) // (8 * len(columns))
+    if n_rows == 0:
+        data = np.zeros((0, len(columns)))
+    elif mmap:
+        data = np.memmap(path, dtype=header['dtype'], mode='r', offset=offset, shape=(n_rows, len(columns)))
+    else:
+        data = np.fromfile(path, dtype=header['dtype'], count=n_rows * len(columns), offset=offset)
+        data = data.reshape(n_rows, len(columns))
+    return CoilFile(path, metadata, data, columns)
+
+
+def convert_coil_file(path, out_path=None):
+    """
+    Write a text file of data_coils as a binary file, with the metadata of the header.
+
+    Parameters
+    ----------
+    path : str
+    out_path : str, None
+        If None, same as path with the .cdat extension.
+
+    Returns
+    -------
+    str
+        out_path
+    """
+    f = load_coil_file(path)
+    if out_path is None:
+        out_path = os.path.splitext(path)[0] + BINARY_EXTENSION
+    with ColumnWriter(out_path, f.columns, f.metadata) as writer:
+        writer.extend(f.data)
+    return out_path
+
+
+def convert_coil_directory(root='data_coils', pattern='**/*.txt', out_root=None):
+    """
+    Convert every measurement file under root with convert_coil_file(). Files without rows and files that are not
+    measurements are skipped.
+
+    Parameters
+    ----------
+    root : str
+    pattern : str
+        glob pattern relative to root.
+    out_root : str, None
+        directory for the binary files, with the same tree as root. If None, every binary file is written next to its
+        text file.
+
+    Returns
+    -------
+    list of str
+        paths of the binary files.
+    """
+    written = []
+    for path in sorted(glob.glob(os.path.join(root, pattern), recursive=True)):
+        if len(load_coil_file(path)) == 0:
+            continue
+        out_path = None
+        if out_root is not None:
+            out_path = os.path.splitext(os.path.join(out_root, os.path.relpath(path, root)))[0] + BINARY_EXTENSION
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        written.append(convert_coil_file(path, out_path))
+    return written
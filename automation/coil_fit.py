@@ -0,0 +1,462 @@
+"""
+Fits of the field of the square coils along their axis. The model is the field of a square loop of side length side
+with n turns of wire, as a function of the position of the gaussmeter probe in motor steps. CoilFieldModel evaluates
+the model and its derivatives for a given coil and current, fit_coil_field() fits a single scan, and fit_coil_runs()
+fits every scan under data_coils in parallel and writes a summary table with one line per scan. IncrementalCoilFit
+updates the fit while a scan runs, so get_pos_b() can stop as soon as n and z0 are known well enough.
+
+Run this file to re-analyse the whole data_coils directory.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+try:
+    from acquisition import GrowableArray
+    from coil_data import load_coil_file
+    from coil_data import load_coil_dataset
+except ModuleNotFoundError:
+    from automation.acquisition import GrowableArray
+    from automation.coil_data import load_coil_file
+    from automation.coil_data import load_coil_dataset
+
+
+COIL_SIDE = {
+    'small': 0.667893,  # meters
+    'medium': 0.7028942,
+    'large': 0.7378954
+}
+METERS_PER_STEP = 6.8E-6
+
+
+def coil_side(coilname):
+    """
+    Parameters
+    ----------
+    coilname : {'small1', 'small2', 'medium1', 'medium2', 'large1', 'large2'}
+
+    Returns
+    -------
+    float
+        side length of the coil in meters.
+    """
+    try:
+        return COIL_SIDE[coilname.rstrip('0123456789')]
+    except KeyError:
+        raise ValueError('unknown coil ' + str(coilname)) from None
+
+
+def coil_field_z_axis(z, n, z0, side, amps):
+    """
+    Field of a square coil along its axis.
+
+    Parameters
+    ----------
+    z : numpy array
+        positions in steps.
+    n : float
+        number of turns of wire in the coil.
+    z0 : float
+        center of the coil in steps.
+    side : float
+        side length of the coil in meters.
+    amps : float
+        current through the coil.
+
+    Returns
+    -------
+    numpy array
+        field in gauss.
+    """
+    x = (z - z0) * METERS_PER_STEP  # convert steps to meters
+    f = 2e-7*amps*n*side**2
+    s = 1 / (x**2 + (side**2)/4)
+    t = 1 / np.sqrt(x**2 + (side**2)/2)
+
+    return f*s*t*10000  # tesla to gauss
+
+
+class CoilFieldModel:
+    def __init__(self, coilname=None, amps=1.0, side=None):
+        """
+        coil_field_z_axis() for a given coil and current, with the constants computed once, and its analytic Jacobian
+        for curve_fit(). With x = (z - z0) * METERS_PER_STEP and B the field:
+
+            dB/dn = B / n
+            dB/dz0 = B * x * METERS_PER_STEP * (2 / (x**2 + side**2/4) + 1 / (x**2 + side**2/2))
+
+        Parameters
+        ----------
+        coilname : {'small1', 'small2', 'medium1', 'medium2', 'large1', 'large2'}, None
+            used to look up the side length if side is None.
+        amps : float
+            current through the coil.
+        side : float, None
+            side length of the coil in meters.
+        """
+        if side is None:
+            side = coil_side(coilname)
+        self.side = side
+        self.amps = amps
+        self._gauss_per_turn = 2e-7 * amps * side**2 * 10000
+        self._a = side**2 / 4
+        self._b = side**2 / 2
+
+    def _terms(self, z, z0):
+        x = (np.asarray(z, dtype=float) - z0) * METERS_PER_STEP
+        x2 = x * x
+        s = 1 / (x2 + self._a)
+        t2 = 1 / (x2 + self._b)
+        return x, s, t2
+
+    def __call__(self, z, n, z0):
+        """
+        Returns
+        -------
+        numpy array
+            field in gauss at the positions z, in steps.
+        """
+        x, s, t2 = self._terms(z, z0)
+        return self._gauss_per_turn * n * s * np.sqrt(t2)
+
+    def jacobian(self, z, n, z0):
+        """
+        Returns
+        -------
+        2D numpy array
+            one row per position, with the derivatives of the field with respect to n and z0.
+        """
+        x, s, t2 = self._terms(z, z0)
+        per_turn = self._gauss_per_turn * s * np.sqrt(t2)
+        jac = np.empty((len(x), 2))
+        jac[:, 0] = per_turn
+        jac[:, 1] = per_turn * n * x * METERS_PER_STEP * (2 * s + t2)
+        return jac
+
+    def fit(self, pos, b, berr=None, p0=(60, 6260), bounds=None):
+        """
+        Fit n and z0 to a scan with the analytic Jacobian. Points with nan are ignored.
+
+        Parameters
+        ----------
+        pos : numpy array
+            position data in steps.
+        b : numpy array
+            magnetic field data in gauss.
+        berr : numpy array, None
+            standard error of every point of b. If given, the fit is weighted by 1/berr**2. Errors that are not
+            finite, or smaller than a tenth of the median error, are replaced by a tenth of the median error. This
+            happens when all the readings of a point are the same, because of the resolution of the gaussmeter. The
+            covariance is scaled by the reduced chi squared of the fit, so it also includes errors that are not in
+            berr.
+        p0 : tuple of float, None
+            initial n and z0. If None, n starts at 60 and z0 at the position of the largest field.
+        bounds : tuple, None
+            ((n min, z0 min), (n max, z0 max)). None for no bounds.
+
+        Returns
+        -------
+        tuple
+            (popt, pcov, residuals). popt is [n, z0], pcov is their 2x2 covariance, and residuals has one value per
+            point of pos, nan where the data is nan.
+        """
+        pos = np.asarray(pos, dtype=float)
+        b = np.asarray(b, dtype=float)
+        ok = np.isfinite(pos) & np.isfinite(b)
+        if np.count_nonzero(ok) < 3:
+            raise ValueError('not enough points to fit')
+
+        sigma = None
+        if berr is not None:
+            berr = np.asarray(berr, dtype=float)[ok]
+            valid = np.isfinite(berr) & (berr > 0)
+            if np.any(valid):
+                floor = np.median(berr[valid]) / 10
+                sigma = np.where(valid & (berr > floor), berr, floor)
+
+        if p0 is None:
+            p0 = (60, pos[ok][np.argmax(np.abs(b[ok]))])
+        if bounds is None:
+            bounds = (-np.inf, np.inf)
+
+        popt, pcov = curve_fit(self, pos[ok], b[ok], p0=p0, sigma=sigma, bounds=bounds, jac=self.jacobian)
+        residuals = b - self(pos, *popt)
+        return popt, pcov, residuals
+
+
+def fit_coil_field(pos, b, coilname, amps, p0=(60, 6260), bounds=((58, 5500), (62, 6500)), berr=None):
+    """
+    Fit n and z0 of the field of a coil to a scan with CoilFieldModel. Points with nan are ignored.
+
+    Parameters
+    ----------
+    pos : numpy array
+        position data in steps.
+    b : numpy array
+        magnetic field data in gauss.
+    coilname : {'small1', 'small2', 'medium1', 'medium2', 'large1', 'large2'}
+    amps : float
+        current through the coil at the moment of taking data.
+    p0 : tuple of float, None
+        initial n and z0. If None, n starts at 60 and z0 at the position of the largest field.
+    bounds : tuple, None
+        ((n min, z0 min), (n max, z0 max)). None for no bounds.
+    berr : numpy array, None
+        standard error of every point of b. If given, the fit is weighted, check CoilFieldModel.fit().
+
+    Returns
+    -------
+    tuple
+        (popt, pcov, residuals). popt is [n, z0], pcov is their 2x2 covariance, and residuals has one value per point
+        of pos, nan where the data is nan.
+    """
+    return CoilFieldModel(coilname, amps).fit(pos, b, berr, p0, bounds)
+
+
+class IncrementalCoilFit:
+    def __init__(
+            self,
+            coilname,
+            amps,
+            n_tolerance=None,
+            z0_tolerance=None,
+            min_points=8,
+            stable_fits=5,
+            p0=None,
+            bounds=None
+    ):
+        """
+        Fit of a scan that is updated every time a point is measured. Every fit starts from the parameters of the
+        previous one, so it usually takes only a couple of iterations. Pass it to get_pos_b() to stop the scan once the
+        errors of n and z0 are below the tolerances.
+
+        Parameters
+        ----------
+        coilname : {'small1', 'small2', 'medium1', 'medium2', 'large1', 'large2'}
+        amps : float
+            current through the coil.
+        n_tolerance : float, None
+            largest error (one standard deviation) of n for the fit to be converged. None to not check n.
+        z0_tolerance : float, None
+            largest error of z0 in steps for the fit to be converged. None to not check z0.
+        min_points : int
+            no fit is made with fewer points. With only a few points the covariance is not reliable.
+        stable_fits : int
+            the fit is only converged if n and z0 of the last stable_fits fits are also within the tolerances of each
+            other. The errors of the fit only include the noise of the readings, so this guards against stopping while
+            the parameters still drift because of errors of the model.
+        p0 : tuple of float, None
+            initial n and z0 of the first fit. If None, check CoilFieldModel.fit().
+        bounds : tuple, None
+            check CoilFieldModel.fit().
+        """
+        self.model = CoilFieldModel(coilname, amps)
+        self.n_tolerance = n_tolerance
+        self.z0_tolerance = z0_tolerance
+        self.min_points = max(min_points, 3)
+        self.popt = None
+        self.pcov = None
+        self.fits = 0
+        self.stable_fits = max(stable_fits, 1)
+        self._history = []
+        self._p0 = p0
+        self._bounds = bounds
+        self._points = GrowableArray(capacity=256, columns=3)
+
+    def add(self, pos, b, berr=None):
+        """
+        Add a point and update the fit. If the fit fails, the previous parameters are kept.
+
+        Parameters
+        ----------
+        pos : float
+            position in steps.
+        b : float
+            field in gauss.
+        berr : float, None
+            standard error of b. Used to weight the fit.
+        """
+        self._points.append((pos, b, np.nan if berr is None else berr))
+        if len(self._points) < self.min_points:
+            return
+
+        data = self._points.data
+        p0 = self.popt if self.popt is not None else self._p0
+        try:
+            self.popt, self.pcov, _ = self.model.fit(data[:, 0], data[:, 1], data[:, 2], p0, self._bounds)
+        except (RuntimeError, ValueError):
+            return
+        self.fits += 1
+        self._history = (self._history + [self.popt])[-self.stable_fits:]
+
+    @property
+    def errors(self):
+        """
+        Standard deviations of n and z0. inf before the first fit.
+        """
+        if self.pcov is None:
+            return np.array([np.inf, np.inf])
+        errors = np.sqrt(np.abs(np.diag(self.pcov)))
+        return np.where(np.isfinite(errors), errors, np.inf)
+
+    def is_converged(self):
+        """
+        Returns
+        -------
+        bool
+            True if at least one tolerance is set, and the errors and the spread of the last stable_fits fits are below
+            all the tolerances that are set.
+        """
+        if self.n_tolerance is None and self.z0_tolerance is None:
+            return False
+        if len(self._history) < self.stable_fits:
+            return False
+        n_err, z0_err = self.errors
+        n_spread, z0_spread = np.ptp(self._history, axis=0)
+        return (self.n_tolerance is None or max(n_err, n_spread) <= self.n_tolerance) and \
+            (self.z0_tolerance is None or max(z0_err, z0_spread) <= self.z0_tolerance)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __repr__(self):
+        if self.popt is None:
+            return 'IncrementalCoilFit(' + str(len(self)) + ' points, no fit)'
+        n_err, z0_err = self.errors
+        return 'IncrementalCoilFit(' + str(len(self)) + ' points, n = ' + str(round(self.popt[0], 4)) + ' +- ' + \
+            str(round(n_err, 4)) + ', z0 = ' + str(round(self.popt[1], 1)) + ' +- ' + str(round(z0_err, 1)) + ')'
+
+
+# ======================================================================================================================
+# Batch analysis
+# ======================================================================================================================
+SUMMARY_COLUMNS = (
+    'file', 'coilname', 'timestamp', 'amps', 'points', 'n', 'z0', 'var_n', 'var_z0', 'cov_n_z0', 'rms', 'status'
+)
+
+
+def _fit_run(args):
+    """
+    Load and fit a single scan. Runs in a worker process.
+
+    Returns
+    -------
+    dictionary
+        one row of the summary table.
+    """
+    path, p0, bounds, weighted = args
+    f = load_coil_file(path)
+    m = f.metadata
+    row = {
+        'file': path, 'coilname': m.get('coilname'), 'timestamp': m.get('timestamp'), 'amps': m.get('amps'),
+        'points': len(f), 'n': np.nan, 'z0': np.nan, 'var_n': np.nan, 'var_z0': np.nan, 'cov_n_z0': np.nan,
+        'rms': np.nan, 'status': 'ok'
+    }
+    if not m.get('amps'):
+        row['status'] = 'no current'
+        return row
+
+    try:
+        berr = f['berr'] if weighted and 'berr' in f.columns else None
+        popt, pcov, residuals = fit_coil_field(f['pos'], f['b'], m['coilname'], m['amps'], p0, bounds, berr)
+    except (ValueError, RuntimeError) as e:
+        row['status'] = str(e).replace(',', ';').splitlines()[0]
+        return row
+
+    row['n'], row['z0'] = popt
+    row['var_n'], row['var_z0'], row['cov_n_z0'] = pcov[0, 0], pcov[1, 1], pcov[0, 1]
+    row['rms'] = np.sqrt(np.nanmean(residuals**2))
+    return row
+
+
+def fit_coil_runs(
+        root='data_coils',
+        pattern='**/*.txt',
+        out='data_coils/fit_summary.csv',
+        p0=None,
+        bounds=None,
+        weighted=True,
+        processes=None
+):
+    """
+    Fit every scan under root with fit_coil_field(), in parallel on all the CPU cores, and write a summary table with
+    one line per scan. Scans without a current in the header are listed with the status 'no current'.
+
+    Parameters
+    ----------
+    root : str
+    pattern : str
+        glob pattern relative to root, check coil_data.load_coil_dataset().
+    out : str, None
+        file for the summary table, as comma separated values. None to not write it.
+    p0 : tuple of float, None
+        initial n and z0 for every scan. None estimates them from every scan.
+    bounds : tuple, None
+        check fit_coil_field().
+    weighted : bool
+        If True, scans with a berr column are weighted by it.
+    processes : int, None
+        number of worker processes. None uses all the cores. 1 runs everything in the current process.
+
+    Returns
+    -------
+    dictionary of str: list
+        one list per column of SUMMARY_COLUMNS, one value per scan.
+    """
+    paths = [f.path for f in load_coil_dataset(root, pattern)]
+    tasks = [(path, p0, bounds, weighted) for path in paths]
+
+    workers = processes if processes is not None else os.cpu_count() or 1
+    if workers == 1 or len(tasks) < 2:
+        rows = list(map(_fit_run, tasks))
+    else:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as executor:
+            rows = list(executor.map(_fit_run, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+
+    table = {c: [row[c] for row in rows] for c in SUMMARY_COLUMNS}
+    if out is not None:
+        write_fit_summary(table, out)
+    return table
+
+
+def write_fit_summary(table, filename):
+    with open(filename, 'w') as file:
+        file.write(','.join(SUMMARY_COLUMNS) + '\n')
+        for i in range(len(table['file'])):
+            file.write(','.join(str(table[c][i]) for c in SUMMARY_COLUMNS) + '\n')
+
+
+def summarize_by_coil(table):
+    """
+    Average the fits of every coil, weighting every scan by the inverse of the variance of n. z0 is not averaged: it is
+    measured from the origin of the probe, which is not the same in every scan. Scans without a coilname are skipped.
+
+    Returns
+    -------
+    dictionary of str: tuple
+        coilname: (number of fitted scans, n, error of n, mean residual rms)
+    """
+    summary = {}
+    for coil in sorted(set(c for c in table['coilname'] if c is not None)):
+        rows = [i for i, c in enumerate(table['coilname']) if c == coil and table['status'][i] == 'ok']
+        if not rows:
+            continue
+        n, var_n, rms = (np.asarray([table[c][i] for i in rows], dtype=float) for c in ('n', 'var_n', 'rms'))
+        w_n = 1 / np.maximum(var_n, 1e-300)
+        summary[coil] = (len(rows), np.sum(w_n * n) / np.sum(w_n), np.sqrt(1 / np.sum(w_n)), np.mean(rms))
+    return summary
+
+
+def main():
+    table = fit_coil_runs()
+    for i in range(len(table['file'])):
+        print(table['file'][i], table['status'][i], round(table['n'][i], 3), round(table['z0'][i], 1),
+              round(table['rms'][i], 5))
+    for coil, (runs, n, n_err, rms) in summarize_by_coil(table).items():
+        print(coil, runs, 'scans: n =', round(n, 3), '+-', round(n_err, 3), ', rms =', round(rms, 5))
+
+
+if __name__ == '__main__':
+    main()
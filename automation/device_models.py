@@ -3,7 +3,11 @@ Created on Thursday, April 7, 2022
 @author: Sebastian Miki-Silva
 """
 import numpy as np
+import re
 import serial
+import socket
+import struct
+import threading
 import time
 from serial import Serial
 from sys import platform
@@ -16,6 +20,7 @@ except ModuleNotFoundError:
 
 
 try:
+    from acquisition import average_readings, GrowableArray, run_in_background, RunningStats
     from connection_type import SocketEthernetDevice
     from device_type import PowerSupply
     try:
@@ -28,6 +33,7 @@ try:
         pass
 
 except ModuleNotFoundError:
+    from automation.acquisition import average_readings, GrowableArray, run_in_background, RunningStats
     from automation.connection_type import SocketEthernetDevice
     from automation.device_type import PowerSupply
     try:
@@ -61,6 +67,7 @@ class Gm3:
             stopbits=1,
             timeout=tmout
         )
+        self.zero_offset = 0.0
 
         self.flush_buffer()
 
@@ -133,8 +140,39 @@ class Gm3:
     def flush_buffer(self):
         self._ser.write(bytes.fromhex('FF' * 6))
 
-    def autozero(self):
-        pass
+    def autozero(self, n=10):
+        """
+        Software zero. The GM3 has no zero command, so n readings are averaged with the coil off and their average is
+        subtracted from every later get_zfield(). Coil scans only do it with software_zero=True, and write the offset
+        to the header of the file.
+
+        Parameters
+        ----------
+        n : int
+            number of readings to average.
+
+        Returns
+        -------
+        True, or str
+            error message if the field could not be measured.
+        """
+        self.zero_offset = 0.0
+        out, sem, taken = average_readings(self.get_zfield, n, 'mean', 2, None, None, 0.2, time)
+        if not np.isfinite(out):
+            return 'ERROR: field could not be measured. Check connection to gaussmeter.'
+        self.zero_offset = out
+        return True
+
+    def autozero_async(self, n=10):
+        """
+        Same as autozero(), but returns right away. Do not read the gaussmeter until it is done.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            result() waits for the zero and returns the value of autozero().
+        """
+        return run_in_background(self.autozero, n)
 
     def get_datapoint(self):
         """
@@ -163,7 +201,10 @@ class Gm3:
                 return 'ERROR: field could not be measured. Check connection to gaussmeter.'
 
     def get_zfield(self):
-        return self.get_datapoint()[3]
+        out = self.get_datapoint()
+        if isinstance(out, str):
+            return out
+        return out[3] - self.zero_offset
 
     def reset_time(self):
         """
@@ -191,15 +232,26 @@ class Gm3:
             except IndexError:
                 return 'ERROR: field could not be measured. Check connection to gaussmeter.'
 
-    def get_avg_zfield(self, n):
-        sum_ = 0
-        i = 0
-        for i in range(n):
-            sum_ += self.get_zfield()
-            time.sleep(0.2)
-            i += 1
+    def get_avg_zfield(self, n=10, target_sem=None, max_n=None, estimator='mean'):
+        """
+        Average of the z field. Check acquisition.average_readings().
+
+        Parameters
+        ----------
+        n : int
+            number of readings, or smallest number of readings if target_sem is given.
+        target_sem : float, None
+            If given, keep reading until the standard error is at most target_sem gauss, or max_n readings.
+        max_n : int, None
+        estimator : {'mean', 'trimmed', 'median'}
 
-        return abs(sum_ / i)
+        Returns
+        -------
+        tuple of float
+            absolute value of the average, and its standard error.
+        """
+        out, sem, taken = average_readings(self.get_zfield, n, estimator, 2, target_sem, max_n, 0.2, time)
+        return abs(out), sem
 
     @property
     def idn(self):
@@ -221,9 +273,19 @@ class Gm3:
 
 
 class Series9550:
-    def __init__(self, gpib_address):
-        rm = pyvisa.ResourceManager()
+    def __init__(self, gpib_address, resource_manager=None):
+        """
+        Parameters
+        ----------
+        gpib_address : int
+            GPIB address of the gaussmeter.
+        resource_manager : pyvisa.ResourceManager, None
+            If None, a new pyvisa.ResourceManager() is used. Pass an
+            instrument_simulation.SimulatedResourceManager() to run without the meter.
+        """
+        rm = resource_manager if resource_manager is not None else pyvisa.ResourceManager()
         self._inst = rm.open_resource('GPIB0::' + str(gpib_address) + '::INSTR')
+        self._buffer_config = None
         self.clear()
 
     def query(self, qry):
@@ -233,25 +295,137 @@ class Series9550:
     def clear(self):
         self._inst.write('*CLS')
 
-    def autozero(self):
+    def autozero(self, timeout=30, poll_interval=0.5):
+        """
+        Zero the probe, and wait until the meter is done. Check autozero_async().
+
+        Returns
+        -------
+        True, or str
+            error message if the meter did not finish in timeout seconds.
+        """
+        return self.autozero_async(timeout, poll_interval).result()
+
+    def autozero_async(self, timeout=30, poll_interval=0.5):
+        """
+        Start the zero of the probe and return right away, so the scan can set up the motor and the power supply while
+        the meter is busy. The meter is polled with *OPC? until it reports that the zero is done, instead of waiting a
+        fixed 13 s. Do not use the meter until the returned future is done.
+
+        Parameters
+        ----------
+        timeout : float
+            seconds to wait for the meter.
+        poll_interval : float
+            seconds between *OPC? queries that time out or fail.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            result() waits for the zero and returns True, or an error message if the meter did not finish in time.
+        """
         self._inst.write(':SYSTem:AZERo1')
-        time.sleep(13)
+        return run_in_background(self._wait_operation_complete, timeout, poll_interval)
+
+    def _wait_operation_complete(self, timeout, poll_interval):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if self._inst.query('*OPC?').strip() == '1':
+                    return True
+            except (pyvisa.errors.VisaIOError, TimeoutError):  # *OPC? blocks until done, so it can time out
+                self._inst.clear()  # else the late 1 is read as the reply of the next query
+            time.sleep(poll_interval)
+        return 'ERROR: autozero did not finish in ' + str(timeout) + ' s'
 
     def get_zfield(self):
         s = self._inst.query(':MEASure:FLUX1?').split('G')[0]
         return float("".join(s.split()))
 
-    def get_avg_zfield(self, n=10):
-        n += 4
-        f_l = np.asarray([])
-        for i in range(n):
-            f = self.get_zfield()
-            time.sleep(0.2)
-            f_l = np.append(f_l, f)
+    @staticmethod
+    def _parse_readings(reply):
+        """
+        Parse a reply with any number of readings, like '2.2615G,2.2613G,2.2617G', in one pass.
+
+        Returns
+        -------
+        numpy array
+        """
+        numbers = re.findall(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?', "".join(reply.split()))
+        return np.array(numbers, dtype=float)
+
+    def configure_buffer(self, n, binary=False):
+        """
+        Set up the trigger system to take n readings every time it is started with :INITiate, and keep them in the
+        buffer of the meter. Readings are sent as text, or as big endian 32 bit floats in an IEEE 488.2 binary block if
+        binary is True.
+
+        Parameters
+        ----------
+        n : int
+            number of readings.
+        binary : bool
+        """
+        self._inst.write(':TRIGger:SOURce IMMediate')
+        self._inst.write(':TRIGger:COUNt ' + str(int(n)))
+        self._inst.write(':FORMat:DATA ' + ('REAL,32' if binary else 'ASCii'))
+        self._buffer_config = (int(n), binary)
+
+    def get_zfield_buffer(self, n, binary=False):
+        """
+        Take n readings with the trigger system of the meter and fetch them in a single transfer, instead of one
+        :MEASure:FLUX1? query per reading.
+
+        Parameters
+        ----------
+        n : int
+            number of readings.
+        binary : bool
+            If True, the readings are fetched as a binary block, which is smaller and faster to parse than text.
+
+        Returns
+        -------
+        numpy array
+            z field readings in gauss.
+        """
+        if self._buffer_config != (int(n), binary):
+            self.configure_buffer(n, binary)
+        self._inst.write(':INITiate')
+        if binary:
+            return np.asarray(self._inst.query_binary_values(':FETCh:FLUX1?', datatype='f', is_big_endian=True),
+                              dtype=float)
+        return self._parse_readings(self._inst.query(':FETCh:FLUX1?'))
+
+    def get_avg_zfield(self, n=10, target_sem=None, max_n=None, estimator='trimmed', buffered=False, binary=False):
+        """
+        Average of the z field. By default, n + 4 readings are taken and the two lowest and two highest are dropped.
+        Check acquisition.average_readings().
 
-        f_l.sort()
-        out = np.average(f_l[2:-2])
-        mean_std = np.std(f_l[2:-2]) / np.sqrt(n-4)
+        Parameters
+        ----------
+        n : int
+            number of readings to average, or smallest number of readings if target_sem is given.
+        target_sem : float, None
+            If given, keep reading until the standard error is at most target_sem gauss, or max_n readings.
+        max_n : int, None
+        estimator : {'mean', 'trimmed', 'median'}
+        buffered : bool
+            If True, the readings are taken by the meter in blocks with get_zfield_buffer(), without a query and a
+            0.2 s sleep per reading.
+        binary : bool
+            used with buffered. Check get_zfield_buffer().
+
+        Returns
+        -------
+        tuple of float
+            average and its standard error.
+        """
+        if buffered:
+            out, mean_std, taken = average_readings(
+                lambda k: self.get_zfield_buffer(k, binary), n, estimator, 2, target_sem, max_n, block=True
+            )
+        else:
+            out, mean_std, taken = average_readings(self.get_zfield, n, estimator, 2, target_sem, max_n, 0.2, time)
 
         print(round(out, 5), '+-', mean_std)
         return out, mean_std
@@ -1243,7 +1417,7 @@ if platform == 'win32':
             ul.d_out(board_num=self._board_number, port_type=enums.DigitalPortType.AUXPORT, data_value=val)
 
 
-if platform == 'linux' or platform == 'linux2':
+if (platform == 'linux' or platform == 'linux2') and 'MccDeviceLinux' in globals():
     class ETcLinux(MccDeviceLinux):
         def __init__(self, ip4_address, port=54211, default_units='celsius'):
             super().__init__(ip4_address, port, default_units)
@@ -1262,9 +1436,14 @@ class Model8742(SocketEthernetDevice):
             self,
             ip4_address,
             port=23,
-            number_of_channels=4
+            number_of_channels=4,
+            position_tolerance=100,
+            timing_uncertainty=0.05
     ):
         """
+        The targets, velocities, and accelerations sent to the controller are kept, so the position of a moving
+        picomotor can be predicted without a query. Check get_position().
+
         Parameters
         ----------
         ip4_address : str
@@ -1272,13 +1451,23 @@ class Model8742(SocketEthernetDevice):
             Model8742 uses Telnet therefore need to use port 23.
         number_of_channels : int
             number of physical motor channels
-
+        position_tolerance : int
+            largest uncertainty in steps of a predicted position. If the prediction is more uncertain, the position is
+            queried.
+        timing_uncertainty : float
+            seconds between sending a move and the start of the motion, which are not known. The uncertainty of a
+            predicted position is the distance moved in this time.
         """
         SocketEthernetDevice.__init__(self, ip4_address=ip4_address, port=port)
         if self._ip4_address is not None:
             self._socket.recv(4096)  # Receive connection acknowledgement
 
         self._number_of_channels = number_of_channels
+        self.position_tolerance = position_tolerance
+        self.timing_uncertainty = timing_uncertainty
+        self._velocity = {}
+        self._acceleration = {}
+        self._tracks = {}  # channel: (time of the move, start, target, settled)
 
     def _query_(self, qry):
         qry += '\r'
@@ -1301,6 +1490,7 @@ class Model8742(SocketEthernetDevice):
         memory and sets Home (DH) position to 0.
         """
         self._command_('RS')
+        self.clear_cache()
 
     def save_settings(self):
         """
@@ -1319,6 +1509,7 @@ class Model8742(SocketEthernetDevice):
 
     def load_settings(self):
         self._command_('*RCL1')
+        self.clear_cache()
 
     def _reset_factory_settings(self):
         """
@@ -1334,6 +1525,7 @@ class Model8742(SocketEthernetDevice):
         9. Desired Acceleration (see AC command)
         """
         self._command_('*RCL0')
+        self.clear_cache()
 
     def is_motion_done(self, chan):
         """
@@ -1341,7 +1533,13 @@ class Model8742(SocketEthernetDevice):
         :param int chan:
         :return bool:
         """
-        return bool(int(self._query_(str(chan) + 'MD?')))
+        track = self._tracks.get(chan)
+        if track is not None and track[3]:
+            return True
+        done = bool(int(self._query_(str(chan) + 'MD?')))
+        if done:
+            self._settle_([chan])
+        return done
 
     def get_instant_position(self, chan):
         """
@@ -1364,19 +1562,24 @@ class Model8742(SocketEthernetDevice):
     def get_velocity(self, chan):
         """
         get the velocity at which the picomotor will move for any displacement command. Measured in steps per second.
+        Only queried the first time, after that the value sent or received last is used.
         :param chan:
         :return int: steps per second.
         """
-        return int(self._query_(str(chan) + 'VA?'))
+        if chan not in self._velocity:
+            self._velocity[chan] = int(self._query_(str(chan) + 'VA?'))
+        return self._velocity[chan]
 
     def get_acceleration(self, chan):
         """
         get the acceleration at which the picomotor will stop and accelerate from rest. Measured in steps per second
-        per second.
+        per second. Only queried the first time, after that the value sent or received last is used.
         :param int chan:
         :return int: steps per second per second.
         """
-        return int(self._query_(str(chan) + 'AC?'))
+        if chan not in self._acceleration:
+            self._acceleration[chan] = int(self._query_(str(chan) + 'AC?'))
+        return self._acceleration[chan]
 
     def hard_stop_all(self):
         """
@@ -1384,6 +1587,7 @@ class Model8742(SocketEthernetDevice):
         parameter.
         """
         self._command_('AB')
+        self._tracks = {}
 
     def soft_stop(self, chan=''):
         """
@@ -1393,6 +1597,10 @@ class Model8742(SocketEthernetDevice):
         :param int chan:
         """
         self._command_(str(chan) + 'ST')
+        if chan == '':
+            self._tracks = {}
+        else:
+            self._tracks.pop(chan, None)
 
     def set_origin(self, chan):
         """
@@ -1400,6 +1608,7 @@ class Model8742(SocketEthernetDevice):
         :param int chan:
         """
         self._command_(str(chan) + 'DH' + '0')
+        self._tracks.pop(chan, None)
 
     def set_position(self, chan, position):
         """
@@ -1408,6 +1617,8 @@ class Model8742(SocketEthernetDevice):
         :return:
         """
         self._command_(str(chan) + 'PA' + str(position))
+        self._track_(chan, position)
+        self._sleep_until_done_([chan])
         while not self.is_motion_done(chan=chan):
             pass
 
@@ -1418,6 +1629,8 @@ class Model8742(SocketEthernetDevice):
         :return:
         """
         self._command_(str(chan) + 'PR' + str(dis))
+        self._track_(chan, dis, relative=True)
+        self._sleep_until_done_([chan])
         while not self.is_motion_done(chan=chan):
             pass
 
@@ -1442,6 +1655,7 @@ class Model8742(SocketEthernetDevice):
         }
 
         self._command_(str(chan) + 'MV' + str(direct_dict[direction]))
+        self._tracks.pop(chan, None)
 
     def set_velocity(self, chan, vel):
         """
@@ -1449,9 +1663,346 @@ class Model8742(SocketEthernetDevice):
         :param int vel:
         """
         self._command_(str(chan) + 'VA' + str(vel))
+        self._velocity[chan] = int(vel)
+        if chan in self._tracks and not self._tracks[chan][3]:  # the rest of the move can not be predicted
+            self._tracks.pop(chan)
 
     def set_acceleration(self, chan, acc):
         self._command_(str(chan) + 'AC' + str(acc))
+        self._acceleration[chan] = int(acc)
+        if chan in self._tracks and not self._tracks[chan][3]:
+            self._tracks.pop(chan)
+
+    # Position tracking
+    # -----------------
+    @staticmethod
+    def _travelled_(t, distance, velocity, acceleration):
+        """
+        Steps travelled t seconds after the start of a move of distance steps, with a trapezoidal speed profile.
+        """
+        t_acc = velocity / acceleration
+        if distance < velocity * t_acc:  # never reaches full speed
+            t_acc = np.sqrt(distance / acceleration)
+            velocity = acceleration * t_acc
+        d_acc = acceleration * t_acc ** 2 / 2
+        t_flat = (distance - 2 * d_acc) / velocity if velocity else 0
+        if t <= 0:
+            return 0
+        if t < t_acc:
+            return acceleration * t ** 2 / 2
+        if t < t_acc + t_flat:
+            return d_acc + velocity * (t - t_acc)
+        if t < 2 * t_acc + t_flat:
+            return distance - acceleration * (2 * t_acc + t_flat - t) ** 2 / 2
+        return distance
+
+    def _move_time_(self, chan, distance):
+        velocity = self.get_velocity(chan)
+        acceleration = self.get_acceleration(chan)
+        t_acc = velocity / acceleration
+        if distance < velocity * t_acc:
+            return 2 * np.sqrt(distance / acceleration)
+        return distance / velocity + t_acc
+
+    def _track_(self, chan, value, relative=False):
+        """
+        Keep the move just sent to a channel. A relative move is only tracked if the previous target is known. If the
+        start of the move is not known, only the target is kept, so the position is known once the motor stops.
+        """
+        track = self._tracks.get(chan)
+        if relative and track is None:
+            return
+        target = track[2] + int(value) if relative else int(value)
+        start = self.predict_position(chan)[0]
+        self._tracks[chan] = (time.time(), start, target, False)
+
+    def _settle_(self, chans):
+        for chan in chans:
+            if chan in self._tracks:
+                self._tracks[chan] = (time.time(), self._tracks[chan][2], self._tracks[chan][2], True)
+
+    def _end_time_(self, chan):
+        """
+        Time at which the channel has stopped for sure, or None if its motion is not tracked.
+        """
+        track = self._tracks.get(chan)
+        if track is None:
+            return None
+        t0, start, target, settled = track
+        if settled:
+            return t0
+        if start is None:
+            return None
+        return t0 + self._move_time_(chan, abs(target - start)) + self.timing_uncertainty
+
+    def _sleep_until_done_(self, chans):
+        """
+        Sleep until the predicted end of the motion of the channels, so the motion status is only polled when the
+        motors should have stopped.
+        """
+        ends = [self._end_time_(chan) for chan in chans]
+        if ends and all(end is not None for end in ends):
+            wait = max(ends) - self.timing_uncertainty - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+    def predict_position(self, chan):
+        """
+        Predict the position of a channel from the last move sent to it, without a query.
+
+        Parameters
+        ----------
+        chan : int
+
+        Returns
+        -------
+        tuple
+            (position in steps, uncertainty in steps). (None, inf) if the position is not known, e.g. before the first
+            get_position() or after move_indefinetely().
+        """
+        track = self._tracks.get(chan)
+        if track is None:
+            return None, np.inf
+        t0, start, target, settled = track
+        if settled:
+            return target, 0
+        if start is None:
+            return None, np.inf
+        distance = abs(target - start)
+        travelled = self._travelled_(time.time() - t0, distance, self.get_velocity(chan), self.get_acceleration(chan))
+        position = start + (travelled if target > start else -travelled)
+        return int(round(position)), min(self.get_velocity(chan) * self.timing_uncertainty, distance)
+
+    def get_position(self, chan, tolerance=None):
+        """
+        Position of a channel, predicted from the moves sent to it when possible. TP? is only queried if the position
+        is not known, if the uncertainty of the prediction is larger than tolerance, or once after the predicted end of
+        a move to confirm that the motor stopped. After that, the position is known until the next move.
+
+        Parameters
+        ----------
+        chan : int
+        tolerance : int, None
+            largest uncertainty in steps. Defaults to position_tolerance.
+
+        Returns
+        -------
+        int, or str
+            steps from the origin, or an error message.
+        """
+        tolerance = self.position_tolerance if tolerance is None else tolerance
+        track = self._tracks.get(chan)
+        if track is not None and track[3]:
+            return track[2]
+        end = self._end_time_(chan)
+        if end is not None and time.time() < end:
+            position, uncertainty = self.predict_position(chan)
+            if uncertainty <= tolerance:
+                return position
+
+        replies = self._query_line_(str(chan) + 'MD?;' + str(chan) + 'TP?', 2)
+        if isinstance(replies, str):
+            return replies
+        try:
+            done, position = bool(int(replies[0])), int(replies[1])
+        except ValueError:
+            return 'ERROR: could not read the position from ' + str(replies)
+        if done:
+            self._tracks[chan] = (time.time(), position, position, True)
+        return position
+
+    def clear_cache(self):
+        """
+        Forget the tracked positions, velocities, and accelerations, e.g. after the motors were moved from the front
+        panel or by another program. They are queried again when needed.
+        """
+        self._velocity = {}
+        self._acceleration = {}
+        self._tracks = {}
+
+    # Multi-axis motion
+    # -----------------
+    def _send_line_(self, line):
+        """
+        Send a command line without the fixed delays of SocketEthernetDevice._command(). Several commands can be sent
+        in one line, separated by semicolons.
+        """
+        try:
+            self._socket.sendall((line + '\r').encode('utf-8'))
+        except OSError:
+            return 'ERROR: Socket not found. Command not sent. Try using the connect() method first.'
+
+    def _query_line_(self, line, n_replies=1, timeout=5):
+        """
+        Send a command line with n_replies queries, and read until all the replies arrived, instead of waiting a fixed
+        time.
+
+        Returns
+        -------
+        list of str, or str
+            the replies, or an error message.
+        """
+        out = self._send_line_(line)
+        if out is not None:
+            return out
+        deadline = time.time() + timeout
+        reply = b''
+        replies = []
+        try:
+            while len(replies) < n_replies:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError
+                self._socket.settimeout(remaining)
+                data = self._socket.recv(4096)
+                if not data:
+                    raise OSError
+                reply += data
+                if reply.endswith(b'\n'):
+                    replies = [r for r in re.split(r'[;\r\n]+', reply.decode('utf-8')) if r.strip()]
+        except (TimeoutError, socket.timeout):
+            return 'ERROR: No response from device for query ' + line
+        except OSError:
+            return 'ERROR: Query not sent. Try using the connect() method first.'
+        return [r.strip() for r in replies]
+
+    def are_motions_done(self, chans=None):
+        """
+        Motion status of several channels, with one query for all of them: 1MD?;2MD?;...
+
+        Parameters
+        ----------
+        chans : list of int, None
+            channels to check. If None, all the channels.
+
+        Returns
+        -------
+        dictionary of int: bool, or str
+            True for the channels that are not moving, or an error message.
+        """
+        if chans is None:
+            chans = range(1, self._number_of_channels + 1)
+        chans = list(chans)
+        replies = self._query_line_(';'.join(str(c) + 'MD?' for c in chans), len(chans))
+        if isinstance(replies, str):
+            return replies
+        try:
+            return {c: bool(int(r)) for c, r in zip(chans, replies)}
+        except ValueError:
+            return 'ERROR: could not read the motion status from ' + str(replies)
+
+    def wait_motions_done(self, chans=None, timeout=60, min_interval=0.01, max_interval=0.25):
+        """
+        Poll the motion status of all the channels at once until none of them is moving. The poll interval starts at
+        min_interval and doubles after every poll, up to max_interval, so short moves are noticed right away and long
+        moves are not polled needlessly often.
+
+        Parameters
+        ----------
+        chans : list of int, None
+            channels to wait for. If None, all the channels.
+        timeout : float
+            seconds to wait.
+        min_interval : float
+        max_interval : float
+
+        Returns
+        -------
+        True, or str
+            error message if the controller did not answer, or the motors still moved after timeout seconds.
+        """
+        if chans is None:
+            chans = range(1, self._number_of_channels + 1)
+        chans = list(chans)
+        if all(chan in self._tracks and self._tracks[chan][3] for chan in chans):
+            return True
+        deadline = time.time() + timeout
+        self._sleep_until_done_(chans)
+        interval = min_interval
+        while True:
+            done = self.are_motions_done(chans)
+            if isinstance(done, str):
+                return done
+            if all(done.values()):
+                self._settle_(done)
+                return True
+            if time.time() + interval > deadline:
+                return 'ERROR: channels ' + str([c for c in done if not done[c]]) + ' still moving after ' + \
+                    str(timeout) + ' s'
+            time.sleep(interval)
+            interval = min(2 * interval, max_interval)
+
+    def move_axes(self, targets, relative=False, wait=True, timeout=60):
+        """
+        Start the motion of several channels with a single command line, e.g. 1PA100;2PA-50;3PA20, so the channels move
+        at the same time. The move takes as long as the slowest channel, instead of the sum of all of them.
+
+        Parameters
+        ----------
+        targets : dictionary of int: int
+            channel: position in steps with respect to the origin, or displacement in steps if relative is True.
+        relative : bool
+        wait : bool
+            If True, wait with wait_motions_done() until all the channels stopped.
+        timeout : float
+            seconds to wait.
+
+        Returns
+        -------
+        True, None, or str
+            True when the channels stopped, None if wait is False, or an error message.
+        """
+        cmd = 'PR' if relative else 'PA'
+        out = self._send_line_(';'.join(str(c) + cmd + str(int(v)) for c, v in sorted(targets.items())))
+        if out is not None:
+            return out
+        for chan, value in targets.items():
+            self._track_(chan, value, relative)
+        if not wait:
+            return None
+        return self.wait_motions_done(sorted(targets), timeout)
+
+    def set_positions(self, positions, wait=True, timeout=60):
+        """
+        Same as set_position() for several channels at the same time. Check move_axes().
+
+        Parameters
+        ----------
+        positions : dictionary of int: int
+            channel: position in steps.
+        """
+        return self.move_axes(positions, False, wait, timeout)
+
+    def displace_axes(self, displacements, wait=True, timeout=60):
+        """
+        Same as displace() for several channels at the same time. Check move_axes().
+
+        Parameters
+        ----------
+        displacements : dictionary of int: int
+            channel: displacement in steps.
+        """
+        return self.move_axes(displacements, True, wait, timeout)
+
+    def get_instant_positions(self, chans=None):
+        """
+        Instant positions of several channels, with one query for all of them.
+
+        Returns
+        -------
+        dictionary of int: int, or str
+            channel: steps from the origin, or an error message.
+        """
+        if chans is None:
+            chans = range(1, self._number_of_channels + 1)
+        chans = list(chans)
+        replies = self._query_line_(';'.join(str(c) + 'TP?' for c in chans), len(chans))
+        if isinstance(replies, str):
+            return replies
+        try:
+            return {c: int(r) for c, r in zip(chans, replies)}
+        except ValueError:
+            return 'ERROR: could not read the positions from ' + str(replies)
 
     @property
     def idn(self):
@@ -1467,19 +2018,19 @@ class Model8742(SocketEthernetDevice):
 
     @property
     def position_ch1(self):
-        return self.get_instant_position(chan=1)
+        return self.get_position(chan=1)
 
     @property
     def position_ch2(self):
-        return self.get_instant_position(chan=2)
+        return self.get_position(chan=2)
 
     @property
     def position_ch3(self):
-        return self.get_instant_position(chan=3)
+        return self.get_position(chan=3)
 
     @property
     def position_ch4(self):
-        return self.get_instant_position(chan=4)
+        return self.get_position(chan=4)
 
     @property
     def setpoint_position_ch1(self):
@@ -1547,54 +2098,238 @@ class Model8742(SocketEthernetDevice):
 
 
 class Vxm:
-    def __init__(self, port, tmout=10):
-        self._ser = serial.Serial(port=port, baudrate=9600, bytesize=8, parity=serial.PARITY_NONE, stopbits=1,
-                                  timeout=tmout)
+    def __init__(self, port, tmout=10, serial_port=None):
+        """
+        Parameters
+        ----------
+        port : str
+            Device port name. Can be found on device manager. Example: COM3
+        tmout : float
+            read timeout in seconds.
+        serial_port : serial.Serial, None
+            If given, it is used instead of opening port. Pass an instrument_simulation.SimulatedVxm() to run without
+            the controller.
+        """
+        if serial_port is not None:
+            self._ser = serial_port
+        else:
+            self._ser = serial.Serial(port=port, baudrate=9600, bytesize=8, parity=serial.PARITY_NONE, stopbits=1,
+                                      timeout=tmout)
+        self._motion = None
+        self.command_stats = {}
         self.initialize()
 
 
     def _query_(self, qry):
+        """
+        Run qry as a program and wait for the ^ that the controller sends when it is done. The program is cleared
+        right after, instead of after a fixed delay.
+        """
+        self.wait_motion()
+        t0 = time.time()
         qry += ',R'
         self._ser.write(qry.encode('utf-8'))
         out = self._ser.read_until(b'^')
-        time.sleep(0.3)
         self._ser.write('C'.encode('utf-8'))
+        self._record_(qry, time.time() - t0)
         return out
 
     def _command_(self, cmd):
+        self.wait_motion()
+        t0 = time.time()
         self._ser.write(cmd.encode('utf-8'))
-        time.sleep(0.3)
-        self._ser.write('C'.encode('utf-8'))
+        out = self.wait_ready()
+        self._record_(cmd, time.time() - t0)
+        return out
+
+    def _record_(self, cmd, seconds):
+        key = re.match(r'[A-Za-z?]*', cmd).group() or cmd[:1]
+        if key not in self.command_stats:
+            self.command_stats[key] = RunningStats()
+        self.command_stats[key].add(seconds)
+
+    def wait_ready(self, timeout=5, poll_interval=0.01):
+        """
+        Poll the controller with the V status query until it is ready for the next command, instead of waiting a fixed
+        time.
+
+        Parameters
+        ----------
+        timeout : float
+            seconds to wait.
+        poll_interval : float
+            seconds between queries while the controller is busy.
+
+        Returns
+        -------
+        True, or str
+            error message if the controller did not answer, or was still busy after timeout seconds.
+        """
+        deadline = time.time() + timeout
+        while True:
+            self._ser.write('V'.encode('utf-8'))
+            status = self._ser.read(1)
+            while status == b'^':  # end of a program that nobody waited for
+                status = self._ser.read(1)
+            if status == b'R':
+                return True
+            if status == b'':
+                return 'ERROR: no answer from VXM. Check connection to motor controller.'
+            if time.time() >= deadline:
+                return 'ERROR: VXM still busy after ' + str(timeout) + ' s'
+            time.sleep(poll_interval)
 
     def initialize(self):
         """
-        Initialize remote connection to motor controller.
+        Initialize remote connection to motor controller. Waits until the controller answers that it is ready.
+
+        Returns
+        -------
+        True, or str
+            error message if the controller is not ready.
         """
-        self._ser.write('F'.encode('utf-8'))
-        time.sleep(0.1)
+        t0 = time.time()
+        self._ser.write('F'.encode('utf-8'))  # on line, without echo
         self._ser.write('N'.encode('utf-8'))
-        time.sleep(0.1)
-        self._ser.write('C'.encode('utf-8'))
-        time.sleep(0.1)
         self._ser.write('C'.encode('utf-8'))
-        time.sleep(0.1)
+        self._ser.reset_input_buffer()
+        out = self.wait_ready()
+        self._record_('F', time.time() - t0)
+        return out
+
+    def get_command_stats(self):
+        """
+        Time taken by the commands sent so far, including the wait for the controller.
+
+        Returns
+        -------
+        dictionary of str: tuple
+            command letters, like S for set_speed(), IA for set_origin(), or R for the programs of run_program(), and
+            (count, mean, std, min, max) in seconds.
+        """
+        return {key: (st.count, st.mean, st.std, st.min, st.max) for key, st in self.command_stats.items()}
 
     def disconnect(self):
+        self.wait_motion()
         self._ser.write('Q'.encode('utf-8'))
 
+    # Motion programs
+    # ---------------
+    @staticmethod
+    def _index_commands_(channel, steps, max_steps=10000):
+        """
+        Index commands for a displacement, split in equal parts of at most max_steps, like displace() always did.
+        """
+        parts = -(-abs(steps) // max_steps) if steps else 1
+        size, extra = divmod(abs(steps), parts)
+        sign = -1 if steps < 0 else 1
+        return ['I' + str(channel) + 'M' + str(sign * (size + (i < extra))) for i in range(parts)]
+
+    def _wait_program_(self, timeout):
+        t0 = time.time()
+        deadline = t0 + timeout
+        out = b''
+        while not out.endswith(b'^'):
+            if time.time() >= deadline:
+                return 'ERROR: motion did not finish in ' + str(timeout) + ' s'
+            out += self._ser.read_until(b'^')
+        self._ser.write('C'.encode('utf-8'))  # the program stays in the buffer until it is cleared
+        self._record_('R', time.time() - t0)
+        return out
+
+    def run_program(self, commands, timeout=300):
+        """
+        Upload a program to the program buffer of the controller in a single write, run it, and return right away.
+        The caller can measure while the motors move. Any other command waits for the program to end.
+
+        Parameters
+        ----------
+        commands : list of str
+            program commands, e.g. ['I1M400', 'P10', 'I1M-400'] to move 400 steps, wait 1 s, and come back.
+        timeout : float
+            seconds to wait for the program to end.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            result() waits for the program and returns b'^', or an error message after timeout seconds.
+        """
+        self.wait_motion()
+        self._ser.write(('C,' + ','.join(commands) + ',R').encode('utf-8'))
+        self._motion = run_in_background(self._wait_program_, timeout)
+        return self._motion
+
+    def wait_motion(self):
+        """
+        Wait for the program started by run_program(), if any.
+
+        Returns
+        -------
+        bytes, str, or None
+            b'^', an error message, or None if no program was running.
+        """
+        motion, self._motion = self._motion, None
+        if motion is None:
+            return None
+        return motion.result()
+
+    def is_moving(self):
+        return self._motion is not None and not self._motion.done()
+
+    def displace_async(self, channel, steps):
+        """
+        Same as displace(), but returns right away. Check run_program().
+
+        Returns
+        -------
+        concurrent.futures.Future
+        """
+        return self.run_program(self._index_commands_(channel, steps))
+
+    def displace_sequence_async(self, channel, displacements, pause=0):
+        """
+        Upload several displacements as one program, so the motor does not wait for the computer between them.
+
+        Parameters
+        ----------
+        channel : int
+            motor channel.
+        displacements : list of int
+            steps of every displacement.
+        pause : float
+            seconds to wait after every displacement. The controller rounds it to tenths of a second.
+
+        Returns
+        -------
+        concurrent.futures.Future
+        """
+        commands = []
+        for steps in displacements:
+            commands += self._index_commands_(channel, steps)
+            if pause:
+                commands.append('P' + str(int(round(pause * 10))))
+        return self.run_program(commands)
+
+    def set_position_async(self, channel, pos):
+        """
+        Same as set_position(), but returns right away. Check run_program().
+
+        Returns
+        -------
+        concurrent.futures.Future
+        """
+        return self.run_program(['IA' + str(channel) + 'M' + str(pos)])
+
     def displace(self, channel, steps):
         """
         displace the slide a number of steps with respect to its standing position. If the number of steps to
-        dispalce is larger than 10000, the displacement will be done in two motions.
+        dispalce is larger than 10000, the displacement is split in equal parts, uploaded as a single program.
         :param int channel: motor channel.
         :param int steps: steps to displace
         :return str: return '^' when the motor has completed the motion
         """
-        if abs(steps) > 10000:
-            self.displace(channel, steps//2)
-            return self.displace(channel, steps - steps//2)
-        else:
-            return self._query_('I' + str(channel) + 'M' + str(steps))
+        self.displace_async(channel, steps)
+        return self.wait_motion()
 
     def set_position(self, channel, pos):
         """
@@ -1603,7 +2338,8 @@ class Vxm:
         :param int pos: final position with respect to the origin
         :return str: return '^' when the motor has completed the motion
         """
-        return self._query_('IA' + str(channel) + 'M' + str(pos))
+        self.set_position_async(channel, pos)
+        return self.wait_motion()
 
     def set_origin(self, channel):
         """
@@ -1635,6 +2371,7 @@ class Vxm:
         return self._query_('A' + str(channel) + 'M' + str(acc))
 
     def get_negative_limit_switch(self):
+        self.wait_motion()
         self._ser.write('?'.encode('utf-8'))
         return bool(ord(self._ser.read(1).decode('utf-8')) & 0b00000010)
 
@@ -2209,11 +2946,11 @@ class Srs100:
 
         self._serial_port.write('SC1\r'.encode('utf-8'))
         time.sleep(0.3)
-        out = np.asarray([])
+        out = np.empty(n_points)
         for i in range(n_points):
             raw = self._serial_port.read(4)
             int_10 = self._translate_to_decimal(raw)
-            out = np.append(out, int_10)
+            out[i] = int_10
 
         return out*(1e-13)/self.get_partial_sensitivity_factor()  # convert raw units to Torr
 
@@ -2253,11 +2990,11 @@ class Srs100:
 
         self._serial_port.write('HS1\r'.encode('utf-8'))
         time.sleep(0.3)
-        out = np.asarray([])
+        out = np.empty(n_points)
         for i in range(n_points):
             raw = self._serial_port.read(4)  # receive each data point individually.
             int_10 = self._translate_to_decimal(raw)
-            out = np.append(out, int_10)
+            out[i] = int_10
 
         return out*(1e-13)/self.get_partial_sensitivity_factor()  # convert raw units to Torr
 
@@ -2314,4 +3051,750 @@ class Srs100:
 
 # Eliptec motor
 class ELL14K:
-    pass
\ No newline at end of file
+    STATUS_MESSAGES = {
+        0: 'OK, no error',
+        1: 'Communication time out',
+        2: 'Mechanical time out',
+        3: 'Command error or not supported',
+        4: 'Value out of range',
+        5: 'Module isolated',
+        6: 'Module out of isolation',
+        7: 'Initializing error',
+        8: 'Thermal error',
+        9: 'Busy',
+        10: 'Sensor error',
+        11: 'Motor error',
+        12: 'Out of range',
+        13: 'Over current error',
+    }
+
+    def __init__(self, port, addresses='0', tmout=2, serial_port=None):
+        """
+        Thorlabs ELL14K rotation mounts on an Elliptec bus. Several mounts can share the serial port, each one with
+        its own address. Angles are in degrees.
+
+        Every command is a packet: the address, two lower case letters, and the data as upper case hex digits, e.g.
+        0ma00008C00. Every reply is the address, two upper case letters, the data, and CR LF. Moves are answered with
+        the position once the mount stopped.
+
+        Parameters
+        ----------
+        port : str
+            Device port name. Can be found on device manager. Example: COM3
+        addresses : str
+            address of every mount on the bus, one character 0-9 or A-F each, e.g. '012'.
+        tmout : float
+            read timeout in seconds.
+        serial_port : serial.Serial, None
+            If given, it is used instead of opening port. Pass an instrument_simulation.SimulatedEll14k() to run without
+            the mounts.
+        """
+        if serial_port is not None:
+            self._ser = serial_port
+        else:
+            self._ser = serial.Serial(port=port, baudrate=9600, bytesize=8, parity=serial.PARITY_NONE, stopbits=1,
+                                      timeout=tmout)
+        self.addresses = addresses.upper()
+        self._motion = None
+        self._pulses_per_rev = {}
+        for address in self.addresses:
+            info = self.get_info(address)
+            self._pulses_per_rev[address] = info['pulses_per_rev'] if isinstance(info, dict) else 143360
+
+    # Packets
+    # -------
+    @staticmethod
+    def _to_hex_(value, digits=8):
+        return '{:0{}X}'.format(int(value) & (16 ** digits - 1), digits)
+
+    @staticmethod
+    def _from_hex_(text):
+        """
+        signed 32 bit integer from 8 hex digits.
+        """
+        value = int(text, 16)
+        return value - 2 ** 32 if len(text) == 8 and value >= 2 ** 31 else value
+
+    @staticmethod
+    def _parse_packet_(raw):
+        """
+        Parameters
+        ----------
+        raw : bytes
+            a reply, e.g. b'0PO00008C00\\r\\n'.
+
+        Returns
+        -------
+        tuple, or str
+            (address, command, data), or an error message if the reply is not a complete packet.
+        """
+        match = re.match(rb'([0-9A-F])([A-Z]{2})([0-9A-F]*)\r\n$', raw)
+        if match is None:
+            return 'ERROR: no valid reply from ELL14K: ' + str(raw)
+        return match.group(1).decode(), match.group(2).decode(), match.group(3).decode()
+
+    def _address_(self, address):
+        return self.addresses[0] if address is None else str(address).upper()
+
+    def _send_(self, address, cmd, data=''):
+        self._ser.write((address + cmd + data).encode('utf-8'))
+
+    def _read_packet_(self):
+        return self._parse_packet_(self._ser.read_until(b'\n'))
+
+    def _query_(self, address, cmd, data=''):
+        """
+        Send a packet and read the reply of the same mount.
+
+        Returns
+        -------
+        tuple, or str
+            (command, data) of the reply, or an error message.
+        """
+        self.wait_motion()
+        address = self._address_(address)
+        self._send_(address, cmd, data)
+        while True:
+            packet = self._read_packet_()
+            if isinstance(packet, str):
+                return packet
+            if packet[0] == address:
+                return packet[1], packet[2]
+
+    def _to_pulses_(self, address, degrees):
+        return int(round(degrees * self._pulses_per_rev.get(address, 143360) / 360))
+
+    def _to_degrees_(self, address, pulses):
+        return pulses * 360 / self._pulses_per_rev.get(address, 143360)
+
+    # Information and status
+    # ----------------------
+    def get_info(self, address=None):
+        """
+        Returns
+        -------
+        dictionary, or str
+            type, serial, year, firmware, travel in degrees, and pulses_per_rev of the mount, or an error message.
+        """
+        reply = self._query_(address, 'in')
+        if isinstance(reply, str):
+            return reply
+        cmd, data = reply
+        if cmd != 'IN' or len(data) < 30:
+            return 'ERROR: unexpected reply to in: ' + cmd + data
+        return {
+            'type': int(data[0:2], 16),
+            'serial': data[2:10],
+            'year': data[10:14],
+            'firmware': data[14:16],
+            'travel': int(data[18:22], 16),
+            'pulses_per_rev': int(data[22:30], 16),
+        }
+
+    def get_status(self, address=None):
+        """
+        Returns
+        -------
+        int, or str
+            status code, check STATUS_MESSAGES, or an error message.
+        """
+        reply = self._query_(address, 'gs')
+        if isinstance(reply, str):
+            return reply
+        return int(reply[1], 16) if reply[0] == 'GS' else 'ERROR: unexpected reply to gs: ' + reply[0] + reply[1]
+
+    def get_position(self, address=None):
+        """
+        Returns
+        -------
+        float, or str
+            angle in degrees, or an error message.
+        """
+        address = self._address_(address)
+        reply = self._query_(address, 'gp')
+        if isinstance(reply, str):
+            return reply
+        if reply[0] != 'PO':
+            return 'ERROR: ' + self._status_error_(reply)
+        return self._to_degrees_(address, self._from_hex_(reply[1]))
+
+    def get_positions(self, addresses=None):
+        """
+        Position of every mount on the bus, in one sweep: one gp packet per mount, each answered before the next is
+        sent, without delays.
+
+        Returns
+        -------
+        dictionary of str: float
+            address: angle in degrees, or an error message.
+        """
+        return {a: self.get_position(a) for a in (self.addresses if addresses is None else addresses.upper())}
+
+    def get_statuses(self, addresses=None):
+        """
+        Status code of every mount on the bus, in one sweep.
+
+        Returns
+        -------
+        dictionary of str: int
+        """
+        return {a: self.get_status(a) for a in (self.addresses if addresses is None else addresses.upper())}
+
+    def _status_error_(self, reply):
+        cmd, data = reply
+        if cmd == 'GS':
+            return self.STATUS_MESSAGES.get(int(data, 16), 'unknown status ' + data)
+        return 'unexpected reply ' + cmd + data
+
+    # Settings
+    # --------
+    def get_velocity(self, address=None):
+        """
+        Returns
+        -------
+        int, or str
+            velocity in percent of the maximum, or an error message.
+        """
+        reply = self._query_(address, 'gv')
+        if isinstance(reply, str):
+            return reply
+        return int(reply[1], 16) if reply[0] == 'GV' else 'ERROR: ' + self._status_error_(reply)
+
+    def set_velocity(self, percent, address=None):
+        """
+        Parameters
+        ----------
+        percent : int
+            velocity in percent of the maximum.
+        """
+        reply = self._query_(address, 'sv', self._to_hex_(percent, 2))
+        if isinstance(reply, str):
+            return reply
+        if reply != ('GS', '00'):
+            return 'ERROR: ' + self._status_error_(reply)
+
+    def get_jog_step(self, address=None):
+        """
+        Returns
+        -------
+        float, or str
+            degrees moved by jog_forward() and jog_backward(), or an error message.
+        """
+        address = self._address_(address)
+        reply = self._query_(address, 'gj')
+        if isinstance(reply, str):
+            return reply
+        if reply[0] != 'GJ':
+            return 'ERROR: ' + self._status_error_(reply)
+        return self._to_degrees_(address, self._from_hex_(reply[1]))
+
+    def set_jog_step(self, degrees, address=None):
+        address = self._address_(address)
+        reply = self._query_(address, 'sj', self._to_hex_(self._to_pulses_(address, degrees)))
+        if isinstance(reply, str):
+            return reply
+        if reply != ('GS', '00'):
+            return 'ERROR: ' + self._status_error_(reply)
+
+    # Motion
+    # ------
+    def _wait_moves_(self, addresses, timeout):
+        """
+        Read the replies of the moving mounts until all of them answered with their position.
+
+        Returns
+        -------
+        dictionary of str: float
+            address: final angle in degrees, or an error message.
+        """
+        deadline = time.time() + timeout
+        out = {}
+        while len(out) < len(addresses):
+            if time.time() >= deadline:
+                for a in addresses:
+                    out.setdefault(a, 'ERROR: ELL14K ' + a + ' did not finish the move in ' + str(timeout) + ' s')
+                break
+            packet = self._read_packet_()
+            if isinstance(packet, str):
+                continue  # nothing yet
+            address, cmd, data = packet
+            if address not in addresses or address in out:
+                continue
+            if cmd == 'PO':
+                out[address] = self._to_degrees_(address, self._from_hex_(data))
+            elif cmd == 'GS' and int(data, 16) not in (0, 9):
+                out[address] = 'ERROR: ' + self.STATUS_MESSAGES.get(int(data, 16), 'unknown status ' + data)
+        return out
+
+    def _start_moves_(self, packets, timeout):
+        """
+        Send one move packet per mount, back to back, so the mounts move at the same time.
+
+        Parameters
+        ----------
+        packets : dictionary of str: tuple
+            address: (command, data).
+
+        Returns
+        -------
+        concurrent.futures.Future
+            result() waits for all the mounts and returns a dictionary of address: final angle, or error message.
+        """
+        self.wait_motion()
+        for address, (cmd, data) in packets.items():
+            self._send_(address, cmd, data)
+        self._motion = run_in_background(self._wait_moves_, ''.join(packets), timeout)
+        return self._motion
+
+    def wait_motion(self):
+        """
+        Wait for the moves started by the async methods, if any.
+
+        Returns
+        -------
+        dictionary of str: float, or None
+            address: final angle in degrees, or error message. None if nothing was moving.
+        """
+        motion, self._motion = self._motion, None
+        if motion is None:
+            return None
+        return motion.result()
+
+    def is_moving(self):
+        return self._motion is not None and not self._motion.done()
+
+    def move_absolute_async(self, angles, timeout=30):
+        """
+        Start moving several mounts to absolute angles and return right away.
+
+        Parameters
+        ----------
+        angles : dictionary of str: float
+            address: angle in degrees.
+        timeout : float
+            seconds to wait for the mounts.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            result() returns a dictionary of address: final angle, or error message.
+        """
+        packets = {}
+        for address, degrees in angles.items():
+            address = self._address_(address)
+            packets[address] = ('ma', self._to_hex_(self._to_pulses_(address, degrees)))
+        return self._start_moves_(packets, timeout)
+
+    def move_relative_async(self, angles, timeout=30):
+        """
+        Same as move_absolute_async(), with angles relative to the current position.
+        """
+        packets = {}
+        for address, degrees in angles.items():
+            address = self._address_(address)
+            packets[address] = ('mr', self._to_hex_(self._to_pulses_(address, degrees)))
+        return self._start_moves_(packets, timeout)
+
+    def home_async(self, addresses=None, clockwise=True, timeout=30):
+        """
+        Start homing the mounts and return right away.
+
+        Returns
+        -------
+        concurrent.futures.Future
+        """
+        addresses = self.addresses if addresses is None else addresses.upper()
+        return self._start_moves_({a: ('ho', '0' if clockwise else '1') for a in addresses}, timeout)
+
+    def move_absolute(self, degrees, address=None):
+        """
+        Returns
+        -------
+        float, or str
+            final angle in degrees, or an error message.
+        """
+        address = self._address_(address)
+        self.move_absolute_async({address: degrees})
+        return self.wait_motion()[address]
+
+    def move_relative(self, degrees, address=None):
+        """
+        Returns
+        -------
+        float, or str
+            final angle in degrees, or an error message.
+        """
+        address = self._address_(address)
+        self.move_relative_async({address: degrees})
+        return self.wait_motion()[address]
+
+    def home(self, address=None, clockwise=True):
+        """
+        Returns
+        -------
+        float, or str
+            angle after homing, or an error message.
+        """
+        address = self._address_(address)
+        self.home_async(address, clockwise)
+        return self.wait_motion()[address]
+
+    def jog_forward(self, address=None):
+        """
+        Move forward by the jog step. Check set_jog_step().
+
+        Returns
+        -------
+        float, or str
+            final angle in degrees, or an error message.
+        """
+        address = self._address_(address)
+        self._start_moves_({address: ('fw', '')}, 30)
+        return self.wait_motion()[address]
+
+    def jog_backward(self, address=None):
+        address = self._address_(address)
+        self._start_moves_({address: ('bw', '')}, 30)
+        return self.wait_motion()[address]
+
+    def disconnect(self):
+        self.wait_motion()
+        self._ser.close()
+
+    @property
+    def idn(self):
+        return 'Thorlabs ELL14K rotation mounts, addresses ' + ', '.join(self.addresses)
+
+
+# ======================================================================================================================
+# Turbomolecular pump
+# ======================================================================================================================
+class Turbovac:
+    # USS telegram: STX, LGE, ADR, PKE, reserved, IND, PWE, PZD1-PZD6, BCC. 24 bytes, big endian
+    _TELEGRAM = struct.Struct('>BBBHBBI6HB')
+    _STX = 0x02
+    _LGE = 22
+
+    # control word bits
+    _START = 0x0001
+    _RESET_ERROR = 0x0080
+    _CONTROL_VALID = 0x0400  # without it, the pump ignores the control word
+
+    STATUS_BITS = {
+        0: 'frequency reached',
+        2: 'operation enabled',
+        3: 'error',
+        4: 'accelerating',
+        5: 'decelerating',
+        7: 'warning',
+    }
+    PARAMETERS = {
+        3: 'frequency (Hz)',
+        4: 'intermediate circuit voltage (0.1 V)',
+        5: 'motor current (0.1 A)',
+        7: 'motor temperature (C)',
+        11: 'converter temperature (C)',
+    }
+
+    def __init__(self, port, address=0, tmout=1, serial_port=None):
+        """
+        Leybold TURBOVAC i pump, through the USS protocol on its RS485 port.
+
+        Every exchange is a 24 byte telegram and a 24 byte reply. The telegram carries a parameter request (PKE, IND,
+        PWE) and the process data (PZD), of which only the control word is used. The reply carries the parameter
+        value, the status word, the frequency, the converter temperature, the motor current, and the intermediate
+        circuit voltage, so every exchange also updates the status. BCC, the last byte, is the XOR of the others. The
+        parity bit of every byte is added by the serial port.
+
+        Parameters
+        ----------
+        port : str
+            Device port name. Can be found on device manager. Example: COM3
+        address : int
+            USS address of the pump, 0-31.
+        tmout : float
+            read timeout in seconds.
+        serial_port : serial.Serial, None
+            If given, it is used instead of opening port. Pass an instrument_simulation.SimulatedTurbovac() to run
+            without the pump.
+        """
+        if serial_port is not None:
+            self._ser = serial_port
+        else:
+            self._ser = serial.Serial(port=port, baudrate=19200, bytesize=8, parity=serial.PARITY_EVEN, stopbits=1,
+                                      timeout=tmout, write_timeout=1)
+        self.address = address
+        self._control = 0
+        self._frames = {}
+        self._lock = threading.Lock()
+        self._poller = None
+        self._polling = False
+        self._readings_lock = threading.Lock()  # the poller appends while get_readings() copies
+        self.readings = GrowableArray(capacity=1024, columns=6)
+        self.status = None
+
+    # Telegrams
+    # ---------
+    @staticmethod
+    def _bcc_(data):
+        bcc = 0
+        for b in data:
+            bcc ^= b
+        return bcc
+
+    def encode(self, ak=0, number=0, index=0, value=0):
+        """
+        Parameters
+        ----------
+        ak : int
+            request: 0 none, 1 read a parameter, 2 write a 16 bit value, 3 write a 32 bit value.
+        number : int
+            parameter number, 0-2047.
+        index : int
+            index of array parameters.
+        value : int
+            value to write.
+
+        Returns
+        -------
+        bytes
+            the telegram, with the current control word.
+        """
+        frame = bytearray(self._TELEGRAM.pack(self._STX, self._LGE, self.address, (ak << 12) | (number & 0x7FF), 0,
+                                              index, value & 0xFFFFFFFF, self._control, 0, 0, 0, 0, 0, 0))
+        frame[-1] = self._bcc_(frame[:-1])
+        return bytes(frame)
+
+    def _frame_(self, ak=0, number=0, index=0):
+        """
+        Telegram without a value, from the cache. Reads and status requests are the same bytes every time, unless the
+        control word changes.
+        """
+        key = (ak, number, index, self._control)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = self.encode(ak, number, index)
+        return frame
+
+    def decode(self, reply):
+        """
+        Parameters
+        ----------
+        reply : bytes
+            24 byte reply of the pump.
+
+        Returns
+        -------
+        dictionary, or str
+            ak, number, index, value, and the status. Error message if the reply is incomplete or corrupted.
+        """
+        if len(reply) != self._TELEGRAM.size:
+            return 'ERROR: no answer from Turbovac. Got ' + str(len(reply)) + ' of 24 bytes.'
+        if self._bcc_(reply):  # the XOR of all the bytes, BCC included, is 0 for a good telegram
+            return 'ERROR: wrong checksum in the answer of Turbovac'
+        stx, lge, adr, pke, _, ind, pwe, zsw, freq, temp, current, _, voltage, _ = self._TELEGRAM.unpack(reply)
+        if stx != self._STX or lge != self._LGE or adr != self.address:
+            return 'ERROR: no valid reply from Turbovac: ' + str(reply)
+        return {
+            'ak': pke >> 12,
+            'number': pke & 0x7FF,
+            'index': ind,
+            'value': pwe,
+            'status_word': zsw,
+            'frequency': freq,
+            'temperature': temp,
+            'current': current / 10,
+            'voltage': voltage / 10,
+        }
+
+    def _exchange_(self, frame):
+        with self._lock:
+            self._ser.reset_input_buffer()
+            self._ser.write(frame)
+            reply = self.decode(self._ser.read(self._TELEGRAM.size))
+        if isinstance(reply, str):
+            return reply
+        status = {key: reply[key] for key in ('status_word', 'frequency', 'temperature', 'current', 'voltage')}
+        status['time'] = time.time()
+        with self._readings_lock:
+            self.status = status
+        return reply
+
+    def _parameter_reply_(self, reply, number):
+        if isinstance(reply, str):
+            return reply
+        if reply['ak'] == 7:
+            return 'ERROR: Turbovac cannot execute the request for parameter ' + str(number) + '. Error number ' + \
+                str(reply['value'])
+        if reply['ak'] == 8:
+            return 'ERROR: no permission to write parameter ' + str(number)
+        if reply['number'] != number:
+            return 'ERROR: Turbovac answered for parameter ' + str(reply['number']) + ' instead of ' + str(number)
+        return reply['value'] & 0xFFFF if reply['ak'] == 1 else reply['value']
+
+    # Parameters
+    # ----------
+    def get_parameter(self, number, index=0):
+        """
+        Parameters
+        ----------
+        number : int
+            parameter number, check Turbovac.PARAMETERS and the manual of the pump.
+        index : int
+
+        Returns
+        -------
+        int, or str
+            value of the parameter, or an error message.
+        """
+        return self._parameter_reply_(self._exchange_(self._frame_(1, number, index)), number)
+
+    def set_parameter(self, number, value, index=0, long=False):
+        """
+        Parameters
+        ----------
+        number : int
+        value : int
+        index : int
+        long : bool
+            If True, the value is written as 32 bits. Else, as 16 bits.
+
+        Returns
+        -------
+        True, or str
+            error message if the pump refused the value.
+        """
+        out = self._parameter_reply_(self._exchange_(self.encode(3 if long else 2, number, index, value)), number)
+        return out if isinstance(out, str) else True
+
+    # Status
+    # ------
+    def get_status(self):
+        """
+        Exchange a telegram without a parameter request.
+
+        Returns
+        -------
+        dictionary, or str
+            status_word, frequency in Hz, temperature of the converter in C, current in A, voltage in V, and the time
+            of the reply. Error message if the pump did not answer.
+        """
+        out = self._exchange_(self._frame_())
+        return out if isinstance(out, str) else self.status
+
+    def get_status_flags(self, status_word=None):
+        """
+        Returns
+        -------
+        list of str
+            names of the bits of the status word that are set, check Turbovac.STATUS_BITS.
+        """
+        if status_word is None:
+            status = self.get_status()
+            if isinstance(status, str):
+                return status
+            status_word = status['status_word']
+        return [name for bit, name in self.STATUS_BITS.items() if status_word & (1 << bit)]
+
+    def get_frequency(self):
+        status = self.get_status()
+        return status if isinstance(status, str) else status['frequency']
+
+    def get_temperature(self):
+        status = self.get_status()
+        return status if isinstance(status, str) else status['temperature']
+
+    def get_current(self):
+        status = self.get_status()
+        return status if isinstance(status, str) else status['current']
+
+    def get_voltage(self):
+        status = self.get_status()
+        return status if isinstance(status, str) else status['voltage']
+
+    def get_motor_temperature(self):
+        return self.get_parameter(7)
+
+    # Control
+    # -------
+    def _control_(self, control):
+        self._control = control
+        out = self.get_status()
+        return out if isinstance(out, str) else True
+
+    def start_pump(self):
+        """
+        Returns
+        -------
+        True, or str
+            error message if the pump did not answer.
+        """
+        return self._control_(self._CONTROL_VALID | self._START)
+
+    def stop_pump(self):
+        return self._control_(self._CONTROL_VALID)
+
+    def reset_error(self):
+        """
+        Send the reset bit once, then go back to the previous control word.
+        """
+        control = self._control
+        out = self._control_(self._CONTROL_VALID | self._RESET_ERROR | (control & self._START))
+        self._control = control
+        return out
+
+    # Polling
+    # -------
+    def _poll_(self, interval, callback):
+        while self._polling:
+            t0 = time.time()
+            status = self.get_status()
+            if not isinstance(status, str):
+                with self._readings_lock:
+                    self.readings.append((status['time'], status['frequency'], status['temperature'],
+                                          status['current'], status['voltage'], status['status_word']))
+                if callback is not None:
+                    callback(status)
+            time.sleep(max(interval - (time.time() - t0), 0))
+
+    def start_polling(self, interval=1.0, callback=None):
+        """
+        Read the status every interval seconds in a background thread, and append it to readings. Parameters can be
+        read and written while polling, the telegrams take turns on the port.
+
+        Parameters
+        ----------
+        interval : float
+            seconds between status telegrams.
+        callback : callable, None
+            called with every status dictionary, e.g. to stop the pump if it gets too hot.
+        """
+        self.stop_polling()
+        self._polling = True
+        self._poller = threading.Thread(target=self._poll_, args=(interval, callback), daemon=True)
+        self._poller.start()
+
+    def stop_polling(self):
+        self._polling = False
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+
+    def get_readings(self):
+        """
+        Returns
+        -------
+        numpy array
+            one row per status read by the poller: time, frequency in Hz, temperature in C, current in A, voltage in V,
+            and status word.
+        """
+        with self._readings_lock:
+            return self.readings.to_array()
+
+    def disconnect(self):
+        self.stop_polling()
+        self._ser.close()
+
+    @property
+    def idn(self):
+        return 'Leybold TURBOVAC, USS address ' + str(self.address)
@@ -1111,7 +1111,7 @@ if platform == 'win32':
             return self.get_temp(channel_n=7)
 
 
-if platform == 'linux' or platform == 'linux2':
+if (platform == 'linux' or platform == 'linux2') and 'DaqDevice' in globals():  # uldaq might not be installed
     class MccDeviceLinux(DaqDevice):
         def __init__(
                 self,
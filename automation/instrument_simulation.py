@@ -0,0 +1,872 @@
+"""
+Simulated instruments. SimulatedResourceManager can be passed to the drivers in device_models.py that take a
+resource_manager, instead of a pyvisa.ResourceManager(), the simulated serial instruments to the drivers that take a
+serial_port, and the drivers of ethernet instruments can connect to the simulated servers, so the drivers, the averaging, and the scans can be tested and benchmarked on any computer. The
+instruments answer the same commands as the real ones, with latency and noise. Everything waits on a clock, which can
+be the time module or a VirtualClock from oven_simulation.py to run faster than real time.
+"""
+import functools
+import operator
+import re
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+try:
+    import device_models
+except ModuleNotFoundError:
+    import automation.device_models as device_models
+
+
+class SimulatedSeries9550:
+    def __init__(
+            self,
+            field=2.2615,
+            noise=0.0005,
+            offset=0.003,
+            resolution=0.0001,
+            query_time=0.03,
+            reading_time=0.01,
+            byte_time=2e-6,
+            autozero_time=12.0,
+            clock=time,
+            seed=None,
+            idn='F.W.BELL,MODEL 9550,V1.1;'
+    ):
+        """
+        A F.W. Bell 9550 gaussmeter behind a GPIB interface. Answers the commands used by device_models.Series9550:
+
+            *IDN?, *CLS, *GTL, *OPC?, :SYSTem:AZERo1, :MEASure:FLUX1?, :TRIGger:SOURce, :TRIGger:COUNt,
+            :FORMat:DATA, :INITiate, :FETCh:FLUX1?, :SYSTem:ERRor?
+
+    *OPC? answers 1 once the meter is not busy. Like a VISA resource, a query that would wait for more than timeout
+    milliseconds raises TimeoutError after timeout milliseconds. The 1 is still sent when the meter is done, and is
+    read as the reply of the next query, unless clear() is called.
+
+        Commands that it does not know are added to the error queue, like a SCPI instrument would.
+
+        Parameters
+        ----------
+        field : float or callable
+            z field in gauss, or a function with no arguments that returns it, e.g. from the position of a simulated
+            probe.
+        noise : float
+            standard deviation of the readings in gauss.
+        offset : float
+            zero offset of the probe in gauss. Removed by :SYSTem:AZERo1.
+        resolution : float
+            readings are rounded to this many gauss.
+        query_time : float
+            seconds for a GPIB command and reply, without the data.
+        reading_time : float
+            seconds for the meter to take a reading.
+        byte_time : float
+            seconds per byte of reply.
+        autozero_time : float
+            seconds that the meter is busy after :SYSTem:AZERo1.
+        clock : module or object with time() and sleep(seconds)
+        seed : int, None
+            seed of the noise.
+        idn : str
+        """
+        self._field = field
+        self.noise = noise
+        self.offset = offset
+        self.resolution = resolution
+        self.query_time = query_time
+        self.reading_time = reading_time
+        self.byte_time = byte_time
+        self.autozero_time = autozero_time
+        self._clock = clock
+        self._rng = np.random.default_rng(seed)
+        self._idn = idn
+        self.timeout = 2000
+
+        self._busy_until = 0.0
+        self._count = 1
+        self._format = 'ASC'
+        self._buffer = np.zeros(0)
+        self._errors = []
+        self._output = []  # replies of queries that timed out, read by the next queries
+        self.queries = 0
+        self.readings = 0
+
+    def _wait(self, seconds):
+        now = self._clock.time()
+        wait = max(self._busy_until - now, 0) + seconds
+        if wait > 0:
+            self._clock.sleep(wait)
+
+    def _take_readings(self, n):
+        field = self._field() if callable(self._field) else self._field
+        values = field + self.offset + self._rng.normal(0, self.noise, n)
+        self.readings += n
+        self._wait(self.reading_time * n)
+        return np.round(values / self.resolution) * self.resolution
+
+    @staticmethod
+    def _format_reading(value):
+        return '{:.4f}G'.format(value)
+
+    def _reply(self, text):
+        self._wait(len(text) * self.byte_time)
+        self._output.append(text + '\n')
+        return self._output.pop(0)
+
+    def write(self, cmd):
+        cmd = cmd.strip()
+        self._wait(self.query_time / 2)
+        upper = cmd.upper()
+        if upper in ('*CLS', '*GTL'):
+            self._errors = []
+        elif upper == ':SYSTEM:AZERO1':
+            self.offset = 0.0
+            self._busy_until = self._clock.time() + self.autozero_time
+        elif upper.startswith(':TRIGGER:SOURCE'):
+            pass
+        elif upper.startswith(':TRIGGER:COUNT'):
+            try:
+                self._count = max(int(cmd.split()[1]), 1)
+            except (IndexError, ValueError):
+                self._errors.append('-224,"Illegal parameter value"')
+        elif upper.startswith(':FORMAT:DATA'):
+            self._format = 'REAL' if 'REAL' in upper else 'ASC'
+        elif upper == ':INITIATE':
+            self._buffer = self._take_readings(self._count)
+        else:
+            self._errors.append('-113,"Undefined header"')
+        return len(cmd)
+
+    def read(self):
+        return self._reply('')
+
+    def query(self, cmd):
+        cmd = cmd.strip()
+        self.queries += 1
+        upper = cmd.upper()
+        if upper == '*OPC?' and self._busy_until - self._clock.time() + self.query_time > self.timeout / 1000:
+            self._clock.sleep(self.timeout / 1000)
+            self._output.append('1\n')  # sent once the meter is done, and read as the reply of the next query
+            raise TimeoutError('VI_ERROR_TMO: timeout expired before operation completed')
+        self._wait(self.query_time)  # every query waits until the meter is not busy
+        if upper == '*IDN?':
+            return self._reply(self._idn)
+        if upper == '*OPC?':
+            return self._reply('1')
+        if upper == ':MEASURE:FLUX1?':
+            return self._reply(' ' + self._format_reading(self._take_readings(1)[0]))
+        if upper == ':FETCH:FLUX1?':
+            return self._reply(','.join(self._format_reading(v) for v in self._buffer))
+        if upper == ':SYSTEM:ERROR?':
+            return self._reply(self._errors.pop(0) if self._errors else '0,"No error"')
+        self._errors.append('-113,"Undefined header"')
+        return self._reply('')
+
+    def clear(self):
+        """
+        Device clear, like pyvisa: drops the replies waiting in the output queue.
+        """
+        self._output = []
+
+    def query_binary_values(self, cmd, datatype='f', is_big_endian=False, container=list):
+        """
+        Same as pyvisa: the reply is an IEEE 488.2 definite length block, #<digits><length><data>.
+        """
+        cmd = cmd.strip()
+        self.queries += 1
+        self._wait(self.query_time)
+        if cmd.upper() != ':FETCH:FLUX1?' or self._format != 'REAL':
+            self._errors.append('-113,"Undefined header"')
+            return container([])
+
+        dtype = ('>' if is_big_endian else '<') + datatype
+        data = np.asarray(self._buffer, dtype=dtype).tobytes()
+        header = '#' + str(len(str(len(data)))) + str(len(data))
+        block = header.encode() + data + b'\n'
+        self._wait(len(block) * self.byte_time)
+
+        length = int(block[2:2 + int(block[1:2])])  # parsed like pyvisa does
+        start = 2 + int(block[1:2])
+        values = struct.unpack(('>' if is_big_endian else '<') + datatype * (length // struct.calcsize(datatype)),
+                               block[start:start + length])
+        return container(values)
+
+    def close(self):
+        pass
+
+
+class SimulatedResourceManager:
+    def __init__(self, instruments=None):
+        """
+        Stand in for pyvisa.ResourceManager(). Pass it as the resource_manager of a driver.
+
+        Parameters
+        ----------
+        instruments : dictionary of str: instrument, None
+            resource name, like 'GPIB0::15::INSTR', and the simulated instrument to return for it. Any other GPIB
+            resource opens a new SimulatedSeries9550 with the default settings.
+        """
+        self._instruments = dict(instruments) if instruments is not None else {}
+
+    def list_resources(self, query='?*::INSTR'):
+        return tuple(self._instruments)
+
+    def open_resource(self, resource_name, **kwargs):
+        if resource_name not in self._instruments:
+            if not resource_name.startswith('GPIB'):
+                raise ValueError('no simulated instrument for ' + resource_name)
+            self._instruments[resource_name] = SimulatedSeries9550()
+        return self._instruments[resource_name]
+
+    def close(self):
+        pass
+
+
+class _SimulatedSerial:
+    def __init__(self, byte_time, timeout, clock):
+        """
+        Reply buffer of a simulated serial instrument. Bytes are sent at a time, and can be read once that time is
+        reached, with read() and read_until() like serial.Serial.
+        """
+        self.byte_time = byte_time
+        self.timeout = timeout
+        self._clock = clock
+        self._out = []  # (time at which the byte can be read, byte)
+        self._lock = threading.Lock()
+
+    def _send(self, t, text):
+        data = text if isinstance(text, bytes) else text.encode('utf-8')
+        duration = len(data) * self.byte_time
+        overlap = [b for b, c in self._out if t < b <= t + duration]
+        while overlap:  # the line is sending another reply, wait for it to end
+            t = max(overlap)
+            overlap = [b for b, c in self._out if t < b <= t + duration]
+        for i, c in enumerate(data):
+            self._out.append((t + (i + 1) * self.byte_time, bytes([c])))
+        self._out.sort(key=lambda x: x[0])
+
+    def _read(self, end):
+        """
+        Wait for the bytes sent by the controller until end(bytes) returns how many of them to read, or until the
+        timeout, like serial.Serial does.
+        """
+        deadline = self._clock.time() + self.timeout
+        while True:
+            now = self._clock.time()
+            with self._lock:
+                available = b''.join(c for t, c in self._out if t <= now)
+                n = end(available)
+                pending = [t for t, c in self._out if t > now]
+                if n is not None:
+                    del self._out[:n]
+                    return available[:n]
+            if not pending or min(pending) > deadline:
+                self._clock.sleep(max(deadline - now, 0))
+                with self._lock:
+                    del self._out[:len(available)]
+                return available
+            self._clock.sleep(min(pending) - now)
+
+    def read(self, size=1):
+        return self._read(lambda b: size if len(b) >= size else None)
+
+    def read_until(self, expected=b'\n', size=None):
+        def end(b):
+            i = b.find(expected)
+            return i + len(expected) if i >= 0 else None
+        return self._read(end)
+
+    def reset_input_buffer(self):
+        now = self._clock.time()
+        with self._lock:
+            self._out = [(t, c) for t, c in self._out if t > now]
+
+    def close(self):
+        pass
+
+
+class SimulatedVxm(_SimulatedSerial):
+    def __init__(
+            self,
+            speed=2000,
+            acceleration=2,
+            byte_time=1 / 960,
+            command_time=0.005,
+            timeout=10,
+            clock=time
+    ):
+        """
+        A Velmex VXM motor controller behind a serial port. Can be passed as the serial_port of device_models.Vxm.
+        Answers the commands used by the driver:
+
+            F, Q, N, C, R, K, V, ?, and the program commands ImMx, IAmMx, IAmM-0, SmMx, AmMx, Px
+
+        Program commands are stored in the program buffer, separated by commas, and run by R. The controller sends ^
+        when the program ends. Moves have a trapezoidal speed profile.
+
+        Parameters
+        ----------
+        speed : int
+            steps per second of both motors until it is changed with SmMx.
+        acceleration : int
+            1 <= int <= 127. In units of 4000 steps per second squared, until it is changed with AmMx.
+        byte_time : float
+            seconds per byte sent or received. 9600 baud by default.
+        command_time : float
+            seconds that the controller takes for a command that does not move a motor.
+        timeout : float
+            read timeout in seconds, like the timeout of serial.Serial.
+        clock : module or object with time() and sleep(seconds)
+        """
+        _SimulatedSerial.__init__(self, byte_time, timeout, clock)
+        self.speed = {1: speed, 2: speed}
+        self.acceleration = {1: acceleration, 2: acceleration}
+        self.command_time = command_time
+
+        self.positions = {1: 0, 2: 0}
+        self.online = False
+        self._program = []
+        self._busy_until = 0.0
+        self.writes = 0
+        self.programs = 0
+        self.errors = []
+
+    def move_time(self, channel, steps):
+        """
+        Returns
+        -------
+        float
+            seconds that the motor takes to move steps, starting and ending at rest.
+        """
+        d = abs(steps)
+        v = self.speed[channel]
+        a = 4000 * self.acceleration[channel]
+        if d * a < v ** 2:  # never reaches full speed
+            return 2 * np.sqrt(d / a)
+        return d / v + v / a
+
+    def _run_program(self, start):
+        t = start
+        for cmd in self._program:
+            index = re.match(r'I(A?)([12])M(-?\d+)$', cmd)
+            setting = re.match(r'([SA])([12])M(\d+)$', cmd)
+            pause = re.match(r'P(\d+)$', cmd)
+            if index:
+                channel = int(index.group(2))
+                if index.group(1) and index.group(3) == '-0':  # set the current position as the origin
+                    self.positions[channel] = 0
+                    t += self.command_time
+                    continue
+                steps = int(index.group(3))
+                if index.group(1):
+                    steps -= self.positions[channel]
+                self.positions[channel] += steps
+                t += self.move_time(channel, steps)
+            elif setting:
+                values = self.speed if setting.group(1) == 'S' else self.acceleration
+                values[int(setting.group(2))] = int(setting.group(3))
+                t += self.command_time
+            elif pause:
+                t += int(pause.group(1)) / 10
+            else:
+                self.errors.append(cmd)
+        return t
+
+    def write(self, data):
+        text = data.decode('utf-8') if isinstance(data, bytes) else data
+        self.writes += 1
+        self._clock.sleep(len(text) * self.byte_time)
+        now = self._clock.time()
+        with self._lock:
+            for cmd in [c.strip() for c in text.split(',') if c.strip()]:
+                upper = cmd.upper()
+                if upper == 'F':
+                    self.online = True
+                elif upper == 'Q':
+                    self.online = False
+                elif upper == 'N':
+                    self.positions = {1: 0, 2: 0}
+                elif upper == 'C':
+                    self._program = []
+                elif upper == 'K':
+                    self._program = []
+                    self._busy_until = now
+                elif upper == 'R':
+                    self.programs += 1
+                    self._busy_until = self._run_program(max(now, self._busy_until))
+                    self._send(self._busy_until, '^')
+                elif upper == 'V':
+                    self._send(now, 'B' if now < self._busy_until else 'R')
+                elif upper == '?':
+                    self._send(now, '0')
+                else:
+                    self._program.append(upper)
+        return len(text)
+
+
+class SimulatedModel8742:
+    def __init__(
+            self,
+            velocity=2000,
+            acceleration=100000,
+            number_of_channels=4,
+            reply_time=0.002,
+            host='127.0.0.1',
+            port=0,
+            idn='New_Focus 8742 v2.2 08/01/13 12345'
+    ):
+        """
+        A Newport 8742 picomotor controller, served on a TCP port of this computer. Connect a device_models.Model8742
+        to host and port once start() was called. Answers the commands used by the driver, one or several per line,
+        separated by semicolons:
+
+            *IDN?, xxMD?, xxTP?, xxPA?, xxVA?, xxAC?, xxPAnn, xxPRnn, xxVAnn, xxACnn, xxDHnn, xxST, AB
+
+        The replies to the queries of a line are sent in one line, separated by semicolons. Every channel moves on its
+        own with a trapezoidal speed profile, so several channels can move at the same time. Runs in real time.
+
+        Parameters
+        ----------
+        velocity : int
+            steps per second of all the channels until it is changed with xxVAnn.
+        acceleration : int
+            steps per second squared of all the channels until it is changed with xxACnn.
+        number_of_channels : int
+        reply_time : float
+            seconds that the controller takes to answer a line.
+        host : str
+        port : int
+            0 picks a free port. Check the port attribute after start().
+        idn : str
+        """
+        self.velocity = {c: velocity for c in range(1, number_of_channels + 1)}
+        self.acceleration = {c: acceleration for c in range(1, number_of_channels + 1)}
+        self.reply_time = reply_time
+        self.host = host
+        self.port = port
+        self._idn = idn
+        self._moves = {c: (0.0, 0, 0) for c in range(1, number_of_channels + 1)}  # (start time, start, target)
+        self._lock = threading.Lock()
+        self._server = None
+        self.lines = 0
+        self.errors = []
+
+    def position(self, chan):
+        """
+        Returns
+        -------
+        int
+            instant position of the channel in steps.
+        """
+        t0, start, target = self._moves[chan]
+        distance = abs(target - start)
+        t = time.time() - t0
+        v, a = self.velocity[chan], self.acceleration[chan]
+        t_acc = v / a
+        if distance < v * t_acc:  # never reaches full speed
+            t_acc = np.sqrt(distance / a)
+            v = a * t_acc
+        t_flat = (distance - a * t_acc ** 2) / v if v else 0
+        if t >= 2 * t_acc + t_flat:
+            return target
+        if t < t_acc:
+            moved = a * t ** 2 / 2
+        elif t < t_acc + t_flat:
+            moved = a * t_acc ** 2 / 2 + v * (t - t_acc)
+        else:
+            moved = distance - a * (2 * t_acc + t_flat - t) ** 2 / 2
+        moved = int(moved)
+        return start + (moved if target > start else -moved)
+
+    def _move(self, chan, target):
+        self._moves[chan] = (time.time(), self.position(chan), int(target))
+
+    def execute(self, line):
+        """
+        Run a command line, and return the replies to its queries, or None if it has no queries.
+        """
+        replies = []
+        with self._lock:
+            self.lines += 1
+            for cmd in [c.strip() for c in line.split(';') if c.strip()]:
+                if cmd.upper() == '*IDN?':
+                    replies.append(self._idn)
+                    continue
+                match = re.match(r'(\d*)([A-Za-z]{2})(\?|[-+]?\d*)$', cmd)
+                if match is None:
+                    self.errors.append(cmd)
+                    continue
+                chan = int(match.group(1)) if match.group(1) else None
+                name, arg = match.group(2).upper(), match.group(3)
+                if chan is not None and chan not in self._moves:
+                    self.errors.append(cmd)
+                elif name == 'AB':
+                    for c in self._moves:
+                        self._move(c, self.position(c))
+                elif name == 'ST':
+                    for c in ([chan] if chan is not None else self._moves):
+                        self._move(c, self.position(c))
+                elif chan is None:
+                    self.errors.append(cmd)
+                elif arg == '?':
+                    values = {
+                        'MD': int(self.position(chan) == self._moves[chan][2]),
+                        'TP': self.position(chan),
+                        'PA': self._moves[chan][2],
+                        'VA': self.velocity[chan],
+                        'AC': self.acceleration[chan],
+                    }
+                    if name in values:
+                        replies.append(str(values[name]))
+                    else:
+                        self.errors.append(cmd)
+                elif name == 'PA':
+                    self._move(chan, int(arg))
+                elif name == 'PR':
+                    self._move(chan, self._moves[chan][2] + int(arg))
+                elif name == 'VA':
+                    self._move(chan, self._moves[chan][2])  # the move goes on from here at the new velocity
+                    self.velocity[chan] = int(arg)
+                elif name == 'AC':
+                    self._move(chan, self._moves[chan][2])
+                    self.acceleration[chan] = int(arg)
+                elif name == 'DH':
+                    offset = int(arg or 0) - self.position(chan)
+                    t0, start, target = self._moves[chan]
+                    self._moves[chan] = (t0, start + offset, target + offset)
+                else:
+                    self.errors.append(cmd)
+        return ';'.join(replies) if replies else None
+
+    def _serve(self, server):
+        while True:
+            try:
+                conn, address = server.accept()
+            except OSError:  # closed by stop()
+                return
+            conn.sendall(b'\xff\xfd\x03')  # telnet negotiation, received by Model8742.__init__()
+            data = b''
+            while True:
+                try:
+                    chunk = conn.recv(4096)
+                except OSError:
+                    break
+                if not chunk:
+                    break
+                data += chunk
+                while b'\r' in data:
+                    line, data = data.split(b'\r', 1)
+                    reply = self.execute(line.decode('utf-8').strip())
+                    if reply is not None:
+                        time.sleep(self.reply_time)
+                        conn.sendall((reply + '\r\n').encode('utf-8'))
+            conn.close()
+
+    def start(self):
+        """
+        Start serving in a background thread.
+
+        Returns
+        -------
+        tuple
+            (host, port)
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen(1)
+        self.port = server.getsockname()[1]
+        self._server = server
+        threading.Thread(target=self._serve, args=(server,), daemon=True).start()
+        return self.host, self.port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+
+class SimulatedEll14k(_SimulatedSerial):
+    def __init__(
+            self,
+            addresses='0',
+            speed=430.0,
+            pulses_per_rev=143360,
+            byte_time=1 / 960,
+            reply_time=0.002,
+            timeout=2,
+            clock=time
+    ):
+        """
+        Thorlabs ELL14K rotation mounts on one Elliptec serial bus. Can be passed as the serial_port of
+        device_models.ELL14K. Every write is one packet, and the mount with its address answers:
+
+            in, gs, gp, gv, gj, ho, ma, mr, fw, bw, sv, sj
+
+        Moves reply with the position once the mount stopped. A mount that is moving answers GS09 (busy) to anything
+        but gs and gp, and unknown commands are answered with GS03.
+
+        Parameters
+        ----------
+        addresses : str
+            one character 0-9 or A-F per mount.
+        speed : float
+            degrees per second at 100 % velocity.
+        pulses_per_rev : int
+            encoder pulses per revolution, reported by in.
+        byte_time : float
+            seconds per byte sent or received. 9600 baud by default.
+        reply_time : float
+            seconds that a mount takes to answer.
+        timeout : float
+            read timeout in seconds, like the timeout of serial.Serial.
+        clock : module or object with time() and sleep(seconds)
+        """
+        _SimulatedSerial.__init__(self, byte_time, timeout, clock)
+        self.speed = speed
+        self.pulses_per_rev = pulses_per_rev
+        self.reply_time = reply_time
+        self.mounts = {a: {'start': 0, 'target': 0, 't0': 0.0, 't1': 0.0, 'velocity': 100, 'jog': pulses_per_rev // 8}
+                       for a in addresses.upper()}
+        self.writes = 0
+        self.errors = []
+
+    def position(self, address):
+        """
+        Returns
+        -------
+        int
+            instant position of a mount in pulses.
+        """
+        m = self.mounts[address]
+        now = self._clock.time()
+        if now >= m['t1']:
+            return m['target']
+        return int(m['start'] + (m['target'] - m['start']) * (now - m['t0']) / (m['t1'] - m['t0']))
+
+    def _move(self, address, target, now):
+        m = self.mounts[address]
+        start = self.position(address)
+        pulses_per_second = self.speed * m['velocity'] / 100 * self.pulses_per_rev / 360
+        m.update(start=start, target=target, t0=now, t1=now + 0.05 + abs(target - start) / pulses_per_second)
+        return m['t1']
+
+    @staticmethod
+    def _hex(value, digits=8):
+        return '{:0{}X}'.format(value & (16 ** digits - 1), digits)
+
+    @staticmethod
+    def _signed(text):
+        value = int(text, 16)
+        return value - 2 ** 32 if value >= 2 ** 31 else value
+
+    def _execute(self, address, cmd, data, now):
+        m = self.mounts[address]
+        t = now + self.reply_time
+        busy = now < m['t1']
+        if cmd == 'gs':
+            return t, 'GS' + ('09' if busy else '00')
+        if cmd == 'gp':
+            return t, 'PO' + self._hex(self.position(address))
+        if busy:
+            return t, 'GS09'
+        if cmd == 'in':
+            return t, 'IN' + '0E' + '11400123' + '2022' + '17' + '00' + '0168' + self._hex(self.pulses_per_rev)
+        if cmd == 'gv':
+            return t, 'GV' + self._hex(m['velocity'], 2)
+        if cmd == 'gj':
+            return t, 'GJ' + self._hex(m['jog'])
+        if cmd == 'sv' and len(data) == 2:
+            m['velocity'] = min(max(int(data, 16), 1), 100)
+            return t, 'GS00'
+        if cmd == 'sj' and len(data) == 8:
+            m['jog'] = self._signed(data)
+            return t, 'GS00'
+        if cmd == 'ho':
+            return self._move(address, 0, now), 'PO' + self._hex(0)
+        if cmd in ('ma', 'mr') and len(data) == 8:
+            target = self._signed(data) + (m['target'] if cmd == 'mr' else 0)
+            return self._move(address, target, now), 'PO' + self._hex(target)
+        if cmd in ('fw', 'bw'):
+            target = m['target'] + (m['jog'] if cmd == 'fw' else -m['jog'])
+            return self._move(address, target, now), 'PO' + self._hex(target)
+        self.errors.append(address + cmd + data)
+        return t, 'GS03'
+
+    def write(self, data):
+        text = data.decode('utf-8') if isinstance(data, bytes) else data
+        self.writes += 1
+        self._clock.sleep(len(text) * self.byte_time)
+        now = self._clock.time()
+        packet = re.match(r'([0-9A-Fa-f])([a-z]{2})([0-9A-F]*)$', text.strip())
+        if packet is None or packet.group(1).upper() not in self.mounts:
+            return len(text)  # nobody on the bus answers
+        address, cmd, data = packet.group(1).upper(), packet.group(2), packet.group(3)
+        with self._lock:
+            t, reply = self._execute(address, cmd, data, now)
+            self._send(t, address + reply + '\r\n')
+        return len(text)
+
+
+class SimulatedTurbovac(_SimulatedSerial):
+    _TELEGRAM = struct.Struct('>BBBHBBI6HB')
+
+    def __init__(
+            self,
+            address=0,
+            nominal_frequency=1000.0,
+            acceleration=5.0,
+            deceleration=2.0,
+            byte_time=11 / 19200,
+            reply_time=0.005,
+            timeout=1,
+            clock=time
+    ):
+        """
+        A Leybold TURBOVAC i pump behind its RS485 port. Can be passed as the serial_port of device_models.Turbovac.
+        Every write is one 24 byte USS telegram, and the pump answers with a 24 byte reply. Telegrams for other
+        addresses, or with a wrong checksum, are not answered, like on a real bus.
+
+        The pump reads and writes any parameter in parameters, and answers with error 0 (no such parameter) for the
+        others. Parameters 3, 4, 5, 7, and 11 follow the state of the pump. The rotor accelerates while bit 0 of the
+        control word is set, and coasts down when it is not. The control word is only used if its bit 10 is set. Set error to True to simulate a fault, which is cleared by bit 7
+        of the control word.
+
+        Parameters
+        ----------
+        address : int
+        nominal_frequency : float
+            rotor frequency in Hz at full speed.
+        acceleration, deceleration : float
+            Hz per second.
+        byte_time : float
+            seconds per byte sent or received. 19200 baud, with start, parity, and stop bits, by default.
+        reply_time : float
+            seconds that the pump takes to answer.
+        timeout : float
+            read timeout in seconds, like the timeout of serial.Serial.
+        clock : module or object with time() and sleep(seconds)
+        """
+        _SimulatedSerial.__init__(self, byte_time, timeout, clock)
+        self.address = address
+        self.nominal_frequency = nominal_frequency
+        self.acceleration = acceleration
+        self.deceleration = deceleration
+        self.reply_time = reply_time
+        self.parameters = {1: 350, 150: 0, 171: 0}
+        self.running = False
+        self.error = False
+        self._f0 = 0.0
+        self._t0 = clock.time()
+        self.writes = 0
+        self.errors = []
+
+    def frequency(self):
+        """
+        Returns
+        -------
+        float
+            rotor frequency in Hz.
+        """
+        dt = self._clock.time() - self._t0
+        if self.running:
+            return min(self._f0 + self.acceleration * dt, self.nominal_frequency)
+        return max(self._f0 - self.deceleration * dt, 0.0)
+
+    def _set_running(self, running):
+        if running != self.running:
+            self._f0 = self.frequency()
+            self._t0 = self._clock.time()
+            self.running = running
+
+    def _process_data(self):
+        f = self.frequency()
+        accelerating = self.running and f < self.nominal_frequency
+        current = 2.5 if accelerating else 0.3 + 0.5 * f / self.nominal_frequency
+        temperature = 25 + 15 * f / self.nominal_frequency
+        status = (f >= self.nominal_frequency) | (self.running << 2) | (self.error << 3) | (accelerating << 4) | \
+            ((not self.running and f > 0) << 5)
+        return {3: int(f), 4: 240, 5: int(round(current * 10)), 7: int(temperature) + 5, 11: int(temperature)}, status
+
+    def _execute(self, ak, number, value):
+        """
+        Returns
+        -------
+        tuple of int
+            (reply ak, value).
+        """
+        measured = self._process_data()[0]
+        if ak == 0:
+            return 0, 0
+        if number in measured:
+            return (1, measured[number]) if ak == 1 else (8, 0)
+        if number not in self.parameters:
+            self.errors.append((ak, number))
+            return 7, 0
+        if ak in (2, 3):
+            self.parameters[number] = value & (0xFFFF if ak == 2 else 0xFFFFFFFF)
+        if ak in (1, 2, 3):
+            value = self.parameters[number]
+            return (1 if value <= 0xFFFF else 2), value  # answered as 16 or 32 bits
+        self.errors.append((ak, number))
+        return 7, 101
+
+    def write(self, data):
+        self.writes += 1
+        self._clock.sleep(len(data) * self.byte_time)
+        now = self._clock.time()
+        if len(data) != self._TELEGRAM.size or functools.reduce(operator.xor, data) != 0:
+            return len(data)  # corrupted, not answered
+        stx, lge, adr, pke, _, ind, pwe, stw, _, _, _, _, _, _ = self._TELEGRAM.unpack(bytes(data))
+        if stx != 0x02 or lge != 22 or adr != self.address:
+            return len(data)
+        with self._lock:
+            if stw & 0x0400:
+                if stw & 0x0080:
+                    self.error = False
+                self._set_running(bool(stw & 0x0001))
+            ak, value = self._execute(pke >> 12, pke & 0x7FF, pwe)
+            measured, status = self._process_data()
+            reply = bytearray(self._TELEGRAM.pack(0x02, 22, self.address, (ak << 12) | (pke & 0x7FF), 0, ind, value,
+                                                  status, measured[3], measured[11], measured[5], 0, measured[4], 0))
+            reply[-1] = functools.reduce(operator.xor, reply[:-1])
+            self._send(now + self.reply_time, bytes(reply))
+        return len(data)
+
+
+def connect_driver(simulator, **kwargs):
+    """
+    Create the driver from device_models.py for a simulated instrument, connected like to the real one: the gaussmeter
+    through a SimulatedResourceManager, the serial instruments as the serial_port, and the picomotor controller over
+    TCP once its server is started. The serial instruments and the gaussmeter wait on a clock, so device_models is made
+    to wait on the same clock, and the sleeps of the driver also take virtual time with a VirtualClock.
+
+    Parameters
+    ----------
+    simulator : SimulatedSeries9550, SimulatedVxm, SimulatedModel8742, SimulatedEll14k, or SimulatedTurbovac
+    kwargs
+        passed to the driver, e.g. position_tolerance for a Model8742.
+
+    Returns
+    -------
+    Series9550, Vxm, Model8742, ELL14K, or Turbovac
+    """
+    if isinstance(simulator, SimulatedModel8742):
+        if simulator._server is None:
+            simulator.start()
+        return device_models.Model8742(simulator.host, port=simulator.port, **kwargs)
+
+    device_models.time = simulator._clock
+    if isinstance(simulator, SimulatedSeries9550):
+        rm = SimulatedResourceManager({'GPIB0::15::INSTR': simulator})
+        return device_models.Series9550(15, resource_manager=rm, **kwargs)
+    if isinstance(simulator, SimulatedVxm):
+        return device_models.Vxm(None, serial_port=simulator, **kwargs)
+    if isinstance(simulator, SimulatedEll14k):
+        return device_models.ELL14K(None, ''.join(simulator.mounts), serial_port=simulator, **kwargs)
+    if isinstance(simulator, SimulatedTurbovac):
+        return device_models.Turbovac(None, address=simulator.address, serial_port=simulator, **kwargs)
+    raise ValueError('no driver for ' + type(simulator).__name__)
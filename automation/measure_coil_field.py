@@ -1,20 +1,301 @@
 import numpy as np
+import queue
+import threading
 import time
 from datetime import datetime
-from scipy.stats import linregress
-from scipy.optimize import curve_fit
 import matplotlib.pyplot as plt
 
-from device_models import Spd3303x
-from device_models import Gm3
-from device_models import Series9550
-from device_models import Vxm
+try:
+    from acquisition import trimmed_mean
+    from device_models import Spd3303x
+    from device_models import Series9550
+    from device_models import Vxm
+    from coil_data import load_coil_file
+    from coil_data import ColumnWriter
+    from coil_data import SCAN_COLUMNS
+    from coil_fit import CoilFieldModel
+except ModuleNotFoundError:
+    from automation.acquisition import trimmed_mean
+    from automation.device_models import Spd3303x
+    from automation.device_models import Series9550
+    from automation.device_models import Vxm
+    from automation.coil_data import load_coil_file
+    from automation.coil_data import ColumnWriter
+    from automation.coil_data import SCAN_COLUMNS
+    from automation.coil_fit import CoilFieldModel
+
+
+class SettleCriteria:
+    def __init__(self, tolerance=0.02, window=3, min_time=0.0, timeout=2.0):
+        """
+        Decides when the field reading has settled after the probe stops moving. Replaces the fixed sleep after every
+        motion: the field is read continuously, and the probe is considered settled once the last window readings are
+        within tolerance of each other.
+
+        Parameters
+        ----------
+        tolerance : float, None
+            largest peak to peak spread in gauss of the last window readings. None only uses min_time.
+        window : int
+            number of readings used to check the spread. The settled readings are kept for the average.
+        min_time : float
+            seconds to wait after the motion before the probe can be considered settled.
+        timeout : float
+            seconds after which the probe is considered settled even if the readings are not within tolerance.
+        """
+        self.tolerance = tolerance
+        self.window = window
+        self.min_time = min_time
+        self.timeout = timeout
+
+    def is_settled(self, readings, elapsed):
+        """
+        Parameters
+        ----------
+        readings : list of float
+            field readings since the motion ended.
+        elapsed : float
+            seconds since the motion ended.
+
+        Returns
+        -------
+        bool
+        """
+        if elapsed < self.min_time:
+            return False
+        if elapsed >= self.timeout:
+            return True
+        if self.tolerance is None:
+            return True
+        if len(readings) < self.window:
+            return False
+        last = readings[-self.window:]
+        return max(last) - min(last) <= self.tolerance
+
+
+class _LineWriter:
+    def __init__(self, file):
+        """
+        Writes lines to an open file from a background thread, so slow disks do not hold up the scan. Every line is
+        flushed, so the data is kept if the scan is interrupted.
+        """
+        self._file = file
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            line = self._queue.get()
+            if line is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+
+    def write(self, line):
+        self._queue.put(line)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class _ScanFile:
+    def __init__(self, filename, header, metadata, background=True):
+        """
+        Output file of a coil scan. Text files get the header and one line per point, written by a _LineWriter if
+        background is True. Binary files (.cdat) get the metadata and one row per point, check coil_data.ColumnWriter.
+        """
+        self._file = None
+        self._writer = None
+        self._columns = None
+        if filename.endswith('.cdat'):
+            self._columns = ColumnWriter(filename, SCAN_COLUMNS, metadata)
+        else:
+            self._file = open(filename, 'w')
+            self._file.write(header)
+            if background:
+                self._writer = _LineWriter(self._file)
+
+    def write_point(self, pos, b, berr):
+        if self._columns is not None:
+            self._columns.append((pos, b, berr))
+        elif self._writer is not None:
+            self._writer.write(str(pos) + ',' + str(b) + ',' + str(berr) + '\n')
+        else:
+            self._file.write(str(pos) + ',' + str(b) + ',' + str(berr) + '\n')
+
+    def close(self):
+        if self._columns is not None:
+            self._columns.close()
+            return
+        if self._writer is not None:
+            self._writer.write('\n')
+            self._writer.close()
+        else:
+            self._file.write('\n')
+        self._file.close()
+
+
+def measure_settled_field(gm, n, settle=None, sample_interval=0.2, target_sem=None, max_n=None, moving=None,
+                          poll_interval=0.01):
+    """
+    Read the z field continuously until it settles, then keep reading until there are n + 4 readings. The two
+    highest and two lowest readings are dropped, as in Series9550.get_avg_zfield(). The readings that were used to
+    decide that the field settled count towards the n + 4 readings.
+
+    Parameters
+    ----------
+    gm : Gm3, Series9550
+        gaussmeter to be used
+    n : int
+        number of readings to average after dropping the outliers.
+    settle : SettleCriteria, None
+        If None, use SettleCriteria().
+    sample_interval : float
+        seconds between the start of two readings. Time spent communicating with the gaussmeter counts towards the
+        interval.
+    target_sem : float, None
+        If given, n is the smallest number of readings, and the readings continue until the standard error is at most
+        target_sem gauss, or there are max_n + 4 readings. Check acquisition.average_readings().
+    max_n : int, None
+        defaults to 10 * n.
+    moving : callable, None
+        e.g. Vxm.is_moving. If given, the function can be called while the probe is still moving: it waits until
+        moving() returns False, and the settling time starts from then. Readings of a moving probe are never taken.
+    poll_interval : float
+        seconds between calls to moving().
+
+    Returns
+    -------
+    two tuple of float
+        average field and standard error of the average.
+    """
+    if settle is None:
+        settle = SettleCriteria()
+
+    while moving is not None and moving():
+        time.sleep(poll_interval)
+
+    readings = []
+    t_start = time.time()
+    t_next = t_start
+    while True:
+        time.sleep(max(0, t_next - time.time()))
+        t_next = time.time() + sample_interval
+        readings.append(gm.get_zfield())
+        if settle.is_settled(readings, time.time() - t_start):
+            break
+    readings = readings[-settle.window:]
+
+    n_max = n if target_sem is None else max(n, max_n if max_n is not None else 10 * n)
+    while True:
+        if len(readings) >= n + 4:
+            out, sem = trimmed_mean(readings[-(n_max + 4):], 2)
+            if target_sem is None or sem <= target_sem or len(readings) >= n_max + 4:
+                return out, sem
+        time.sleep(max(0, t_next - time.time()))
+        t_next = time.time() + sample_interval
+        readings.append(gm.get_zfield())
+
+
+def _start_coil_scan(coilname, ps, gm, vx, a, n, delta_step, notes, file_format='txt', background=True,
+                     software_zero=False):
+    """
+    Zero the gaussmeter, turn on the coil current, set up the motor, and open the data file with its header. Used by
+    get_pos_b() and get_pos_b_adaptive(). If the gaussmeter has autozero_async(), the motor and the power supply are
+    set up while it zeroes.
+
+    Gaussmeters with a zero_offset, like the Gm3, have no zero command: their autozero() measures the ambient field
+    and subtracts it from every reading. That is only done if software_zero is True, so the readings stay raw like in
+    the older files of data_coils. The offset is written to the header and the metadata of the file.
+
+    Parameters
+    ----------
+    delta_step : int, str
+        steps between points, or a description of the steps for adaptive scans.
+    file_format : {'txt', 'cdat'}
+        text file, or binary file that can be memory mapped (check coil_data.ColumnWriter).
+    background : bool
+        If True, text files are written by a background thread.
+    software_zero : bool
+        If True, zero gaussmeters that only have a software zero. Check Gm3.autozero().
+
+    Returns
+    -------
+    _ScanFile
+        the open data file.
+    """
+    zero = None
+    if hasattr(gm, 'zero_offset') and not software_zero:
+        gm.zero_offset = 0.0
+    elif hasattr(gm, 'autozero_async'):  # the motor and the supply are set up while the meter zeroes
+        zero = gm.autozero_async()
+    else:
+        gm.autozero()
+    vx.set_speed(1, 1000)
+    vx.set_acceleration(1, 1)
+    ps.set_current_limit(1, 3)
+    ps.set_voltage(1, 20)
+    ps.set_current(1, a)
+    if zero is not None:
+        out = zero.result()  # the coil has to be off during the zero
+        if out is not True:
+            print(out)
 
+    ps.set_channel_state(1, True)
+    time.sleep(1)
 
-def get_pos_b(coilname, ps, gm, vx, a, n, delta_step, notes=''):
+    now = datetime.now()
+    filename = 'data_coils/' + coilname + '/' + now.strftime('%y_%m_%d__%H_%M_%S') + '.' + file_format
+
+    volts = ps.get_actual_voltage(1)
+    amps = ps.get_actual_current(1)
+    start_position = 'tip of probe is 1.8 inches below resting surface of magnetic coil.'
+    header = str(gm.idn) + ', average for ' + str(n) + ' data points' + '\n'
+    header += 'V = ' + str(volts) + ', A = ' + str(amps) + '\n'
+    header += 'deltaX = ' + str(delta_step) + ' steps.' + '\n'
+    zero_offset = getattr(gm, 'zero_offset', None)
+    if zero_offset:
+        header += 'Software zero = ' + str(zero_offset) + ' G subtracted from the readings.' + '\n'
+    header += 'Starting position: ' + start_position + '\n'
+    header += notes
+    metadata = {
+        'idn': str(gm.idn), 'n_average': n, 'volts': volts, 'amps': amps, 'delta_step': delta_step,
+        'zero_offset': zero_offset or None, 'start_position': start_position, 'notes': notes.strip(),
+        'coilname': coilname, 'timestamp': now, 'kind': 'scan'
+    }
+    return _ScanFile(filename, header, metadata, background)
+
+
+def get_pos_b(
+        coilname,
+        ps,
+        gm,
+        vx,
+        a,
+        n,
+        delta_step,
+        notes='',
+        pipelined=True,
+        settle=None,
+        sample_interval=0.2,
+        file_format='txt',
+        fit=None,
+        software_zero=False
+):
     """
     collects data on the position and magnetic field, writes it to a file, and then returns the data
 
+    If pipelined is True, the motor starts moving to the next position with Vxm.displace_async() as soon as the last
+    field reading is taken. The fit update, the print, and the file write of the point happen while the motor moves,
+    and the file is written by a background thread. The acquisition of the next point starts while the motor is still
+    moving: measure_settled_field() waits for Vxm.is_moving() to turn False, and then reads the field until it
+    settles (see SettleCriteria) instead of sleeping a fixed time. The settled readings count towards the average.
+
+    The field is only read with the probe at rest, so the motion itself does not overlap with the readings. Most of
+    the time saved compared to pipelined=False comes from the settle detection replacing the fixed sleeps.
+
     Paramters
     ---------
     coilname : {'small1', 'small2', 'medium1', 'medium2', 'large1', 'large2'}
@@ -33,44 +314,217 @@ def get_pos_b(coilname, ps, gm, vx, a, n, delta_step, notes=''):
         the number of steps to displace the probe between datapoints
     notes : str
         notes to write in the header of the file
+    pipelined : bool
+        If False, run the scan one step at a time with fixed sleeps, as in earlier versions.
+    settle : SettleCriteria, None
+        used when pipelined is True. If None, use SettleCriteria().
+    sample_interval : float
+        seconds between gaussmeter readings when pipelined is True.
+    file_format : {'txt', 'cdat'}
+        'cdat' writes a binary file with the header as metadata instead of a text file. Read it with
+        coil_data.load_coil_file().
+    fit : coil_fit.IncrementalCoilFit, None
+        If given, the fit is updated with every point, and the scan stops as soon as the errors of n and z0 are below
+        the tolerances of the fit.
+    software_zero : bool
+        If True, subtract the ambient field from the readings of a Gm3. Check _start_coil_scan().
 
     Returns
     -------
     tuple of numpy arrays
-        tuple containing the position array, magnetic field array, and the standard error array.
+        tuple containing the position array, magnetic field array, and the standard error array. Shorter than a full
+        scan if the fit stopped it early.
     """
     # vx.displace(1, -16000)
-    gm.autozero()
-    ps.set_current_limit(1, 3)
-    ps.set_voltage(1, 20)
-    ps.set_current(1, a)
-    ps.set_channel_state(1, True)
-    time.sleep(1)
+    file = _start_coil_scan(coilname, ps, gm, vx, a, n, delta_step, notes, file_format, background=pipelined,
+                           software_zero=software_zero)
+    pos = np.arange(0, 16000, delta_step)
+    bout = np.zeros(len(pos))
+    berr = np.zeros(len(pos))
+    count = 0
+    if pipelined:
+        try:
+            for i, pos_i in enumerate(pos):
+                f, sterror = measure_settled_field(gm, n, settle, sample_interval, moving=vx.is_moving)
+                count = i + 1
+                done = False
+                if fit is not None:
+                    fit.add(pos_i, f, sterror)
+                    done = fit.is_converged()
+                if not done:
+                    vx.displace_async(1, delta_step)  # probe leaves as soon as the readings are done
+
+                bout[i] = f
+                berr[i] = sterror
+                file.write_point(pos_i, f, sterror)
+                print(round(f, 5), '+-', sterror)
+                if done:
+                    print('fit converged after', count, 'points:', fit)
+                    break
+        finally:
+            vx.wait_motion()
+    else:
+        for i, pos_i in enumerate(pos):
+            f, sterror = gm.get_avg_zfield(n)
+            bout[i] = f
+            berr[i] = sterror
+            file.write_point(pos_i, f, sterror)
+            count = i + 1
+            if fit is not None:
+                fit.add(pos_i, f, sterror)
+                if fit.is_converged():
+                    print('fit converged after', count, 'points:', fit)
+                    break
+            vx.displace(1, delta_step)
+            time.sleep(0.3)
+    file.close()
 
-    vx.set_speed(1, 1000)
-    vx.set_acceleration(1, 1)
+    ps.zero_all_channels()
+    gm.disconnect()
+    vx.disconnect()
 
-    time_now = datetime.now().strftime('%y_%m_%d__%H_%M_%S')
-    filename = 'data_coils/' + coilname + '/' + time_now + '.txt'
+    return pos[:count], bout[:count], berr[:count]
 
-    file = open(filename, 'w')
-    file.write(str(gm.idn) + ', average for ' + str(n) + ' data points' + '\n')
-    file.write('V = ' + str(ps.get_actual_voltage(1)) + ', A = ' + str(ps.get_actual_current(1)) + '\n')
-    file.write('deltaX = ' + str(delta_step) + ' steps.' + '\n')
-    file.write('Starting position: tip of probe is 1.8 inches below resting surface of magnetic coil.' + '\n')
-    file.write(notes)
-    pos = np.arange(0, 16000, delta_step)
-    bout = np.asarray([])
-    berr = np.asarray([])
-    for pos_i in pos:
-        f, sterror = gm.get_avg_zfield(n)
-        bout = np.append(bout, f)
-        berr = np.append(berr, sterror)
-        vx.displace(1, delta_step)
-        time.sleep(0.3)
-        file.write(str(pos_i) + ',' + str(f) + ',' + str(sterror) + '\n')
-    file.write('\n')
-    file.close()
+
+def refine_positions(pos, b, tolerance, min_step, residuals=None):
+    """
+    Find the intervals of a field scan that need more points. An interval is split in two when the error of a
+    straight line between its end points, estimated from the curvature of the field, is larger than tolerance. If
+    residuals are given, intervals next to a point with a fit residual larger than tolerance are split too. Intervals
+    shorter than 2 * min_step are never split.
+
+    Parameters
+    ----------
+    pos : numpy array
+        sorted positions in steps.
+    b : numpy array
+        field at every position.
+    tolerance : float
+        gauss.
+    min_step : int
+        smallest distance between two points in steps.
+    residuals : numpy array, None
+        residuals of a fit of the field, for example from get_field_fit().
+
+    Returns
+    -------
+    numpy array
+        new positions to measure, in steps.
+    """
+    pos = np.asarray(pos, dtype=float)
+    b = np.asarray(b, dtype=float)
+    h = np.diff(pos)
+    if len(pos) < 3:
+        return np.round(pos[:-1][h >= 2 * min_step] + h[h >= 2 * min_step] / 2)
+
+    slopes = np.diff(b) / h
+    curvature = np.zeros(len(pos))
+    curvature[1:-1] = 2 * np.diff(slopes) / (h[:-1] + h[1:])
+    curvature[0] = curvature[1]
+    curvature[-1] = curvature[-2]
+
+    error = np.maximum(np.abs(curvature[:-1]), np.abs(curvature[1:])) * h ** 2 / 8
+    split = error > tolerance
+    if residuals is not None:
+        bad = np.abs(residuals) > tolerance
+        split |= bad[:-1] | bad[1:]
+    split &= h >= 2 * min_step
+
+    return np.round(pos[:-1][split] + h[split] / 2)
+
+
+def get_pos_b_adaptive(
+        coilname,
+        ps,
+        gm,
+        vx,
+        a,
+        n,
+        coarse_step=1000,
+        min_step=100,
+        tolerance=0.05,
+        use_fit=False,
+        max_points=320,
+        notes='',
+        settle=None,
+        sample_interval=0.2,
+        file_format='txt',
+        software_zero=False
+):
+    """
+    Same as get_pos_b(), but the positions are chosen adaptively. A coarse pass measures the field every coarse_step
+    steps. Then, every pass measures the middle of the intervals where the field is not well described by a straight
+    line between its end points (see refine_positions()), until no interval needs to be split, or max_points is
+    reached. Flat regions get few points, and the motor moves and gaussmeter readings go where the field changes.
+
+    The probe is moved with absolute positions, so the starting position is set as the origin of the motor. Points are
+    written to the file in the order they are measured.
+
+    Parameters
+    ----------
+    coilname : {'small1', 'small2', 'medium1', 'medium2', 'large1', 'large2'}
+    ps : Spd3303x
+    gm : Gm3, Series9550
+    vx : Vxm
+    a : float
+        current to put through the coil wire
+    n : int
+        number of gaussmeter measurements to average for every point
+    coarse_step : int
+        steps between the points of the coarse pass.
+    min_step : int
+        smallest distance between two points in steps.
+    tolerance : float
+        largest allowed error in gauss of a straight line between neighbouring points. Should be larger than the
+        noise of the averaged readings.
+    use_fit : bool
+        If True, also split the intervals next to points with a residual from get_field_fit() larger than tolerance.
+    max_points : int
+        stop refining once this many points have been measured.
+    notes : str
+    settle : SettleCriteria, None
+    sample_interval : float
+    file_format : {'txt', 'cdat'}
+    software_zero : bool
+
+    Returns
+    -------
+    tuple of numpy arrays
+        position, magnetic field, and standard error arrays, sorted by position.
+    """
+    delta_text = 'adaptive, coarse ' + str(coarse_step) + ' steps, minimum ' + str(min_step)
+    file = _start_coil_scan(coilname, ps, gm, vx, a, n, delta_text, notes, file_format, software_zero=software_zero)
+    vx.set_origin(1)
+
+    pos = np.zeros(0)
+    bout = np.zeros(0)
+    berr = np.zeros(0)
+    new_pos = np.arange(0, 16000, coarse_step)
+    direction = 1
+    try:
+        while len(new_pos) and len(pos) < max_points:
+            new_pos = new_pos[::direction][:max_points - len(pos)]  # every pass goes the opposite way
+            new_b = np.zeros(len(new_pos))
+            new_err = np.zeros(len(new_pos))
+            for i, pos_i in enumerate(new_pos):
+                vx.set_position(1, int(pos_i))
+                new_b[i], new_err[i] = measure_settled_field(gm, n, settle, sample_interval)
+                file.write_point(int(pos_i), new_b[i], new_err[i])
+            direction = -direction
+
+            pos = np.concatenate([pos, new_pos])
+            bout = np.concatenate([bout, new_b])
+            berr = np.concatenate([berr, new_err])
+            order = np.argsort(pos)
+            pos, bout, berr = pos[order], bout[order], berr[order]
+
+            residuals = None
+            if use_fit:
+                residuals = get_field_fit(pos, bout, berr, coilname, a)[2]
+            new_pos = refine_positions(pos, bout, tolerance, min_step, residuals)
+            print(len(pos), 'points measured,', len(new_pos), 'intervals to refine')
+    finally:
+        file.close()
 
     ps.zero_all_channels()
     gm.disconnect()
@@ -81,7 +535,8 @@ def get_pos_b(coilname, ps, gm, vx, a, n, delta_step, notes=''):
 
 def process_file(file_, n_cols):
     """
-    Reads n_cols from a file and outputs every column as a numpy array. Will also attempt to ignore a header.
+    Reads n_cols from a file and outputs every column as a numpy array. The header is skipped. Check
+    coil_data.load_coil_file() to also get the metadata in the header.
 
     Parameters
     ----------
@@ -95,28 +550,15 @@ def process_file(file_, n_cols):
     list of numpy arrays
         a list containing as many numpy arrays as specified by n_cols.
     """
-    out = []
-    for i in range(n_cols):
-        out.append(np.asarray([]))
-
-    with open(file_, 'r') as file:
-        data = file.readline()
-        while data != '\n':
-            try:
-                cols = data.split(',')
-                for i in range(n_cols):
-                    out[i] = np.append(out[i], float(cols[i]))
-            except (ValueError, IndexError):
-                pass
+    data = load_coil_file(file_).data
+    if data.ndim != 2 or data.shape[1] < n_cols:
+        return [np.zeros(0) for _ in range(n_cols)]
+    return [data[:, i].copy() for i in range(n_cols)]
 
-            data = file.readline()
 
-    return out
-
-
-def get_field_fit(pos, b, berr, coilname, amps):
+def get_field_fit(pos, b, berr, coilname, amps, weighted=False):
     """
-    model for magnetic field.
+    model for magnetic field. Check coil_fit.fit_coil_runs() to fit every file in data_coils at once.
 
     Parameters
     ----------
@@ -124,44 +566,23 @@ def get_field_fit(pos, b, berr, coilname, amps):
         position data
     b : numpy array
         magnetic field data
-    berr : numpy array
-        standard error of data points. Not used currently
+    berr : numpy array, None
+        standard error of data points. Only used if weighted is True.
     coilname : {'small1', 'small2', 'medium1', 'medium2', 'large1', 'large2'}
         name of the coil that was used to get the data
     amps : float
         current through the coil at the moment of taking data
+    weighted : bool
+        If True and berr is given, the fit is weighted by 1 / berr**2. Check CoilFieldModel.fit().
 
     """
-    def coil_field_z_axis(z, n, z0):
-        """
-        :param z: steps
-        :param n: number of turns of wire in the coil
-        :param z0: center position of coils in meter
-        """
-        coil_side = {
-            'small': 0.667893,  # meters
-            'medium': 0.7028942,
-            'large': 0.7378954
-        }
-
-        side = coil_side[coilname[:-1]]
-
-        meters = (z - z0) * 6.8E-6  # convert steps to meters
-
-        x = meters
-        f = 2e-7*amps*n*side**2
-        s = 1 / (x**2 + (side**2)/4)
-        t = 1 / np.sqrt(x**2 + (side**2)/2)
-
-        return f*s*t*10000  # tesla to gauss
-
-    popt, pcov = curve_fit(coil_field_z_axis, pos, b, p0=[60, 6260], bounds=([58, 5500], [62, 6500]))
+    model = CoilFieldModel(coilname, amps)
+    popt, pcov, residuals = model.fit(pos, b, berr if weighted else None, bounds=((58, 5500), (62, 6500)))
     pos_model = np.linspace(pos[0], pos[-1], 1000)
-    b_model = coil_field_z_axis(pos_model, *popt)
+    b_model = model(pos_model, *popt)
 
     print(popt, pcov)
 
-    residuals = b - coil_field_z_axis(pos, *popt)
     return pos_model, b_model, residuals
 
 
@@ -225,4 +646,5 @@ def main():
     plot_data_from_file()
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,623 @@
+"""
+Faster-than-real-time simulation of an oven. A LumpedThermalModel is shared by a SimulatedPowerSupply and a
+SimulatedTempDaq, which can be put together into regular HeaterAssembly objects. Everything is driven by a
+VirtualClock, so a full HeaterAssembly + server_loop stack can run hours of oven time in a few seconds. Used for
+regression tests and for tuning the PID settings without a physical oven.
+"""
+import numpy as np
+
+try:
+    from device_type import PowerSupply
+    from device_type import Heater
+    from assemblies import HeaterAssembly
+    from pid_controller_server import server_loop
+except ModuleNotFoundError:
+    from automation.device_type import PowerSupply
+    from automation.device_type import Heater
+    from automation.assemblies import HeaterAssembly
+    from automation.pid_controller_server import server_loop
+
+
+class VirtualClock:
+    def __init__(self, t0=0.0):
+        """
+        A clock that only moves forward when sleep() is called. Can be used anywhere the time module is used as a
+        clock, for example by HeaterAssembly and server_loop.
+
+        Parameters
+        ----------
+        t0 : float
+            starting time in seconds.
+        """
+        self._t = float(t0)
+
+    def time(self):
+        """
+        Returns
+        -------
+        float
+            current virtual time in seconds.
+        """
+        return self._t
+
+    def monotonic(self):
+        """
+        Same as time(). The virtual time never goes back, like time.monotonic().
+        """
+        return self._t
+
+    def sleep(self, seconds):
+        """
+        Advance the virtual time. Returns immediately.
+
+        Parameters
+        ----------
+        seconds : float
+            must be positive or zero.
+        """
+        if seconds < 0:
+            raise ValueError('sleep length must be non-negative')
+        self._t += seconds
+
+
+class LumpedThermalModel:
+    def __init__(
+            self,
+            clock,
+            number_of_zones=1,
+            heat_capacity=300,
+            loss_conductance=0.15,
+            coupling_conductance=0,
+            heater_resistance=60,
+            ambient_temp=25,
+            initial_temp=None,
+            sensor_time_constant=5,
+            max_step=0.5,
+            record=False,
+    ):
+        """
+        Lumped thermal model of an oven with one or more heater zones. Every zone is a single heat capacity heated by a
+        resistive heater and losing heat to the ambient. Neighbouring zones exchange heat through a coupling
+        conductance. The thermocouple of every zone follows the zone temperature with a first order lag.
+
+            C dT/dt = P - G_loss (T - T_ambient) - G_coupling (2T - T_left - T_right)
+
+        The model is integrated lazily up to the time of the clock every time that it is read or that a heater output
+        changes.
+
+        Parameters
+        ----------
+        clock : VirtualClock or module
+            Source of time. Must have a time() method.
+        number_of_zones : int
+            number of heater zones.
+        heat_capacity : float or list of float
+            heat capacity of every zone in J/K.
+        loss_conductance : float or list of float
+            thermal conductance from every zone to the ambient in W/K.
+        coupling_conductance : float
+            thermal conductance between neighbouring zones in W/K.
+        heater_resistance : float or list of float
+            electrical resistance of every heater in Ohms.
+        ambient_temp : float
+            ambient temperature in Celsius.
+        initial_temp : float or list of float, None
+            starting temperature of every zone in Celsius. Defaults to the ambient temperature.
+        sensor_time_constant : float
+            time constant of the thermocouples in seconds. 0 for an ideal sensor.
+        max_step : float
+            largest integration step in seconds.
+        record : bool
+            If True, the time, zone temperatures, and heater powers are stored every time the model is integrated.
+            Retrieve them with the history property.
+        """
+        n = number_of_zones
+        self._clock = clock
+        self._n = n
+        self._C = np.full(n, heat_capacity, dtype=float)
+        self._G_loss = np.full(n, loss_conductance, dtype=float)
+        self._G_coupling = float(coupling_conductance)
+        self._R_heater = np.full(n, heater_resistance, dtype=float)
+        self._T_ambient = float(ambient_temp)
+        self._tau_sensor = float(sensor_time_constant)
+        self._max_step = float(max_step)
+
+        if initial_temp is None:
+            initial_temp = ambient_temp
+        self._T = np.full(n, initial_temp, dtype=float)
+        self._T_sensor = self._T.copy()
+
+        self._volts = np.zeros(n)
+        self._current_limit = np.zeros(n)
+        self._on = np.zeros(n, dtype=bool)
+
+        self._t = clock.time()
+        self._record = record
+        self._history = []
+        if record:
+            self._history.append((self._t, *self._T, *self.get_heater_power()))
+
+    def _derivatives(self, T, T_sensor, power):
+        dT = power - self._G_loss * (T - self._T_ambient)
+        if self._G_coupling and self._n > 1:
+            flow = self._G_coupling * np.diff(T)  # heat flowing from zone i+1 into zone i
+            dT[:-1] += flow
+            dT[1:] -= flow
+        dT /= self._C
+
+        if self._tau_sensor > 0:
+            dT_sensor = (T - T_sensor) / self._tau_sensor
+        else:
+            dT_sensor = np.zeros(self._n)
+        return dT, dT_sensor
+
+    def advance(self):
+        """
+        Integrate the model from the last update up to the current time of the clock. The heater outputs are constant
+        during the integration.
+        """
+        t_end = self._clock.time()
+        if t_end <= self._t:
+            return
+
+        power = self.get_heater_power()
+        T = self._T
+        T_sensor = self._T_sensor
+        remaining = t_end - self._t
+        while remaining > 0:
+            h = min(self._max_step, remaining)
+            k1, k1_sensor = self._derivatives(T, T_sensor, power)
+            k2, k2_sensor = self._derivatives(T + h * k1, T_sensor + h * k1_sensor, power)  # Heun's method
+            T = T + h * (k1 + k2) / 2
+            T_sensor = T_sensor + h * (k1_sensor + k2_sensor) / 2
+            remaining -= h
+
+        if self._tau_sensor <= 0:
+            T_sensor = T.copy()
+
+        self._T = T
+        self._T_sensor = T_sensor
+        self._t = t_end
+        if self._record:
+            self._history.append((self._t, *self._T, *power))
+
+    def set_heater_output(self, zone, volts=None, current_limit=None, state=None):
+        """
+        Change the electrical output going into a heater. The model is first integrated up to the current time using
+        the previous output.
+
+        Parameters
+        ----------
+        zone : int
+            heater zone, starting from 0.
+        volts : float, None
+            setpoint voltage of the power supply channel. None keeps the previous value.
+        current_limit : float, None
+            setpoint current of the power supply channel. None keeps the previous value.
+        state : bool, None
+            True for ON, False for OFF. None keeps the previous value.
+        """
+        self.advance()
+        if volts is not None:
+            self._volts[zone] = volts
+        if current_limit is not None:
+            self._current_limit[zone] = current_limit
+        if state is not None:
+            self._on[zone] = bool(state)
+
+    def get_heater_current(self):
+        """
+        The power supply works in constant voltage mode until the current reaches the setpoint current, then it
+        switches to constant current mode.
+
+        Returns
+        -------
+        numpy array
+            current through every heater in Amps.
+        """
+        amps = np.minimum(self._volts / self._R_heater, self._current_limit)
+        return np.where(self._on, amps, 0.0)
+
+    def get_heater_voltage(self):
+        """
+        Returns
+        -------
+        numpy array
+            voltage across every heater in Volts.
+        """
+        return self.get_heater_current() * self._R_heater
+
+    def get_heater_power(self):
+        """
+        Returns
+        -------
+        numpy array
+            electrical power going into every heater in Watts.
+        """
+        return self.get_heater_current() ** 2 * self._R_heater
+
+    def get_zone_temp(self, zone):
+        """
+        Parameters
+        ----------
+        zone : int
+            heater zone, starting from 0.
+
+        Returns
+        -------
+        float
+            actual temperature of the zone in Celsius.
+        """
+        self.advance()
+        return float(self._T[zone])
+
+    def get_sensor_temp(self, zone):
+        """
+        Parameters
+        ----------
+        zone : int
+            heater zone, starting from 0.
+
+        Returns
+        -------
+        float
+            temperature read by the thermocouple of the zone in Celsius.
+        """
+        self.advance()
+        return float(self._T_sensor[zone])
+
+    @property
+    def number_of_zones(self):
+        return self._n
+
+    @property
+    def ambient_temp(self):
+        return self._T_ambient
+
+    @property
+    def history(self):
+        """
+        Returns
+        -------
+        numpy array
+            one row per integration. Columns are time, the temperature of every zone, and the heater power of every
+            zone.
+        """
+        return np.asarray(self._history)
+
+
+class SimulatedPowerSupply(PowerSupply):
+    def __init__(
+            self,
+            model,
+            zones=None,
+            MAX_voltage=32,
+            MAX_current=3.3,
+            channel_voltage_limits=None,
+            channel_current_limits=None,
+            zero_on_startup=True,
+            idn='Simulated power supply',
+    ):
+        """
+        A power supply whose channels drive the heaters of a LumpedThermalModel. Channel 1 drives the first zone in
+        zones, channel 2 the second, and so on.
+
+        Parameters
+        ----------
+        model : LumpedThermalModel
+        zones : list of int, None
+            zones driven by the channels. Defaults to one channel per zone of the model.
+        MAX_voltage : float
+        MAX_current : float
+        channel_voltage_limits : list of float, None
+        channel_current_limits : list of float, None
+        zero_on_startup : bool
+        idn : str
+        """
+        if zones is None:
+            zones = list(range(model.number_of_zones))
+        self._model = model
+        self._zones = list(zones)
+        self._idn = idn
+        self._setpoint_voltage = [0.0] * len(self._zones)
+        self._setpoint_current = [0.0] * len(self._zones)
+        self._state = [False] * len(self._zones)
+
+        super().__init__(
+            MAX_voltage=MAX_voltage,
+            MAX_current=MAX_current,
+            channel_voltage_limits=channel_voltage_limits,
+            channel_current_limits=channel_current_limits,
+            number_of_channels=len(self._zones),
+            zero_on_startup=zero_on_startup,
+        )
+
+        if self._zero_on_startup:
+            self.zero_all_channels()
+
+    def get_channel_state(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        return self._state[channel - 1]
+
+    def set_channel_state(self, channel, state):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        if type(state) is not bool and type(state) is not int:
+            return 'ERROR: type ' + str(type(state)) + ' not supported. Input True or 1 for ON, or False or 0 for OFF'
+
+        self._state[channel - 1] = bool(state)
+        self._model.set_heater_output(self._zones[channel - 1], state=bool(state))
+
+    def get_setpoint_voltage(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        return self._setpoint_voltage[channel - 1]
+
+    def set_voltage(self, channel, volts):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        if volts > self.get_voltage_limit(channel):
+            return 'ERROR: CH' + str(channel) + ' voltage not set. New voltage is higher than limit'
+
+        volts = round(volts, 3)
+        self._setpoint_voltage[channel - 1] = volts
+        self._model.set_heater_output(self._zones[channel - 1], volts=volts)
+
+    def get_actual_voltage(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        self._model.advance()
+        return round(float(self._model.get_heater_voltage()[self._zones[channel - 1]]), 3)
+
+    def get_setpoint_current(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        return self._setpoint_current[channel - 1]
+
+    def set_current(self, channel, amps):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        if amps > self.get_current_limit(channel):
+            return 'ERROR: CH' + str(channel) + ' current not set. New current is higher than limit'
+
+        amps = round(amps, 3)
+        self._setpoint_current[channel - 1] = amps
+        self._model.set_heater_output(self._zones[channel - 1], current_limit=amps)
+
+    def get_actual_current(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        self._model.advance()
+        return round(float(self._model.get_heater_current()[self._zones[channel - 1]]), 3)
+
+    @property
+    def idn(self):
+        return self._idn
+
+    @property
+    def ip4_address(self):
+        return 'simulated'
+
+
+class SimulatedTempDaq:
+    def __init__(
+            self,
+            model,
+            zones=None,
+            default_units='celsius',
+            noise=0.0,
+            seed=None,
+            idn='Simulated temperature DAQ',
+    ):
+        """
+        A temperature DAQ whose channels read the thermocouples of a LumpedThermalModel. Channel 0 reads the first
+        zone in zones, channel 1 the second, and so on. Has the same temperature methods as MccDeviceLinux.
+
+        Parameters
+        ----------
+        model : LumpedThermalModel
+        zones : list of int, None
+            zones read by the channels. Defaults to one channel per zone of the model.
+        default_units : {'c', 'celsius', 'f', 'fahrenheit', 'k', 'kelvin'}
+        noise : float
+            standard deviation in Celsius of the gaussian noise added to every reading.
+        seed : int, None
+            seed for the noise generator.
+        idn : str
+        """
+        if zones is None:
+            zones = list(range(model.number_of_zones))
+        self._model = model
+        self._zones = list(zones)
+        self._default_units = default_units
+        self._noise = noise
+        self._rng = np.random.default_rng(seed)
+        self._idn = idn
+        self._tc_types = ['K'] * len(self._zones)
+
+    def check_valid_units(self, units):
+        """
+        Parameters
+        ----------
+        units : {'c', 'celsius', 'f', 'fahrenheit', 'k', 'kelvin'}, None
+
+        Returns
+        -------
+        None
+            If units are valid
+        str
+            Else, return error string
+        """
+        if units is None:
+            return
+        elif type(units) is not str:
+            return 'ERROR: input type should be string. Type ' + str(type(units)) + ' not supported.'
+
+        units_set = {'c', 'celsius', 'f', 'fahrenheit', 'k', 'kelvin'}
+        if units.lower() not in units_set:
+            return 'ERROR: units ' + str(units) + ' not supported'
+
+    def check_valid_temp_channel(self, channel):
+        if type(channel) is not int:
+            return 'ERROR: channel input must be int. type ' + str(type(channel)) + ' not supported.'
+
+        if not (0 <= channel < self.number_temp_channels):
+            return 'ERROR: channel ' + str(channel) + ' not valid. This unit has ' + str(
+                self.number_temp_channels) + ' channels, starting from channel 0.'
+
+    def get_temp(self, channel_n=0, units=None):
+        """
+        Parameters
+        ----------
+        channel_n : int
+            the number of the channel from which to read the temperature. defaults to channel 0.
+        units : str, None
+            check docstring for self.check_valid_units for valid input units.
+
+        Returns
+        -------
+        float
+            If succesful, reading as a float in the specified units.
+        str
+            Else, return error string
+        """
+        err1 = self.check_valid_units(units)
+        if err1 is not None:
+            return err1
+        err2 = self.check_valid_temp_channel(channel_n)
+        if err2 is not None:
+            return err2
+
+        if units is None:
+            units = self._default_units
+
+        temp = self._model.get_sensor_temp(self._zones[channel_n])
+        if self._noise:
+            temp += self._rng.normal(0, self._noise)
+
+        units = units.lower()
+        if units in ('f', 'fahrenheit'):
+            return temp * 9 / 5 + 32
+        elif units in ('k', 'kelvin'):
+            return temp + 273.15
+        return temp
+
+    def get_thermocouple_type(self, channel):
+        err = self.check_valid_temp_channel(channel)
+        if err is not None:
+            return err
+        return self._tc_types[channel]
+
+    def set_thermocouple_type(self, channel, new_tc):
+        err = self.check_valid_temp_channel(channel)
+        if err is not None:
+            return err
+        if new_tc.upper() not in ('J', 'K', 'T', 'E', 'R', 'S', 'B', 'N'):
+            return 'ERROR: TC Type ' + str(new_tc) + ' not supported'
+        self._tc_types[channel] = new_tc.upper()
+
+    @property
+    def idn(self):
+        return self._idn
+
+    @property
+    def ip4_address(self):
+        return 'simulated'
+
+    @property
+    def number_temp_channels(self):
+        return len(self._zones)
+
+    @property
+    def default_units(self):
+        return self._default_units
+
+    @default_units.setter
+    def default_units(self, new_units):
+        err = self.check_valid_units(new_units)
+        if err is None:
+            self._default_units = new_units
+        else:
+            print(err)
+
+
+def simulated_oven(number_of_assemblies=1, heater=None, clock=None, daq_noise=0.0, seed=None, **model_kwargs):
+    """
+    Create the HeaterAssembly objects of a simulated oven. All the assemblies share one LumpedThermalModel, one
+    SimulatedPowerSupply with one channel per assembly, and one SimulatedTempDaq.
+
+    Parameters
+    ----------
+    number_of_assemblies : int
+        number of heater zones of the oven.
+    heater : Heater, None
+        limits used by every assembly. Defaults to Heater(MAX_temp=200, MAX_volts=30, MAX_current=0.5).
+    clock : VirtualClock, None
+        If None, a new VirtualClock is created.
+    daq_noise : float
+        standard deviation of the noise of the temperature readings in Celsius.
+    seed : int, None
+        seed for the noise generator.
+    model_kwargs
+        passed to LumpedThermalModel.
+
+    Returns
+    -------
+    tuple of dictionary of str: HeaterAssembly, VirtualClock, and LumpedThermalModel
+        The assemblies are named 'asm1', 'asm2', and so on.
+    """
+    if clock is None:
+        clock = VirtualClock()
+
+    model = LumpedThermalModel(clock, number_of_zones=number_of_assemblies, **model_kwargs)
+    ps = SimulatedPowerSupply(model)
+    daq = SimulatedTempDaq(model, noise=daq_noise, seed=seed)
+
+    asm_dict = {}
+    for i in range(number_of_assemblies):
+        if heater is None:
+            h = Heater(MAX_temp=200, MAX_volts=30, MAX_current=0.5)
+        else:
+            h = Heater(heater.idn, heater.MAX_temp, heater.MAX_volts, heater.MAX_current)
+        asm_dict['asm' + str(i + 1)] = HeaterAssembly([ps, i + 1], [daq, i], h, clock=clock)
+
+    return asm_dict, clock, model
+
+
+def run_server(asm_dict, clock, run_time, vectorized=False, verbose=False):
+    """
+    Run the regular server_loop on the loopback address with a virtual clock, so hours of oven time take seconds.
+    The server binds to a free port and returns after run_time seconds of virtual time.
+
+    Parameters
+    ----------
+    asm_dict : dictionary of str: HeaterAssembly
+        usually created with simulated_oven().
+    clock : VirtualClock
+        the same clock used by the assemblies.
+    run_time : float
+        seconds of virtual time to run.
+    vectorized : bool
+        passed to server_loop.
+    verbose : bool
+        passed to server_loop.
+    """
+    server_loop(
+        asm_dict,
+        vectorized=vectorized,
+        host='127.0.0.1',
+        port=0,
+        clock=clock,
+        run_time=run_time,
+        accept_timeout=1e-4,
+        verbose=verbose,
+    )
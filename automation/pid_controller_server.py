@@ -1,6 +1,7 @@
 import socket
 from sys import platform
 import time
+import numpy as np
 try:
     import fcntl
     import struct
@@ -12,6 +13,7 @@ try:
     from device_models import Spd3303x
     from device_models import Mr50040
     from assemblies import HeaterAssembly
+    from assemblies import PidBank
     from device_type import Heater
     try:
         from device_models import ETcWindows
@@ -26,6 +28,7 @@ except ModuleNotFoundError:
     from automation.device_models import Spd3303x
     from automation.device_models import Mr50040
     from automation.assemblies import HeaterAssembly
+    from automation.assemblies import PidBank
     from automation.device_type import Heater
     try:
         from automation.device_models import ETcWindows
@@ -238,6 +241,13 @@ def process_command(cmd, asm_dict):
                     return asm.get_pid_sample_time()
                 else:
                     return asm.set_pid_sample_time(float(param))
+            elif comm == 'TUNE':
+                if param == '?':
+                    return asm.get_pid_tuning_status()
+                elif param == 'STOP':
+                    return asm.stop_pid_tuning()
+                else:
+                    return asm.start_pid_tuning(param)
             elif comm == 'REGT':
                 if param == '?':
                     return asm.get_pid_regulation()
@@ -250,6 +260,19 @@ def process_command(cmd, asm_dict):
             else:
                 return 'ERROR: bad command ' + str(cmd)
 
+            # Setpoint profile
+        elif dev == 'PF':
+            if comm == 'LOAD':
+                return asm.load_profile(param)
+            elif comm == 'STRT':
+                return asm.start_profile()
+            elif comm == 'STOP':
+                return asm.stop_profile()
+            elif comm == 'STAT':
+                return asm.get_profile_status()
+            else:
+                return 'ERROR: bad command ' + str(cmd)
+
                 # Heater settings
         elif dev == 'HT':
             if comm == 'TMAX':
@@ -296,7 +319,7 @@ def process_command(cmd, asm_dict):
     return
 
 
-def update_heaters(asm_dict, t0_dict):
+def update_heaters(asm_dict, t0_dict, clock=time, verbose=True):
     """
     For all HeaterAssembly object used by the Oven, check if the pid is set to regulate and check if the sampling
     time has passed. If yes, then set the power supply to a new value based on the PID output.
@@ -307,6 +330,10 @@ def update_heaters(asm_dict, t0_dict):
         dictionary checking if it should update their respective power supply.
     t0_dict: dictionary of str: float
         Used to keep track of the sampling time for each individual HeaterAssembly
+    clock : module or object
+        Source of time. Must have a monotonic() method. Defaults to the time module.
+    verbose : bool
+        If True, print the output of every updated assembly.
 
     Returns
     -------
@@ -316,18 +343,96 @@ def update_heaters(asm_dict, t0_dict):
     """
     out_dict = {}
     for key, asm in asm_dict.items():
-        if asm.get_pid_regulation() and time.time() - t0_dict[key] >= asm.get_pid_sample_time():
+        if asm.get_pid_regulation() and clock.monotonic() - t0_dict[key] >= asm.get_pid_sample_time():
             out_or_err = asm.update_supply()
-            t0_dict[key] = time.time()
+            t0_dict[key] = clock.monotonic()
             out_dict[key] = out_or_err
 
-    for key in out_dict:
-        print(key + ':', out_dict[key])
+    if verbose:
+        for key in out_dict:
+            print(key + ':', out_dict[key])
+
+    return t0_dict, out_dict
+
+
+def update_heaters_bank(asm_dict, t0_dict, bank, clock=time, verbose=True):
+    """
+    Same as update_heaters(), but the new power supply voltages of all the HeaterAssembly objects that are due for an
+    update are calculated together in one vectorized call to a PidBank. The temperatures are read first into a single
+    snapshot, then the bank is stepped, then the power supplies are set. Assemblies running a relay tuning experiment
+    are updated on their own.
+
+    Parameters
+    ----------
+    asm_dict : dictionary of str: HeaterAssembly
+        Should contain all the HeaterAssembly objects used by the oven. The rows of the bank follow the order of the
+        keys of this dictionary.
+    t0_dict: dictionary of str: float
+        Used to keep track of the sampling time for each individual HeaterAssembly
+    bank : PidBank
+        bank with one row per HeaterAssembly. Usually created with PidBank.from_assemblies().
+    clock : module or object
+        Source of time. Must have a monotonic() method. Defaults to the time module.
+    verbose : bool
+        If True, print the output of every updated assembly.
+
+    Returns
+    -------
+    dictionary of str: float
+        the same dictionary used to keep track of sampling time. Should be used as the input for the same function
+        in the next iteration.
+    """
+    keys = list(asm_dict)
+    asm_list = [asm_dict[key] for key in keys]
+    now = clock.monotonic()
+
+    due = np.zeros(len(keys), dtype=bool)
+    temps = np.full(len(keys), np.nan)
+    dt = np.ones(len(keys))
+    out_dict = {}
+    for i, key in enumerate(keys):
+        asm = asm_list[i]
+        if asm.get_pid_regulation() and now - t0_dict[key] >= asm.get_pid_sample_time():
+            if asm.is_tuning:  # relay experiments are stepped by the assembly itself
+                out_dict[key] = asm.update_supply()
+                t0_dict[key] = clock.monotonic()
+                bank.reset(rows=i)
+                continue
+            asm.update_profile()
+            due[i] = True
+            temps[i] = round(asm.temp, 2)
+            dt[i] = now - t0_dict[key]
+
+    if due.any():
+        bank.load_assemblies(asm_list)
+        new_volts = bank.step(temps, dt, mask=due)
+        bank.store_assemblies(asm_list, rows=due)
+        for i in np.flatnonzero(due):
+            key = keys[i]
+            err = asm_list[i].set_supply_voltage(float(new_volts[i]))
+            t0_dict[key] = clock.monotonic()
+            if err is not None:
+                out_dict[key] = err
+            else:
+                out_dict[key] = asm_list[i].get_daq_temp()
+
+    if verbose:
+        for key in out_dict:
+            print(key + ':', out_dict[key])
 
     return t0_dict, out_dict
 
 
-def server_loop(asm_dict):
+def server_loop(
+        asm_dict,
+        vectorized=False,
+        host=None,
+        port=65432,
+        clock=time,
+        run_time=None,
+        accept_timeout=1,
+        verbose=True,
+):
     """
     Server that istens for commands from a remote machine, then executes the command on the respective assembly object.
     The server will continue to regulate an oven regardless of the connection of the remote machine. This means that if
@@ -338,48 +443,90 @@ def server_loop(asm_dict):
     asm_dict : dictionary of str: HeaterAssembly
         dictionary containing all the HeaterAssembly objects to be used by the oven and their respective keys. The
         keys are used to identify each HeaterAssembly in the Oven class. Keys are not case-sensitive.
+    vectorized : bool
+        If True, the PID outputs of all the assemblies are calculated together with a PidBank. Useful for ovens with
+        many heater zones.
+    host : str, None
+        IPv4 address to bind the server to. If None, use the IP of the eth0 interface of the BeagleBone.
+    port : int
+        port number to bind the server to. Use 0 to let the operating system pick a free port.
+    clock : module or object
+        Source of time. Must have monotonic() and sleep() methods. Defaults to the time module. Simulations use a
+        virtual clock (see oven_simulation.VirtualClock) to run hours of oven time in seconds.
+    run_time : float, None
+        If given, the server returns after this many seconds of clock time. If None, the server runs forever.
+    accept_timeout : float
+        real seconds to wait for a connection before updating the heaters. The heaters are updated once every second
+        of clock time while no connection is open. Simulations use a small value.
+    verbose : bool
+        If True, print the server activity.
 
     """
     keys_raw = list(asm_dict)
     for key in keys_raw:      # change all keys to uppercase
         asm_dict[key.upper()] = asm_dict.pop(key)
 
-    HOST = get_host_ip(loopback=False)  # set to False for BeagleBoneBlack use,
-    # HOST = get_host_ip(loopback=True)  # set to True for testing with local host,
-    PORT = 65432
+    bank = None
+    if vectorized:
+        bank = PidBank.from_assemblies(list(asm_dict.values()))
+
+    def update(t0):
+        if bank is None:
+            return update_heaters(asm_dict, t0, clock=clock, verbose=verbose)
+        return update_heaters_bank(asm_dict, t0, bank, clock=clock, verbose=verbose)
+
+    def time_is_up():
+        return run_time is not None and clock.monotonic() - t_start >= run_time
+
+    HOST = host
+    if HOST is None:
+        HOST = get_host_ip(loopback=False)  # set to False for BeagleBoneBlack use,
+        # HOST = get_host_ip(loopback=True)  # set to True for testing with local host,
+    PORT = port
 
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.bind((HOST, PORT))
-    print('Bound to', HOST, PORT)
+    if verbose:
+        print('Bound to', HOST, PORT)
 
-    while True:
+    t_start = clock.monotonic()
+    while not time_is_up():
         t0_dict = {}
         for key in asm_dict.keys():
-            t0_dict[key] = time.time()  # Keeps track of time for every assembly. Used for update_heaters()
+            t0_dict[key] = clock.monotonic()  # Keeps track of time for every assembly. Used for update_heaters()
 
         while True:  # Listen for connections for one second. If timeout, update heaters using stored PID settings.
-            s.settimeout(1)
+            if time_is_up():
+                s.close()
+                return
+            s.settimeout(accept_timeout)
+            t_listen = clock.monotonic()
             try:
-                print('listening')
+                if verbose:
+                    print('listening')
                 s.listen()
                 conn, addr = s.accept()
                 break
             except socket.timeout:
-                t0_dict, out_dict = update_heaters(asm_dict, t0_dict)
+                clock.sleep(max(0, 1 - (clock.monotonic() - t_listen)))  # no-op with the real clock
+                t0_dict, out_dict = update(t0_dict)
 
         conn.setblocking(False)
-        print(f"Connected by {addr}")
+        if verbose:
+            print(f"Connected by {addr}")
         with conn:  # with connection: regulate oven, then listen for commands to carry on.
-            while True:
-                t0_dict, out_dict = update_heaters(asm_dict, t0_dict)
-                time.sleep(0.2)
+            while not time_is_up():
+                t0_dict, out_dict = update(t0_dict)
+                clock.sleep(0.2)
                 try:
                     data = conn.recv(1024).decode('utf-8').upper()
                     if not data:
-                        print(f"Disconnected by {addr}")
+                        if verbose:
+                            print(f"Disconnected by {addr}")
                         break
 
-                    print(data)
+                    if verbose:
+                        print(data)
                     out = process_command(data, asm_dict)
                     if out is None:
                         out = 'NOERROR'
@@ -388,14 +535,17 @@ def server_loop(asm_dict):
                 except BlockingIOError:
                     pass
                 except ConnectionResetError:  # if connection is lost, go back to listening for connections.
-                    print(f"Disconnected by {addr}")
+                    if verbose:
+                        print(f"Disconnected by {addr}")
                     break
 
+    s.close()
+
 
 ########################################################################################################################
 ########################################################################################################################
 #
-# FOR REGULAR SETUP, DO NOT MODIFY CODE ABOVE THESE LINES, except for check line 347.
+# FOR REGULAR SETUP, DO NOT MODIFY CODE ABOVE THESE LINES, except for the HOST line in server_loop().
 #
 ########################################################################################################################
 ########################################################################################################################
@@ -457,4 +607,5 @@ def main():
     server_loop(asm_dict)
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""
+Tools for finding the PID gains of a HeaterAssembly. A first-order-plus-dead-time (FOPDT) model is fitted to a logged
+step response, and a grid of Kp, Ki, and Kd values is then simulated against the model in parallel on all the CPU
+cores. Every gain set is scored on overshoot, settling time, and energy. The best gains can be sent to an oven with
+push_gains(), which uses the PD:KPRO, PD:KINT, and PD:KDER commands.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+try:
+    from assemblies import PidBank
+except ModuleNotFoundError:
+    from automation.assemblies import PidBank
+
+
+class FopdtModel:
+    def __init__(self, K, tau, theta, y0=0.0, u0=0.0):
+        """
+        First-order-plus-dead-time model of a heater assembly.
+
+            tau dy/dt = -(y - y0) + K (u(t - theta) - u0)
+
+        The input u is the output of the PID, which for a HeaterAssembly is the power supply voltage. The model is a
+        linearization around the operating point of the step response, so it is most accurate near the temperatures
+        where the step was recorded.
+
+        Parameters
+        ----------
+        K : float
+            process gain in degrees per volt.
+        tau : float
+            time constant in seconds.
+        theta : float
+            dead time in seconds.
+        y0 : float
+            temperature at the operating point.
+        u0 : float
+            input at the operating point.
+        """
+        self.K = K
+        self.tau = tau
+        self.theta = theta
+        self.y0 = y0
+        self.u0 = u0
+
+    def __repr__(self):
+        return 'FopdtModel(K=' + str(self.K) + ', tau=' + str(self.tau) + ', theta=' + str(self.theta) + ', y0=' + \
+            str(self.y0) + ', u0=' + str(self.u0) + ')'
+
+    def step_response(self, t, u1, t_step=0.0):
+        """
+        Parameters
+        ----------
+        t : array of float
+            times in seconds.
+        u1 : float
+            input after the step. The input is u0 before t_step.
+        t_step : float
+            time of the step.
+
+        Returns
+        -------
+        numpy array
+            temperatures at times t.
+        """
+        t = np.asarray(t, dtype=float)
+        elapsed = np.maximum(t - t_step - self.theta, 0)
+        return self.y0 + self.K * (u1 - self.u0) * (1 - np.exp(-elapsed / self.tau))
+
+    def simc_gains(self, tau_c=None):
+        """
+        Starting point for the gain search, using the SIMC tuning rules (Skogestad).
+
+        Parameters
+        ----------
+        tau_c : float, None
+            desired closed loop time constant. Defaults to the dead time, or tau/10 if there is no dead time.
+
+        Returns
+        -------
+        three tuple of float
+            Kp, Ki, Kd in the units used by simple_pid.
+        """
+        if tau_c is None:
+            tau_c = self.theta if self.theta > 0 else self.tau / 10
+        kp = self.tau / (self.K * (tau_c + self.theta))
+        ti = min(self.tau, 4 * (tau_c + self.theta))
+        return kp, kp / ti, 0.0
+
+
+def fit_fopdt(t, temps, volts):
+    """
+    Fit a FopdtModel to a logged open loop step response. The step time is the first point where the voltage is
+    different from the starting voltage. Every point before the step is used to find the starting temperature.
+
+    Parameters
+    ----------
+    t : array of float
+        times in seconds.
+    temps : array of float
+        measured temperatures.
+    volts : array of float
+        power supply voltage at every time. Should contain a single step.
+
+    Returns
+    -------
+    FopdtModel
+    """
+    t = np.asarray(t, dtype=float)
+    temps = np.asarray(temps, dtype=float)
+    volts = np.asarray(volts, dtype=float)
+    if not (len(t) == len(temps) == len(volts)):
+        raise ValueError('t, temps, and volts must have the same length')
+
+    u0 = volts[0]
+    changed = np.nonzero(volts != u0)[0]
+    if len(changed) == 0:
+        raise ValueError('no step found in volts')
+    i_step = changed[0]
+    t_step = t[i_step]
+    u1 = volts[i_step]
+    y0 = np.mean(temps[:i_step])
+    du = u1 - u0
+
+    # initial guess from the two point method, using the times at 28.3% and 63.2% of the final change
+    after = t >= t_step
+    dy = temps[-1] - y0
+    frac = (temps[after] - y0) / dy
+    t_after = t[after] - t_step
+    t28 = t_after[np.argmax(frac >= 0.283)]
+    t63 = t_after[np.argmax(frac >= 0.632)]
+    tau_guess = max(1.5 * (t63 - t28), 1e-3)
+    theta_guess = max(t63 - tau_guess, 0)
+    k_guess = dy / du
+
+    def fopdt(t_, k, tau, theta):
+        elapsed = np.maximum(t_ - t_step - theta, 0)
+        return y0 + k * du * (1 - np.exp(-elapsed / tau))
+
+    popt, _ = curve_fit(
+        fopdt, t, temps,
+        p0=[k_guess, tau_guess, theta_guess],
+        bounds=([-np.inf, 1e-6, 0], [np.inf, np.inf, t[-1] - t_step]),
+    )
+    return FopdtModel(popt[0], popt[1], popt[2], y0, u0)
+
+
+def record_step_response(oven, asm_key, volts, duration, period=2, clock=time):
+    """
+    Record an open loop step response of an assembly of an Oven. PID regulation is turned off, the supply voltage is
+    stepped to volts, and the temperature is logged every period seconds. The supply is stopped at the end.
+
+    Parameters
+    ----------
+    oven : Oven
+    asm_key : str or int
+        assembly to use.
+    volts : float
+        supply voltage after the step.
+    duration : float
+        seconds to record after the step.
+    period : float
+        seconds between readings.
+    clock : module or object
+        Must have time() and sleep() methods. Defaults to the time module.
+
+    Returns
+    -------
+    three tuple of numpy arrays
+        times, temperatures, and voltages. Can be passed to fit_fopdt().
+    """
+    oven.set_pid_regulation(asm_key, False)
+    oven.ready_supply(asm_key)
+
+    t_log = []
+    temp_log = []
+    volt_log = []
+    t0 = clock.time()
+    for i in range(3):  # baseline before the step
+        t_log.append(clock.time() - t0)
+        temp_log.append(oven.get_daq_temp(asm_key))
+        volt_log.append(0.0)
+        clock.sleep(period)
+
+    oven.set_supply_voltage(asm_key, volts)
+    t_end = clock.time() + duration
+    while clock.time() < t_end:
+        t_log.append(clock.time() - t0)
+        temp_log.append(oven.get_daq_temp(asm_key))
+        volt_log.append(volts)
+        clock.sleep(period)
+
+    oven.stop_supply(asm_key)
+    return np.array(t_log), np.array(temp_log), np.array(volt_log)
+
+
+def _simulate_chunk(args):
+    """
+    Simulate the closed loop step response of a chunk of gain sets against a FopdtModel. Runs in a worker process.
+    All the gain sets of the chunk are simulated at once as the rows of a PidBank.
+    """
+    model, gains, setpoint, sample_time, output_limits, duration, substeps, band = args
+    kp, ki, kd = gains
+    n = len(kp)
+
+    h = sample_time / substeps
+    a = np.exp(-h / model.tau)
+    delay = int(round(model.theta / h))
+    n_steps = int(np.ceil(duration / h))
+
+    bank = PidBank(n, kp, ki, kd, setpoint, sample_time, output_limits)
+    u_buffer = np.full((delay + 1, n), float(model.u0))
+    y = np.full(n, float(model.y0))
+    u = np.full(n, float(model.u0))
+
+    y_max = y.copy()
+    energy = np.zeros(n)
+    last_outside = np.zeros(n)
+    step_size = abs(setpoint - model.y0)
+    for k in range(n_steps):
+        if k % substeps == 0:
+            u = bank.step(y, sample_time)
+        u_buffer[k % (delay + 1)] = u
+        u_delayed = u_buffer[(k + 1) % (delay + 1)]
+        y = a * y + (1 - a) * (model.y0 + model.K * (u_delayed - model.u0))
+
+        y_max = np.maximum(y_max, y)
+        energy += u ** 2 * h
+        outside = np.abs(y - setpoint) > band * step_size
+        last_outside = np.where(outside, (k + 1) * h, last_outside)
+
+    overshoot = np.maximum(y_max - setpoint, 0) / step_size * 100
+    return overshoot, last_outside, energy
+
+
+def _grid(values):
+    kp, ki, kd = np.meshgrid(*values, indexing='ij')
+    return kp.ravel(), ki.ravel(), kd.ravel()
+
+
+def tune_pid(
+        model,
+        setpoint,
+        kp_values=None,
+        ki_values=None,
+        kd_values=None,
+        sample_time=2,
+        output_limits=(0, 30),
+        duration=None,
+        overshoot_weight=1.0,
+        settling_weight=1.0,
+        energy_weight=0.1,
+        band=0.02,
+        refinements=1,
+        substeps=4,
+        processes=None,
+        chunk_size=None,
+):
+    """
+    Search for the PID gains that give the best closed loop step response from model.y0 to setpoint. Every
+    combination of kp_values, ki_values, and kd_values is simulated against the model. The grid is split in chunks
+    that are simulated in parallel by a process pool. After the grid, every refinement builds a finer grid around the
+    best gains found so far.
+
+    The score of every gain set is
+
+        overshoot_weight * overshoot / 100 + settling_weight * settling_time / duration
+        + energy_weight * energy / steady_energy
+
+    where steady_energy is the energy needed to hold the setpoint for the whole duration. Lower is better.
+
+    Parameters
+    ----------
+    model : FopdtModel
+    setpoint : float
+        temperature to step to.
+    kp_values, ki_values, kd_values : array of float, None
+        values to search. None uses a logarithmic grid around the SIMC gains of the model.
+    sample_time : float
+        sample time of the PID in seconds.
+    output_limits : two tuple of float
+        lower and upper limits of the PID output. Usually (0, assembly MAX voltage).
+    duration : float, None
+        seconds of simulated time. Defaults to 10 * (tau + theta).
+    overshoot_weight, settling_weight, energy_weight : float
+        weights of the score.
+    band : float
+        settling band as a fraction of the step size.
+    refinements : int
+        number of finer grids to run around the best gains.
+    substeps : int
+        integration steps of the model per PID sample.
+    processes : int, None
+        number of worker processes. None uses all the cores. 1 runs everything in the current process.
+    chunk_size : int, None
+        number of gain sets simulated by every task. None splits every grid in two tasks per worker process.
+
+    Returns
+    -------
+    two tuple of three tuple of float and dictionary of str: numpy array
+        The best Kp, Ki, and Kd, and a table with the keys 'kp', 'ki', 'kd', 'overshoot', 'settling_time', 'energy',
+        and 'score', sorted from best to worst score.
+    """
+    if duration is None:
+        duration = 10 * (model.tau + model.theta)
+
+    kp0, ki0, kd0 = model.simc_gains()
+    if kp_values is None:
+        kp_values = kp0 * np.logspace(-1, 1, 9)
+    if ki_values is None:
+        ki_values = ki0 * np.logspace(-1.5, 1, 11)
+    if kd_values is None:
+        kd_values = kp0 * max(model.theta, sample_time) * np.array([0, 0.125, 0.25, 0.5])
+    values = [np.asarray(kp_values, dtype=float), np.asarray(ki_values, dtype=float),
+              np.asarray(kd_values, dtype=float)]
+
+    u_steady = model.u0 + (setpoint - model.y0) / model.K
+    steady_energy = max(u_steady ** 2 * duration, 1e-12)
+
+    table = {'kp': [], 'ki': [], 'kd': [], 'overshoot': [], 'settling_time': [], 'energy': []}
+    workers = processes if processes is not None else os.cpu_count() or 1
+    executor = None if workers == 1 else ProcessPoolExecutor(workers)
+    try:
+        for r in range(refinements + 1):
+            kp, ki, kd = _grid(values)
+            size = chunk_size if chunk_size is not None else int(np.ceil(len(kp) / (2 * workers)))
+            tasks = []
+            for i in range(0, len(kp), size):
+                gains = (kp[i:i + size], ki[i:i + size], kd[i:i + size])
+                tasks.append((model, gains, setpoint, sample_time, output_limits, duration, substeps, band))
+
+            if executor is None:
+                results = map(_simulate_chunk, tasks)
+            else:
+                results = executor.map(_simulate_chunk, tasks)
+
+            for task, (overshoot, settling_time, energy) in zip(tasks, results):
+                table['kp'].append(task[1][0])
+                table['ki'].append(task[1][1])
+                table['kd'].append(task[1][2])
+                table['overshoot'].append(overshoot)
+                table['settling_time'].append(settling_time)
+                table['energy'].append(energy)
+
+            flat = {key: np.concatenate(val) for key, val in table.items()}
+            score = _score(flat, duration, steady_energy, overshoot_weight, settling_weight, energy_weight)
+            best = np.argmin(score)
+            best_gains = [flat[key][best] for key in ('kp', 'ki', 'kd')]
+
+            # zoom in around the best gains. Every new grid spans the neighbouring points of the previous one.
+            new_values = []
+            for v, g in zip(values, best_gains):
+                v = np.unique(v)
+                j = np.searchsorted(v, g)
+                lo = v[max(j - 1, 0)]
+                hi = v[min(j + 1, len(v) - 1)]
+                new_values.append(np.linspace(lo, hi, len(v)) if len(v) > 1 else v)
+            values = new_values
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    table = {key: np.concatenate(val) for key, val in table.items()}
+    table['score'] = _score(table, duration, steady_energy, overshoot_weight, settling_weight, energy_weight)
+    order = np.argsort(table['score'], kind='stable')
+    table = {key: val[order] for key, val in table.items()}
+
+    return (table['kp'][0], table['ki'][0], table['kd'][0]), table
+
+
+def _score(table, duration, steady_energy, overshoot_weight, settling_weight, energy_weight):
+    return overshoot_weight * table['overshoot'] / 100 + settling_weight * table['settling_time'] / duration + \
+        energy_weight * table['energy'] / steady_energy
+
+
+def push_gains(oven, asm_key, gains):
+    """
+    Send a gain set to an assembly of an Oven using the PD:KPRO, PD:KINT, and PD:KDER commands.
+
+    Parameters
+    ----------
+    oven : Oven
+    asm_key : str or int
+    gains : three tuple of float
+        Kp, Ki, and Kd. Usually the first item returned by tune_pid().
+
+    Returns
+    -------
+    None
+        If successful.
+    str
+        Else, the first error string returned by the oven.
+    """
+    kp, ki, kd = gains
+    for setter, k in ((oven.set_pid_kpro, kp), (oven.set_pid_kint, ki), (oven.set_pid_kder, kd)):
+        err = setter(asm_key, float(k))
+        if err is not None:
+            return err
@@ -0,0 +1,470 @@
+"""
+Generic scans over any number of motion axes, measuring any number of readouts at every point. Axes and readouts are
+thin wrappers around the device classes in device_models.py, so the same scan code works with a Vxm slide, a Model8742
+picomotor, an ELL14K rotation mount, a gaussmeter, an RGA, or a temperature DAQ. Results are streamed to a text file with
+one column per quantity, or to a binary .cdat file (check coil_data.ColumnWriter), and an interrupted scan can be resumed
+from the last completed point.
+"""
+import os
+import time
+
+import numpy as np
+
+try:
+    from coil_data import BINARY_EXTENSION
+    from coil_data import ColumnWriter
+    from coil_data import load_column_file
+except ModuleNotFoundError:
+    from automation.coil_data import BINARY_EXTENSION
+    from automation.coil_data import ColumnWriter
+    from automation.coil_data import load_column_file
+
+
+# ======================================================================================================================
+# Axes
+# ======================================================================================================================
+class VxmAxis:
+    def __init__(self, vx, channel=1, name=None):
+        """
+        A channel of a Vxm motor controller used as a scan axis. Positions are in steps with respect to the origin of
+        the channel.
+
+        Parameters
+        ----------
+        vx : Vxm
+        channel : int
+            motor channel.
+        name : str, None
+            name of the column in the scan file. Defaults to vxm<channel>.
+        """
+        self._vx = vx
+        self._channel = channel
+        self._position = None
+        self.name = name if name is not None else 'vxm' + str(channel)
+
+    def move_to(self, position):
+        self._vx.set_position(self._channel, int(position))
+        self._position = int(position)
+
+    @property
+    def position(self):
+        return self._position
+
+
+class PicomotorAxis:
+    def __init__(self, pm, channel=1, name=None):
+        """
+        A channel of a Model8742 picomotor controller used as a scan axis. Positions are in steps with respect to the
+        origin of the channel.
+
+        Parameters
+        ----------
+        pm : Model8742
+        channel : int
+            motor channel.
+        name : str, None
+            name of the column in the scan file. Defaults to pico<channel>.
+        """
+        self._pm = pm
+        self._channel = channel
+        self.name = name if name is not None else 'pico' + str(channel)
+
+    def move_to(self, position):
+        self._pm.set_position(self._channel, int(position))
+
+    @property
+    def position(self):
+        return self._pm.get_instant_position(self._channel)
+
+
+class ElliptecAxis:
+    def __init__(self, ell, address='0', name=None):
+        """
+        A Thorlabs ELL14K rotation mount used as a scan axis. Positions are angles in degrees.
+
+        Parameters
+        ----------
+        ell : ELL14K
+        address : str
+            address of the mount on the Elliptec bus.
+        name : str, None
+            name of the column in the scan file. Defaults to ell<address>.
+        """
+        self._ell = ell
+        self._address = address
+        self.name = name if name is not None else 'ell' + str(address)
+
+    def move_to(self, position):
+        out = self._ell.move_absolute(position, self._address)
+        if isinstance(out, str):
+            print(out)
+
+    @property
+    def position(self):
+        return self._ell.get_position(self._address)
+
+
+# ======================================================================================================================
+# Readouts
+# ======================================================================================================================
+class GaussmeterReadout:
+    def __init__(self, gm, n=None, name='b', target_sem=None):
+        """
+        z field of a Gm3 or Series9550 gaussmeter.
+
+        Parameters
+        ----------
+        gm : Gm3, Series9550
+        n : int, None
+            number of readings to average with get_avg_zfield(). If None, take a single reading with get_zfield().
+        name : str
+            name of the field column. If n is given, a second column with the standard error is added.
+        target_sem : float, None
+            If given with n, every point is averaged until the standard error is at most target_sem gauss. Check
+            acquisition.average_readings().
+        """
+        self._gm = gm
+        self._n = n
+        self._target_sem = target_sem
+        if n is None:
+            self.columns = (name,)
+        else:
+            self.columns = (name, name + 'err')
+
+    def read(self):
+        if self._n is None:
+            return self._gm.get_zfield(),
+        if self._target_sem is None:
+            return self._gm.get_avg_zfield(self._n)
+        return self._gm.get_avg_zfield(self._n, target_sem=self._target_sem)
+
+
+class TemperatureReadout:
+    def __init__(self, daq, channel=0, units=None, name=None):
+        """
+        Temperature of a channel of an MCC DAQ, or of any device with a get_temp(channel, units) method.
+
+        Parameters
+        ----------
+        daq : MccDeviceLinux, MccDeviceWindows
+        channel : int
+        units : str, None
+            check the docstring of the DAQ for valid units. None uses the default units of the DAQ.
+        name : str, None
+            name of the column. Defaults to temp<channel>.
+        """
+        self._daq = daq
+        self._channel = channel
+        self._units = units
+        self.columns = (name if name is not None else 'temp' + str(channel),)
+
+    def read(self):
+        return self._daq.get_temp(self._channel, self._units),
+
+
+class RgaReadout:
+    def __init__(self, rga, masses, speed=8):
+        """
+        Partial pressures of an Srs100 RGA at a few masses.
+
+        Parameters
+        ----------
+        rga : Srs100
+        masses : list of int
+            masses in amu.
+        speed : int
+            noise floor or speed. Check Srs100.get_single_mass_measurement().
+        """
+        self._rga = rga
+        self._masses = list(masses)
+        self._speed = speed
+        self.columns = tuple('p' + str(m) for m in self._masses)
+
+    def read(self):
+        return tuple(self._rga.get_single_mass_measurement(m, self._speed) for m in self._masses)
+
+
+class FunctionReadout:
+    def __init__(self, columns, func):
+        """
+        Any other measurement.
+
+        Parameters
+        ----------
+        columns : tuple of str
+            names of the values returned by func.
+        func : callable
+            takes no arguments and returns a tuple with one value per column.
+        """
+        self.columns = tuple(columns)
+        self._func = func
+
+    def read(self):
+        return tuple(self._func())
+
+
+# ======================================================================================================================
+# Trajectories
+# ======================================================================================================================
+def raster(*axis_positions):
+    """
+    Every combination of the positions of the axes. The last axis moves fastest.
+
+    Parameters
+    ----------
+    axis_positions : array of float
+        one array of positions per axis.
+
+    Returns
+    -------
+    numpy array
+        one row per point, one column per axis.
+    """
+    grids = np.meshgrid(*axis_positions, indexing='ij')
+    return np.stack([g.ravel() for g in grids], axis=1)
+
+
+def snake(*axis_positions):
+    """
+    Same points as raster(), but the faster axes change direction on every pass, so the motors never travel back to
+    the start of a line.
+
+    Parameters
+    ----------
+    axis_positions : array of float
+        one array of positions per axis.
+
+    Returns
+    -------
+    numpy array
+        one row per point, one column per axis.
+    """
+    first = np.asarray(axis_positions[0], dtype=float)
+    if len(axis_positions) == 1:
+        return first.reshape(-1, 1)
+
+    inner = snake(*axis_positions[1:])
+    blocks = []
+    for i, x in enumerate(first):
+        block = inner if i % 2 == 0 else inner[::-1]
+        blocks.append(np.column_stack([np.full(len(block), x), block]))
+    return np.concatenate(blocks)
+
+
+def list_trajectory(points):
+    """
+    Parameters
+    ----------
+    points : list of tuple of float, or list of float for a single axis
+        points in the order they should be visited.
+
+    Returns
+    -------
+    numpy array
+        one row per point, one column per axis.
+    """
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 1:
+        points = points.reshape(-1, 1)
+    return points
+
+
+# ======================================================================================================================
+# Scan
+# ======================================================================================================================
+class Scan:
+    def __init__(self, axes, readouts, trajectory, filename, settle_time=0.0, notes=''):
+        """
+        Moves the axes through the points of a trajectory and measures every readout at every point. Every point is
+        written to filename as soon as it is measured, as one line of comma separated values. The file starts with a
+        few header lines that start with #, followed by a line with the names of the columns:
+
+            index, <axis names>, <readout columns>
+
+        If filename ends in .cdat, the points are written instead as rows of a binary file with ColumnWriter, with the
+        number of points and the notes in its metadata. Both kinds of file are read with load_scan().
+
+        Parameters
+        ----------
+        axes : list of VxmAxis, PicomotorAxis, ElliptecAxis, or any object with name, move_to(position)
+        readouts : list of GaussmeterReadout, TemperatureReadout, RgaReadout, FunctionReadout, or any object with
+            columns and read()
+        trajectory : numpy array
+            one row per point, one column per axis. Usually created with raster(), snake(), or list_trajectory().
+        filename : str
+            path of the scan file. Text, unless it ends in .cdat.
+        settle_time : float
+            seconds to wait after every motion before measuring.
+        notes : str
+            written in the header of the file.
+        """
+        trajectory = np.asarray(trajectory, dtype=float)
+        if trajectory.ndim != 2 or trajectory.shape[1] != len(axes):
+            raise ValueError('trajectory must have one column per axis')
+
+        self._axes = list(axes)
+        self._readouts = list(readouts)
+        self._trajectory = trajectory
+        self._filename = filename
+        self._binary = filename.endswith(BINARY_EXTENSION)
+        self._settle_time = settle_time
+        self._notes = notes
+
+        self.columns = ['index'] + [ax.name for ax in self._axes]
+        for r in self._readouts:
+            self.columns += list(r.columns)
+
+    def _write_header(self, file):
+        file.write('# scan of ' + str(len(self._trajectory)) + ' points\n')
+        for line in self._notes.splitlines():
+            file.write('# ' + line + '\n')
+        file.write(','.join(self.columns) + '\n')
+
+    def _completed_points(self):
+        """
+        Read the points already in the scan file, and drop a last line that was only partly written.
+
+        Returns
+        -------
+        numpy array
+            one row per completed point.
+        """
+        data = load_scan(self._filename)
+        if list(data) != self.columns:
+            raise ValueError('columns of ' + self._filename + ' do not match this scan')
+        done = np.column_stack([data[c] for c in self.columns]) if len(data['index']) else \
+            np.zeros((0, len(self.columns)))
+
+        n_axes = len(self._axes)
+        if len(done) > len(self._trajectory) or \
+                not np.allclose(done[:, 1:1 + n_axes], self._trajectory[:len(done)], equal_nan=True):
+            raise ValueError('points in ' + self._filename + ' do not match the trajectory of this scan')
+
+        if self._binary:  # a partial last row is removed by ColumnWriter
+            return done
+        with open(self._filename, 'rb+') as file:  # remove a partial last line
+            content = file.read()
+            if content and not content.endswith(b'\n'):
+                file.truncate(content.rfind(b'\n') + 1)
+        return done
+
+    def run(self, resume=True, verbose=True):
+        """
+        Run the scan. If resume is True and the scan file already exists, the points in the file are kept and the scan
+        continues from the first point that is missing.
+
+        Parameters
+        ----------
+        resume : bool
+            If False, an existing file is overwritten.
+        verbose : bool
+            If True, print every point.
+
+        Returns
+        -------
+        dictionary of str: numpy array
+            one array per column, with one value per point of the trajectory.
+        """
+        n_points = len(self._trajectory)
+        data = np.full((n_points, len(self.columns)), np.nan)
+        data[:, 0] = np.arange(n_points)
+        data[:, 1:1 + len(self._axes)] = self._trajectory
+
+        start = 0
+        if resume and os.path.exists(self._filename):
+            done = self._completed_points()
+            data[:len(done)] = done
+            start = len(done)
+            if self._binary:
+                file = ColumnWriter(self._filename, append=True)
+            else:
+                file = open(self._filename, 'a')
+            if verbose:
+                print('resuming scan at point', start, 'of', n_points)
+        elif self._binary:
+            file = ColumnWriter(self._filename, self.columns, {'points': n_points, 'notes': self._notes})
+        else:
+            file = open(self._filename, 'w')
+            self._write_header(file)
+            file.flush()
+
+        last = [None] * len(self._axes)
+        try:
+            for i in range(start, n_points):
+                point = self._trajectory[i]
+                moved = False
+                for j, ax in enumerate(self._axes):
+                    if last[j] != point[j]:
+                        ax.move_to(point[j])
+                        last[j] = point[j]
+                        moved = True
+                if moved and self._settle_time:
+                    time.sleep(self._settle_time)
+
+                values = []
+                for r in self._readouts:
+                    values += list(r.read())
+                row = data[i]
+                col = 1 + len(self._axes)
+                for v in values:
+                    try:
+                        row[col] = float(v)
+                    except (TypeError, ValueError):
+                        print('point', i, ':', v)  # error string from the device
+                    col += 1
+
+                if self._binary:
+                    file.append(row)
+                else:
+                    file.write(','.join([str(int(row[0]))] + [repr(float(v)) for v in row[1:]]) + '\n')
+                    file.flush()
+                if verbose:
+                    print(i, row[1:])
+        finally:
+            file.close()
+
+        return {c: data[:, k] for k, c in enumerate(self.columns)}
+
+    @property
+    def trajectory(self):
+        return self._trajectory.copy()
+
+
+def load_scan(filename):
+    """
+    Read a file written by Scan.run().
+
+    Parameters
+    ----------
+    filename : str
+        text file, or binary file if it ends in .cdat.
+
+    Returns
+    -------
+    dictionary of str: numpy array
+        one array per column, one value per completed point.
+    """
+    if filename.endswith(BINARY_EXTENSION):
+        f = load_column_file(filename, mmap=False)  # no memory map, so the file can be appended to when resuming
+        return {c: f[c] for c in f.columns}
+
+    with open(filename, 'r') as file:
+        lines = file.read().split('\n')
+
+    i = 0
+    while i < len(lines) and lines[i].startswith('#'):
+        i += 1
+    columns = lines[i].split(',')
+
+    rows = []
+    for line in lines[i + 1:-1]:  # the last item is empty, or a line that was only partly written
+        fields = line.split(',')
+        if len(fields) != len(columns):
+            continue  # empty or partial line
+        try:
+            rows.append([float(f) for f in fields])
+        except ValueError:
+            continue
+
+    data = np.asarray(rows, dtype=float).reshape(-1, len(columns))
+    return {c: data[:, k] for k, c in enumerate(columns)}
@@ -0,0 +1,91 @@
+"""
+Benchmark of the ways of collecting points in an acquisition loop, for 10^4 to 10^6 points. np.append() copies the
+whole array on every point, so it is only timed up to 10^5 points.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from automation.acquisition import GrowableArray
+from automation.measure_coil_field import process_file
+
+
+def with_np_append(n):
+    out = np.asarray([])
+    for i in range(n):
+        out = np.append(out, i * 0.5)
+    return out
+
+
+def with_growable_array(n):
+    out = GrowableArray()
+    for i in range(n):
+        out.append(i * 0.5)
+    return out.to_array()
+
+
+def with_preallocated(n):
+    out = np.empty(n)
+    for i in range(n):
+        out[i] = i * 0.5
+    return out
+
+
+def process_file_np_append(file_, n_cols):  # process_file() before GrowableArray
+    out = []
+    for i in range(n_cols):
+        out.append(np.asarray([]))
+    with open(file_, 'r') as file:
+        data = file.readline()
+        while data != '\n':
+            try:
+                cols = data.split(',')
+                for i in range(n_cols):
+                    out[i] = np.append(out[i], float(cols[i]))
+            except (ValueError, IndexError):
+                pass
+            data = file.readline()
+    return out
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    out = func(*args)
+    return time.perf_counter() - t0, out
+
+
+def testing_loops(sizes=(10**4, 10**5, 10**6)):
+    print('points      np.append   GrowableArray   preallocated')
+    for n in sizes:
+        t_append = timed(with_np_append, n)[0] if n <= 10**5 else np.nan
+        t_grow, a = timed(with_growable_array, n)
+        t_pre, b = timed(with_preallocated, n)
+        assert np.array_equal(a, b)
+        print(f'{n:<10d}  {t_append:9.3f}   {t_grow:13.3f}   {t_pre:12.3f}   s')
+
+
+def testing_process_file(sizes=(10**4, 10**5, 10**6)):
+    print('lines       old process_file   process_file')
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            name = os.path.join(tmp, 'data.txt')
+            with open(name, 'w') as f:
+                f.write('F.W.BELL,MODEL 9550,V1.1;\n, average for 10 data points\nV = 20, A = 2.3\n')
+                pos = np.arange(n)
+                np.savetxt(f, np.column_stack([pos, np.sin(pos), np.full(n, 0.01)]), delimiter=',')
+                f.write('\n')
+            t_old = timed(process_file_np_append, name, 3)[0] if n <= 10**5 else np.nan
+            t_new, out = timed(process_file, name, 3)
+            assert len(out[0]) == n and np.allclose(out[1], np.sin(pos))
+            print(f'{n:<10d}  {t_old:16.3f}   {t_new:12.3f}   s')
+
+
+def main():
+    testing_loops()
+    testing_process_file()
+
+
+if __name__ == '__main__':
+    main()
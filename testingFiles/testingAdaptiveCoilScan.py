@@ -0,0 +1,181 @@
+"""
+Compares a uniform get_pos_b() scan against get_pos_b_adaptive() on a simulated coil. Both data sets are fitted with
+get_field_fit(). Time runs 50 times faster than real time.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+import automation.measure_coil_field as mcf
+from automation.acquisition import run_in_background
+
+
+class ScaledTime:
+    def __init__(self, scale):
+        import time
+        self._time = time
+        self._scale = scale
+
+    def time(self):
+        return self._time.time() / self._scale
+
+    def sleep(self, seconds):
+        self._time.sleep(seconds * self._scale)
+
+
+clock = ScaledTime(0.02)
+
+
+def coil_field(z, amps=2.3, n=60, z0=6260, side=0.7378954):  # same model as get_field_fit() for a large coil
+    x = (z - z0) * 6.8E-6
+    return 2e-7*amps*n*side**2 / (x**2 + side**2/4) / np.sqrt(x**2 + side**2/2) * 10000
+
+
+class FakePowerSupply:
+    def set_current_limit(self, channel, amps): pass
+    def set_voltage(self, channel, volts): pass
+    def set_current(self, channel, amps): pass
+    def set_channel_state(self, channel, state): pass
+    def get_actual_voltage(self, channel): return 20
+    def get_actual_current(self, channel): return 2.3
+    def zero_all_channels(self): pass
+
+
+class FakeGaussmeter:
+    def __init__(self, vx, field, noise=0.003):
+        self._vx = vx
+        self._field = field
+        self._noise = noise
+        self._rng = np.random.default_rng(0)
+        self.idn = 'Simulated gaussmeter'
+        self.readings = 0
+
+    def autozero(self): pass
+    def disconnect(self): pass
+
+    def get_zfield(self):
+        clock.sleep(0.03)
+        self.readings += 1
+        return self._field(self._vx.position) + self._rng.normal(0, self._noise)
+
+
+class FakeVxm:
+    def __init__(self):
+        self.position = 0
+        self.moves = 0
+        self._motion = None
+
+    def set_speed(self, channel, speed): pass
+    def set_acceleration(self, channel, acc): pass
+    def set_origin(self, channel): self.position = 0
+    def disconnect(self): pass
+
+    def _move(self, steps):
+        clock.sleep(0.35 + abs(steps) / 1000)
+        self.position += steps
+        self.moves += 1
+        return '^'
+
+    def displace(self, channel, steps):
+        return self._move(steps)
+
+    def set_position(self, channel, pos):
+        return self._move(pos - self.position)
+
+    def displace_async(self, channel, steps):  # same as Vxm.displace_async()
+        self._motion = run_in_background(self.displace, channel, steps)
+        return self._motion
+
+    def is_moving(self):
+        return self._motion is not None and not self._motion.done()
+
+    def wait_motion(self):
+        motion, self._motion = self._motion, None
+        return None if motion is None else motion.result()
+
+
+def coil_field_with_bump(z):
+    """
+    coil field plus a narrow feature, for example from a magnetic part close to the probe path.
+    """
+    return coil_field(z) + 0.5 * np.exp(-((z - 11000) / 400) ** 2)
+
+
+def testing_adaptive(field=coil_field, tolerance=0.01, fit=True):
+    """
+    Scans the simulated field uniformly every 100 steps and adaptively. Prints the cost of every scan and the largest
+    error of the field interpolated between the measured points. If fit is True, also prints the error of the fit.
+    """
+    mcf.time = clock
+    grid = np.arange(0, 16000, 10)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs('data_coils/large1')
+        try:
+            results = {}
+            for name in ('uniform', 'adaptive'):
+                vx = FakeVxm()
+                gm = FakeGaussmeter(vx, field)
+                t0 = clock.time()
+                if name == 'uniform':
+                    pos, b, berr = mcf.get_pos_b('large1', FakePowerSupply(), gm, vx, 2.3, 10, 100)
+                else:
+                    pos, b, berr = mcf.get_pos_b_adaptive('large1', FakePowerSupply(), gm, vx, 2.3, 10,
+                                                          tolerance=tolerance)
+                interp_error = np.max(np.abs(np.interp(grid, pos, b) - field(grid))[grid <= pos[-1]])
+                fit_error = np.nan
+                if fit:
+                    pos_model, b_model, residuals = mcf.get_field_fit(pos, b, berr, 'large1', 2.3)
+                    fit_error = np.max(np.abs(np.interp(grid, pos_model, b_model) - field(grid))[grid <= pos[-1]])
+                results[name] = (len(pos), gm.readings, clock.time() - t0, interp_error, fit_error)
+        finally:
+            os.chdir(cwd)
+
+    for name, (points, readings, t, interp_error, fit_error) in results.items():
+        print(name + ':', points, 'points,', readings, 'readings,', round(t), 's, max interpolation error',
+              round(interp_error, 4), 'G, max fit error', round(fit_error, 4), 'G')
+    return results
+
+
+def testing_refine_positions():
+    pos = np.arange(0, 16001, 1000.0)
+    b = np.exp(-((pos - 8000) / 1500) ** 2)  # narrow peak in a flat field
+    new = mcf.refine_positions(pos, b, 0.01, 100)
+    print('narrow peak, new positions:', new)
+    assert np.all((new > 3000) & (new < 13000))
+    # with only two points, the interval is split only if it is at least 2 * min_step long
+    assert list(mcf.refine_positions([0, 1000], [0, 1], 0.01, 100)) == [500]
+    assert len(mcf.refine_positions([0, 150], [0, 1], 0.01, 100)) == 0
+
+
+def testing_weighted_opt_in():
+    pos = np.arange(0, 12001, 200.0)
+    b = coil_field(pos)
+    berr = np.linspace(0.001, 0.01, len(pos))
+    b_noisy = b + np.random.default_rng(1).normal(0, berr)
+    plain = mcf.get_field_fit(pos, b_noisy, berr, 'large1', 2.3)[2]
+    unweighted = mcf.get_field_fit(pos, b_noisy, None, 'large1', 2.3)[2]
+    weighted = mcf.get_field_fit(pos, b_noisy, berr, 'large1', 2.3, weighted=True)[2]
+    assert np.allclose(plain, unweighted)  # berr is ignored unless weighted is True
+    assert not np.allclose(weighted, unweighted)
+
+
+def main():
+    testing_refine_positions()
+    testing_weighted_opt_in()
+
+    print('coil field: the coarse pass is already enough')
+    results = testing_adaptive()
+    assert results['adaptive'][0] < results['uniform'][0] / 4
+    assert results['adaptive'][3] < 0.01 + 0.005
+
+    print('coil field with a narrow feature: points are added around the feature')
+    results = testing_adaptive(coil_field_with_bump, fit=False)
+    assert results['adaptive'][0] < results['uniform'][0] / 2
+    assert results['adaptive'][3] < 0.01 + 0.005
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Runs the alignment searches of alignment.py on a simulated beam: the signal is a gaussian of the positions of the
+channels, with noise, like a photodiode behind a mirror on a picomotor mount. First on instant motors, to compare the
+number of measurements and motor steps of every search, then on the simulated Model8742 of instrument_simulation.py.
+"""
+import time
+
+import numpy as np
+
+from automation.alignment import AlignmentProblem, PicomotorGroup, coordinate_search, nelder_mead, spsa
+from automation.instrument_simulation import SimulatedModel8742, connect_driver
+from automation.scans import FunctionReadout
+
+PEAK = np.array([1200, -800, 400, -300])
+WIDTH = np.array([1500, 1500, 3000, 3000])
+
+
+def beam(position, noise=0.0, rng=np.random.default_rng(0)):
+    position = np.asarray(position, dtype=float)
+    n = len(position)
+    r2 = np.sum(((position - PEAK[:n]) / WIDTH[:n]) ** 2)
+    return np.exp(-r2 / 2) + rng.normal(0, noise)
+
+
+class InstantMotors:
+    def __init__(self, n):
+        self.position = np.zeros(n, dtype=int)
+        self.moves = 0
+
+    def move_to(self, point):
+        self.position = np.asarray(point, dtype=int)
+        self.moves += 1
+
+
+def testing_searches(n_axes=2, noise=0.002):
+    print('search              measurements  steps    distance to peak  signal')
+    searches = {
+        'nelder_mead': lambda p: nelder_mead(p, step=500),
+        'coordinate_search': lambda p: coordinate_search(p, step=500),
+        'spsa': lambda p: spsa(p, step=300, perturbation=200, n_iter=60, seed=1),
+    }
+    for name, search in searches.items():
+        motors = InstantMotors(n_axes)
+        problem = AlignmentProblem(motors, lambda: beam(motors.position, noise), max_evaluations=150)
+        point, value = search(problem)
+        distance = np.linalg.norm(point - PEAK[:n_axes])
+        print('{:<19} {:<13} {:<8} {:<17.0f} {:.4f}'.format(name, problem.evaluations, problem.steps, distance, value))
+        assert np.array_equal(motors.position, point)
+        assert distance < 0.15 * WIDTH[0] and value > 0.97
+        assert len(problem.history) == problem.evaluations
+
+
+def testing_budget_and_reuse():
+    motors = InstantMotors(2)
+    problem = AlignmentProblem(motors, lambda: beam(motors.position), max_evaluations=1000, max_steps=5000)
+    coordinate_search(problem, step=500)
+    print(problem)
+    assert problem.steps <= 5000 + np.abs(problem.best_point).sum()  # the last move to the best point is not limited
+
+    motors = InstantMotors(2)
+    problem = AlignmentProblem(motors, lambda: beam(motors.position), maximize=False, max_evaluations=20)
+    problem.evaluate((100, 100))
+    problem.evaluate((100.4, 99.6))  # same whole steps, not measured again
+    assert problem.evaluations == 1 and motors.moves == 1
+    try:
+        coordinate_search(problem, shrink=2)
+    except ValueError as e:
+        print('ValueError:', e)
+
+
+def testing_picomotors(n_axes=4):
+    sim = SimulatedModel8742(velocity=20000, acceleration=2000000)
+    pm = connect_driver(sim)
+    channels = list(range(1, n_axes + 1))
+    for c in channels:
+        pm.get_velocity(c), pm.get_acceleration(c)
+    readout = FunctionReadout(('signal',), lambda: (beam([sim.position(c) for c in channels], 0.002),))
+
+    problem = AlignmentProblem(PicomotorGroup(pm, channels), readout, max_evaluations=200)
+    lines = sim.lines
+    t0 = time.perf_counter()
+    point, value = spsa(problem, step=400, perturbation=200, n_iter=80, seed=2)
+    print('spsa on', n_axes, 'picomotors:', round(time.perf_counter() - t0, 1), 's,', problem.evaluations,
+          'measurements,', sim.lines - lines, 'command lines, signal', round(value, 4), 'at', point)
+    assert value > 0.9
+    assert [sim.position(c) for c in channels] == list(point)
+    sim.stop()
+
+
+def main():
+    testing_searches()
+    testing_searches(n_axes=4)
+    testing_budget_and_reuse()
+    testing_picomotors()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Checks the non blocking autozero of the gaussmeters against the simulated Series9550 of instrument_simulation.py, and
+shows the time that a scan saves by setting up the motor while the meter zeroes.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import automation.device_models as device_models
+import automation.measure_coil_field as mcf
+from automation.coil_data import load_coil_file
+from automation.device_models import Gm3
+from automation.instrument_simulation import SimulatedSeries9550, connect_driver
+from automation.oven_simulation import VirtualClock
+
+
+def testing_polled_autozero():
+    clock = VirtualClock()
+    meter = SimulatedSeries9550(clock=clock, seed=0)
+    gm = connect_driver(meter)
+    t0 = clock.time()
+    assert gm.autozero() is True
+    took = clock.time() - t0
+    print('autozero took', round(took, 2), 's of virtual time, instead of a fixed 13 s')
+    assert 12 <= took < 13
+    assert abs(gm.get_avg_zfield(10)[0] - 2.2615) < 0.001
+
+    meter = SimulatedSeries9550(autozero_time=60, clock=clock, seed=0)
+    gm = connect_driver(meter)
+    out = gm.autozero(timeout=30)
+    print(out)
+    assert out.startswith('ERROR')
+    field = gm.get_zfield()  # not the late 1 of the *OPC? that timed out
+    print('first reading after the timeout:', field)
+    assert abs(field - 2.2615) < 0.01
+
+
+def testing_overlap(autozero_time=1.0, homing_time=0.8):
+    meter = SimulatedSeries9550(autozero_time=autozero_time, clock=time, seed=0)
+    gm = connect_driver(meter)
+    meter.timeout = 200
+
+    t0 = time.perf_counter()
+    gm.autozero()
+    time.sleep(homing_time)  # stands for homing the motor
+    sequential = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    zero = gm.autozero_async(poll_interval=0.05)
+    time.sleep(homing_time)
+    assert zero.result() is True
+    overlapped = time.perf_counter() - t0
+
+    print('autozero then homing:', round(sequential, 2), 's    at the same time:', round(overlapped, 2), 's')
+    assert overlapped < sequential - 0.5 * homing_time
+
+
+def testing_gm3_software_zero():
+    device_models.time = VirtualClock()
+    readings = iter(np.r_[np.full(10, 0.25), np.full(10, 2.5)])
+    gm = Gm3.__new__(Gm3)  # no serial port
+    gm.zero_offset = 0.0
+    gm.get_datapoint = lambda: [0, 0, 0, next(readings), 0]
+
+    assert gm.autozero_async(n=10).result() is True
+    print('GM3 zero offset:', gm.zero_offset)
+    assert np.isclose(gm.zero_offset, 0.25)
+    assert np.isclose(gm.get_avg_zfield(10)[0], 2.25)
+
+
+class FakePowerSupply:
+    def set_current_limit(self, channel, amps): pass
+    def set_voltage(self, channel, volts): pass
+    def set_current(self, channel, amps): pass
+    def set_channel_state(self, channel, state): pass
+    def get_actual_voltage(self, channel): return 20
+    def get_actual_current(self, channel): return 2.3
+
+
+class OfflineGm3(Gm3):
+    idn = 'GM3'
+
+
+class FakeVxm:
+    def set_speed(self, channel, speed): pass
+    def set_acceleration(self, channel, acc): pass
+
+
+def testing_gm3_scan_header():
+    """
+    The software zero of the GM3 is only used by coil scans that ask for it, and is written to the file.
+    """
+    mcf.time = device_models.time = VirtualClock()
+    gm = OfflineGm3.__new__(OfflineGm3)
+    gm.zero_offset = 0.0
+    gm.get_datapoint = lambda: [0, 0, 0, 0.25, 0]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs('data_coils/large1')
+        try:
+            for software_zero in (False, True):
+                file = mcf._start_coil_scan('large1', FakePowerSupply(), gm, FakeVxm(), 2.3, 10, 100, '',
+                                            software_zero=software_zero)
+                file.write_point(0, gm.get_zfield(), 0.001)
+                file.close()
+                time.sleep(1)  # files are named by the second
+            raw, zeroed = [load_coil_file('data_coils/large1/' + name) for name in
+                           sorted(os.listdir('data_coils/large1'))]
+        finally:
+            os.chdir(cwd)
+    print('raw:', raw.metadata['zero_offset'], raw['b'], ' zeroed:', zeroed.metadata['zero_offset'], zeroed['b'])
+    assert raw.metadata['zero_offset'] is None and raw['b'][0] == 0.25
+    assert np.isclose(zeroed.metadata['zero_offset'], 0.25) and np.isclose(zeroed['b'][0], 0)
+
+
+def main():
+    testing_polled_autozero()
+    testing_overlap()
+    testing_gm3_software_zero()
+    testing_gm3_scan_header()
+    mcf.time = time
+    device_models.time = time
+
+
+if __name__ == '__main__':
+    main()
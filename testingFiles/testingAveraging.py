@@ -0,0 +1,138 @@
+"""
+Checks the statistics of acquisition.py, and shows how many gaussmeter readings a precision target saves compared to a
+fixed number of readings.
+"""
+import time
+
+import numpy as np
+
+from automation.acquisition import RunningStats, average_readings, median_sem, trimmed_mean
+from automation.device_models import Series9550
+
+
+class NoisyField:
+    def __init__(self, field=2.2615, noise=0.001, spikes=(), seed=0):
+        self._field = field
+        self._noise = noise
+        self._spikes = spikes
+        self._rng = np.random.default_rng(seed)
+        self.readings = 0
+
+    def __call__(self):
+        self.readings += 1
+        if self.readings in self._spikes:
+            return self._field + 0.5
+        return self._field + self._rng.normal(0, self._noise)
+
+
+class FakeSeries9550Inst:  # answers :MEASure:FLUX1? and the buffer commands like the meter does
+    def __init__(self, read):
+        self._read = read
+        self._count = 1
+        self._buffer = []
+        self.transfers = 0
+
+    def query(self, qry):
+        self.transfers += 1
+        if qry.startswith(':FETCh'):
+            return ','.join(str(round(v, 4)) + 'G' for v in self._buffer) + '\n'
+        return ' ' + str(round(self._read(), 4)) + 'G\n'
+
+    def query_binary_values(self, qry, datatype='f', is_big_endian=False):
+        self.transfers += 1
+        data = np.asarray(self._buffer, dtype='>f4' if is_big_endian else '<f4').tobytes()
+        block = b'#' + str(len(str(len(data)))).encode() + str(len(data)).encode() + data
+        return list(np.frombuffer(block[2 + len(str(len(data))):], dtype='>f4' if is_big_endian else '<f4'))
+
+    def write(self, cmd):
+        if cmd.startswith(':TRIGger:COUNt'):
+            self._count = int(cmd.split()[1])
+        elif cmd == ':INITiate':
+            self._buffer = [self._read() for _ in range(self._count)]
+
+
+def testing_running_stats():
+    values = 1e6 + np.random.default_rng(1).normal(0, 0.001, 10**5)
+    stats = RunningStats()
+    for v in values:
+        stats.add(v)
+    print('Welford mean and std:', stats.mean, stats.std, '  numpy:', np.mean(values), np.std(values, ddof=1))
+    assert np.isclose(stats.mean, np.mean(values), rtol=0, atol=1e-8)
+    assert np.isclose(stats.std, np.std(values, ddof=1), rtol=1e-6)
+    assert np.isclose(stats.sem, np.std(values, ddof=1) / np.sqrt(len(values)))
+
+
+def testing_estimators():
+    values = np.array([2.0, 2.1, 1.9, 2.05, 1.95, 9.0, -5.0, 2.02])
+    f_l = np.sort(values)[2:-2]  # Series9550.get_avg_zfield() before acquisition.py
+    assert np.allclose(trimmed_mean(values, 2), (np.average(f_l), np.std(f_l) / np.sqrt(len(f_l))))
+    print('with two spikes: mean', np.mean(values), ', trimmed', trimmed_mean(values)[0], ', median',
+          median_sem(values)[0])
+
+
+def testing_target_sem():
+    print('estimator   noise (G)   target (G)   readings   average        error')
+    for estimator in ('mean', 'trimmed', 'median'):
+        for noise in (0.0002, 0.001, 0.003):
+            read = NoisyField(noise=noise, spikes=(3,))
+            out, sem, taken = average_readings(read, n=5, estimator=estimator, target_sem=0.0003, max_n=200)
+            print('{:<11} {:<11} {:<12} {:<10} {:<14.6f} {:.6f}'.format(estimator, noise, 0.0003, taken, out, sem))
+            if estimator != 'mean':
+                assert abs(out - 2.2615) < 4 * max(sem, 0.0003)
+    out, sem, taken = average_readings(NoisyField(), n=10)
+    assert taken == 14
+
+    out, sem, taken = average_readings(lambda: 'ERROR: field could not be measured.', n=3, estimator='mean')
+    assert np.isnan(out) and taken == 3
+
+
+def testing_series9550(n=5):
+    gm = Series9550.__new__(Series9550)
+    read = NoisyField(noise=0.0002)
+    gm._inst = FakeSeries9550Inst(read)
+
+    t0 = time.perf_counter()
+    out, sem = gm.get_avg_zfield(n)
+    t_fixed = time.perf_counter() - t0
+    readings_fixed = read.readings
+
+    t0 = time.perf_counter()
+    out_target, sem_target = gm.get_avg_zfield(2, target_sem=0.0002)
+    t_target = time.perf_counter() - t0
+    print('fixed n =', n, ':', readings_fixed, 'readings,', round(t_fixed, 2), 's;   target 0.0002 G:',
+          read.readings - readings_fixed, 'readings,', round(t_target, 2), 's')
+    assert sem_target <= 0.0002
+
+
+def testing_series9550_buffered(n=10):
+    for binary in (False, True):
+        gm = Series9550.__new__(Series9550)
+        gm._buffer_config = None
+        read = NoisyField(noise=0.0002, spikes=(3,))
+        gm._inst = FakeSeries9550Inst(read)
+
+        t0 = time.perf_counter()
+        out, sem = gm.get_avg_zfield(n, buffered=True, binary=binary)
+        t = time.perf_counter() - t0
+        print('buffered, binary =', binary, ':', read.readings, 'readings in', gm._inst.transfers, 'transfer,',
+              round(t, 4), 's')
+        assert read.readings == n + 4 and gm._inst.transfers == 1
+        assert abs(out - 2.2615) < 0.001
+
+        out, sem = gm.get_avg_zfield(5, target_sem=0.00005, buffered=True, binary=binary)
+        assert sem <= 0.00005
+
+    print('parsed:', Series9550._parse_readings(' 2.2615G,-2.2613G, 1.5E-3G\n'))
+    assert np.allclose(Series9550._parse_readings(' 2.2615G,-2.2613G, 1.5E-3G\n'), [2.2615, -2.2613, 0.0015])
+
+
+def main():
+    testing_running_stats()
+    testing_estimators()
+    testing_target_sem()
+    testing_series9550()
+    testing_series9550_buffered()
+
+
+if __name__ == '__main__':
+    main()
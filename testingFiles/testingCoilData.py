@@ -0,0 +1,163 @@
+"""
+Checks the data_coils loaders against the old line by line parser, and times both on the whole data_coils directory.
+Run from the root of the repository.
+"""
+import glob
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from automation.coil_data import load_coil_file, load_coil_dataset, load_column_file
+from automation.coil_data import ColumnWriter, convert_coil_directory
+
+
+def process_file_line_by_line(file_, n_cols):  # process_file() before coil_data
+    rows = []
+    with open(file_, 'r') as file:
+        data = file.readline()
+        while data != '\n' and data != '':
+            try:
+                cols = data.split(',')
+                rows.append([float(cols[i]) for i in range(n_cols)])
+            except (ValueError, IndexError):
+                pass
+            data = file.readline()
+    return np.asarray(rows, dtype=float).reshape(-1, n_cols)
+
+
+def testing_metadata():
+    f = load_coil_file('data_coils/small1/22_07_05__19_39_14.txt')
+    print(f)
+    print(f.metadata)
+    assert f.metadata['coilname'] == 'small1'
+    assert f.metadata['idn'] == 'F.W.BELL,MODEL 9550,V1.1;'
+    assert f.metadata['n_average'] == 10
+    assert (f.metadata['volts'], f.metadata['amps']) == (8.004, 2.269)
+    assert f.metadata['delta_step'] == 1000
+    assert f.columns == ('pos', 'b', 'berr')
+    assert f['pos'][1] == 1000
+
+    f = load_coil_file('data_coils/small2/22_07_05__13_50_24.txt')  # first row on the same line as the notes
+    print(f, f['pos'][:3], f.metadata['start_position'])
+    assert f['pos'][0] == 0 and f['b'][0] == 2.2615
+
+    f = load_coil_file('data_coils/small2/22_07_01__18_54_10.txt')  # empty line after the idn
+    print(f)
+    assert len(f) > 0 and f.columns == ('pos', 'b')
+
+    f = load_coil_file('data_coils/officeMeasurements/small2/22_06_30__12_10_18.txt')
+    print(f, f.metadata['kind'], f.columns)
+    assert f.metadata['kind'] == 'sweep'
+
+
+def testing_same_as_line_by_line():
+    for path in sorted(glob.glob('data_coils/**/*.txt', recursive=True)):
+        old = process_file_line_by_line(path, 2)
+        new = load_coil_file(path).data
+        if len(old):  # the old parser found nothing after an empty line under the header
+            assert np.array_equal(old, new[-len(old):, :2], equal_nan=True), path
+
+
+def testing_dataset():
+    t0 = time.perf_counter()
+    ds = load_coil_dataset('data_coils')
+    t_new = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for path in glob.glob('data_coils/**/*.txt', recursive=True):
+        process_file_line_by_line(path, 2)
+    t_old = time.perf_counter() - t0
+
+    print(ds.table())
+    print(len(ds), 'files,', len(ds.data), 'points')
+    print('load_coil_dataset:', round(t_new, 4), 's    line by line (no metadata):', round(t_old, 4), 's')
+
+    small2 = ds.select(coilname='small2', amps=2.299)
+    print(len(small2), 'small2 scans at 2.299 A')
+    for k in range(len(small2)):
+        assert np.array_equal(small2.points(k)[:, :2], small2[k].data[:, :2], equal_nan=True)
+
+
+def testing_binary_conversion():
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        written = convert_coil_directory('data_coils', out_root=tmp)
+        print('converted', len(written), 'files in', round(time.perf_counter() - t0, 3), 's')
+
+        text = load_coil_dataset('data_coils', kind=None)
+        binary = load_coil_dataset(tmp, pattern='**/*.cdat', kind=None)
+        assert len(text) == len(binary)
+        for f_text, f_bin in zip(text, binary):
+            assert f_text.columns == f_bin.columns
+            assert f_text.metadata == f_bin.metadata, (f_text.metadata, f_bin.metadata)
+            assert np.array_equal(f_text.data, f_bin.data, equal_nan=True)
+        assert isinstance(binary[0].data, np.memmap)
+
+        size_text = sum(os.path.getsize(f.path) for f in text)
+        size_bin = sum(os.path.getsize(f.path) for f in binary)
+        print('text:', size_text, 'bytes    binary:', size_bin, 'bytes')
+
+
+def testing_binary_append(n=10**6):
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'scan.cdat')
+        with ColumnWriter(name, metadata={'coilname': 'large1', 'amps': 2.3, 'delta_step': 100}) as writer:
+            for i in range(5):
+                writer.append((i * 100, 1.0 + i, 0.001))
+        with open(name, 'ab') as file:
+            file.write(b'\x00' * 12)  # half a row, like an interrupted scan
+
+        f = load_column_file(name)
+        assert len(f) == 5 and f.metadata['amps'] == 2.3
+        with ColumnWriter(name, append=True) as writer:
+            assert len(writer) == 5
+            writer.append((500, 6.0, 0.001))
+        f = load_column_file(name)
+        assert len(f) == 6 and f['b'][-1] == 6.0 and f['pos'][-1] == 500
+
+        rows = np.random.default_rng(0).normal(size=(n, 3))
+        big = os.path.join(tmp, 'big.cdat')
+        with ColumnWriter(big) as writer:
+            writer.extend(rows)
+        big_txt = os.path.join(tmp, 'big.txt')
+        np.savetxt(big_txt, rows, delimiter=',')
+
+        t0 = time.perf_counter()
+        b = load_column_file(big)['b']
+        mean_bin = b.mean()
+        t_bin = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        mean_txt = load_coil_file(big_txt)['b'].mean()
+        t_txt = time.perf_counter() - t0
+        assert np.isclose(mean_bin, mean_txt)
+        print(n, 'rows, mean of one column:', round(t_bin, 4), 's memory map    ', round(t_txt, 4), 's text')
+
+
+def testing_bad_values():
+    text = 'F.W.BELL,MODEL 9550,V1.1;, average for 10 data points\nV = 8.0, A = 2.3\ndeltaX = 100 steps.\n' \
+           'Starting position: tip\n0,1.5,0.01\n100,,0.02\n200,1.7,0.0x3\n300,1.8\n400,1.9,0.05\n\n'
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bad.txt')
+        with open(path, 'w') as file:
+            file.write(text)
+        f = load_coil_file(path)
+        print(f, f.data.tolist())
+        assert f.columns == ('pos', 'b', 'berr')
+        assert np.array_equal(f['pos'], [0, 100, 200, 400])  # the row with a missing column is skipped
+        assert np.isnan(f['b'][1]) and np.isnan(f['berr'][2]) and f['b'][3] == 1.9
+        assert len(load_coil_dataset(tmp)) == 1 and len(load_coil_dataset(tmp).column('pos')) == 4
+
+
+def main():
+    testing_metadata()
+    testing_same_as_line_by_line()
+    testing_bad_values()
+    testing_dataset()
+    testing_binary_conversion()
+    testing_binary_append()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Fits every scan in data_coils, in one process and in a process pool, and checks the fits against the model that used to
+be inside get_field_fit(). Run from the root of the repository.
+"""
+import time
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+from automation.coil_data import load_coil_dataset, load_coil_file
+from automation.coil_fit import CoilFieldModel, coil_field_z_axis, fit_coil_field, fit_coil_runs, summarize_by_coil
+
+
+def get_field_fit_closure(pos, b, coilname, amps):  # get_field_fit() before coil_fit
+    def coil_field_z_axis(z, n, z0):
+        coil_side = {
+            'small': 0.667893,
+            'medium': 0.7028942,
+            'large': 0.7378954
+        }
+        side = coil_side[coilname[:-1]]
+        x = (z - z0) * 6.8E-6
+        f = 2e-7*amps*n*side**2
+        s = 1 / (x**2 + (side**2)/4)
+        t = 1 / np.sqrt(x**2 + (side**2)/2)
+        return f*s*t*10000
+
+    popt, pcov = curve_fit(coil_field_z_axis, pos, b, p0=[60, 6260], bounds=([58, 5500], [62, 6500]))
+    return popt, pcov
+
+
+def testing_same_fit():
+    f = load_coil_file('data_coils/medium2/22_07_06__18_33_37.txt')
+    amps = f.metadata['amps']
+    popt_old, pcov_old = get_field_fit_closure(f['pos'], f['b'], 'medium2', amps)
+    popt, pcov, residuals = fit_coil_field(f['pos'], f['b'], 'medium2', amps)
+    print('closure:', popt_old, '  fit_coil_field:', popt)
+    assert np.allclose(popt, popt_old) and np.allclose(pcov, pcov_old)
+
+
+def testing_jacobian():
+    model = CoilFieldModel('large1', 2.3)
+    z = np.linspace(-10000, 25000, 200)
+    assert np.allclose(model(z, 60, 6260), coil_field_z_axis(z, 60, 6260, model.side, 2.3))
+
+    jac = model.jacobian(z, 60, 6260)
+    h = 1e-4
+    d_n = (model(z, 60 + h, 6260) - model(z, 60 - h, 6260)) / (2 * h)
+    d_z0 = (model(z, 60, 6260 + h) - model(z, 60, 6260 - h)) / (2 * h)
+    assert np.allclose(jac[:, 0], d_n, rtol=1e-6)
+    assert np.allclose(jac[:, 1], d_z0, rtol=1e-4, atol=1e-12)
+
+
+def testing_jacobian_speed(repeat=20):
+    """
+    Fits every scan of data_coils from a poor starting point, with the analytic Jacobian and with finite differences.
+    """
+    files = [f for f in load_coil_dataset('data_coils') if f.metadata['amps'] and np.isfinite(f['b']).sum() > 3]
+    results = {}
+    for name in ('finite differences', 'analytic jacobian'):
+        converged = 0
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            for f in files:
+                model = CoilFieldModel(f.metadata['coilname'], f.metadata['amps'])
+                ok = np.isfinite(f['b'])
+                try:
+                    if name == 'analytic jacobian':
+                        popt = model.fit(f['pos'], f['b'], p0=(50, 0), bounds=None)[0]
+                    else:
+                        popt = curve_fit(model, f['pos'][ok], f['b'][ok], p0=(50, 0))[0]
+                    converged += 1
+                except RuntimeError:
+                    popt = (np.nan, np.nan)
+        results[name] = popt
+        print(name + ':', round((time.perf_counter() - t0) / repeat, 4), 's per pass,', converged // repeat, 'of',
+              len(files), 'scans converged')
+    assert np.allclose(*results.values(), rtol=1e-4)
+
+
+def testing_weighted_fit(seed=0):
+    """
+    Points near the ends of the scan are much noisier. The weighted fit should be closer to the true n and z0.
+    """
+    rng = np.random.default_rng(seed)
+    model = CoilFieldModel('large1', 2.3)
+    pos = np.arange(0, 16000, 100.0)
+    berr = np.where(np.abs(pos - 8000) > 5000, 0.05, 0.001)
+    errors = {'unweighted': [], 'weighted': []}
+    for _ in range(50):
+        b = model(pos, 60, 6260) + rng.normal(0, berr)
+        errors['unweighted'].append(model.fit(pos, b)[0] - (60, 6260))
+        errors['weighted'].append(model.fit(pos, b, berr)[0] - (60, 6260))
+    for name, e in errors.items():
+        e = np.asarray(e)
+        print(name + ': rms error of n', np.sqrt(np.mean(e[:, 0]**2)), ', z0', np.sqrt(np.mean(e[:, 1]**2)))
+    assert np.mean(np.square(errors['weighted'])) < np.mean(np.square(errors['unweighted']))
+
+
+def testing_batch():
+    t0 = time.perf_counter()
+    serial = fit_coil_runs(out=None, processes=1)
+    t_serial = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    parallel = fit_coil_runs(out=None)
+    t_parallel = time.perf_counter() - t0
+
+    print(len(serial['file']), 'scans, ', serial['status'].count('ok'), 'fitted')
+    print('one process:', round(t_serial, 3), 's    process pool:', round(t_parallel, 3), 's')
+    assert serial['file'] == parallel['file']
+    assert np.allclose(serial['n'], parallel['n'], equal_nan=True)
+
+    for coil, (runs, n, n_err, rms) in summarize_by_coil(serial).items():
+        print(coil, runs, 'scans: n =', round(n, 3), '+-', round(n_err, 3), ', rms =', round(rms, 5))
+
+
+def testing_summary():
+    table = {'coilname': ['a', None, 'a', 'b'], 'status': ['ok', 'ok', 'ok', 'failed'],
+             'n': [10.0, 99.0, 12.0, 5.0], 'var_n': [1.0, 1.0, 1.0, 1.0], 'rms': [0.1, 0.1, 0.3, 0.1]}
+    summary = summarize_by_coil(table)
+    print(summary)
+    assert list(summary) == ['a']  # no coilname, and no fitted scan
+    runs, n, n_err, rms = summary['a']
+    assert runs == 2 and np.isclose(n, 11) and np.isclose(n_err, np.sqrt(0.5)) and np.isclose(rms, 0.2)
+
+
+def main():
+    testing_same_fit()
+    testing_jacobian()
+    testing_jacobian_speed()
+    testing_weighted_fit()
+    testing_batch()
+    testing_summary()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Runs the ELL14K driver against simulated rotation mounts on one Elliptec bus, from instrument_simulation.py: packets,
+settings, moves of several mounts at the same time, and a polarizer scan with the scan engine of scans.py.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import automation.device_models as device_models
+from automation.device_models import ELL14K
+from automation.instrument_simulation import SimulatedEll14k, connect_driver
+from automation.oven_simulation import VirtualClock
+from automation.scans import ElliptecAxis, FunctionReadout, Scan, load_scan
+
+
+def testing_packets():
+    for value in (0, 1, 17920, -17920, 2 ** 31 - 1, -2 ** 31):
+        assert ELL14K._from_hex_(ELL14K._to_hex_(value)) == value
+    assert ELL14K._to_hex_(-1) == 'FFFFFFFF'
+    assert ELL14K._parse_packet_(b'2PO00004600\r\n') == ('2', 'PO', '00004600')
+    print(ELL14K._parse_packet_(b'2PO0000'))
+    assert ELL14K._parse_packet_(b'2PO0000').startswith('ERROR')
+
+
+def testing_single_mount():
+    bus = SimulatedEll14k('0', pulses_per_rev=262144, clock=VirtualClock())
+    ell = connect_driver(bus)
+    info = ell.get_info()
+    print(info)
+    assert info['pulses_per_rev'] == 262144 and info['travel'] == 360
+
+    assert ell.home() == 0
+    assert ell.move_absolute(45) == 45
+    assert np.isclose(ell.move_relative(-90), -45)
+    assert np.isclose(ell.get_position(), -45)
+    ell.set_jog_step(10)
+    assert np.isclose(ell.get_jog_step(), 10, atol=0.01)  # rounded to whole pulses
+    assert np.isclose(ell.jog_forward(), -35, atol=0.01) and np.isclose(ell.jog_backward(), -45)
+    ell.set_velocity(50)
+    assert ell.get_velocity() == 50
+    assert ell.get_status() == 0
+
+    print(ell._query_('0', 'xx'), '->', ell._status_error_(ell._query_('0', 'xx')))
+    assert ell.move_absolute(10, address='7').startswith('ERROR')  # no mount answers at this address
+
+
+def testing_several_mounts(angles=None):
+    if angles is None:
+        angles = {'0': 90, '1': 180, '2': 45}
+    bus = SimulatedEll14k('012', clock=time)
+    ell = connect_driver(bus)
+    ell.home_async()
+    print('homed:', ell.wait_motion())
+
+    t0 = time.perf_counter()
+    for address, degrees in angles.items():
+        ell.move_absolute(degrees, address)
+    t_one = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    move = ell.move_absolute_async({a: 0 for a in angles})
+    returned = time.perf_counter() - t0
+    assert ell.is_moving()
+    print('final angles:', move.result())
+    ell.wait_motion()
+    t_all = time.perf_counter() - t0
+
+    print('one mount at a time:', round(t_one, 2), 's    all at once:', round(t_all, 2), 's    returned after',
+          round(1000 * returned, 1), 'ms')
+    assert t_all < 0.6 * t_one and returned < 0.05
+    positions = ell.get_positions()
+    print('positions:', positions, '  statuses:', ell.get_statuses())
+    assert all(p == 0 for p in positions.values())
+
+
+def testing_polarizer_scan():
+    bus = SimulatedEll14k('0', clock=VirtualClock())
+    ell = connect_driver(bus)
+    readout = FunctionReadout(('power',), lambda: (np.cos(np.radians(bus.position('0') * 360 / 143360 - 30)) ** 2,))
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'polarizer.txt')
+        Scan([ElliptecAxis(ell, '0', name='angle')], [readout], np.arange(0, 181, 15).reshape(-1, 1), filename).run(
+            verbose=False)
+        data = load_scan(filename)
+    best = data['angle'][np.argmax(data['power'])]
+    print('polarizer scan: largest power at', best, 'degrees')
+    assert best == 30
+
+
+def main():
+    testing_packets()
+    testing_single_mount()
+    testing_several_mounts()
+    testing_polarizer_scan()
+    device_models.time = time
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Checks IncrementalCoilFit on a scan from data_coils, and uses it to stop a simulated get_pos_b() scan early. Time runs
+50 times faster than real time. Run from the root of the repository.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import automation.measure_coil_field as mcf
+from automation.acquisition import run_in_background
+from automation.coil_data import load_coil_file
+from automation.coil_fit import IncrementalCoilFit, fit_coil_field
+
+
+class ScaledTime:
+    def __init__(self, scale):
+        self._scale = scale
+
+    def time(self):
+        return time.time() / self._scale
+
+    def sleep(self, seconds):
+        time.sleep(seconds * self._scale)
+
+
+clock = ScaledTime(0.02)
+
+
+def coil_field(z, amps=2.3, n=60, z0=6260, side=0.7378954):  # same model as get_field_fit() for a large coil
+    x = (z - z0) * 6.8E-6
+    return 2e-7*amps*n*side**2 / (x**2 + side**2/4) / np.sqrt(x**2 + side**2/2) * 10000
+
+
+class FakePowerSupply:
+    def set_current_limit(self, channel, amps): pass
+    def set_voltage(self, channel, volts): pass
+    def set_current(self, channel, amps): pass
+    def set_channel_state(self, channel, state): pass
+    def get_actual_voltage(self, channel): return 20
+    def get_actual_current(self, channel): return 2.3
+    def zero_all_channels(self): pass
+
+
+class FakeGaussmeter:
+    def __init__(self, vx, noise=0.003):
+        self._vx = vx
+        self._noise = noise
+        self._rng = np.random.default_rng(0)
+        self.idn = 'Simulated gaussmeter'
+
+    def autozero(self): pass
+    def disconnect(self): pass
+
+    def get_zfield(self):
+        clock.sleep(0.03)
+        return coil_field(self._vx.position) + self._rng.normal(0, self._noise)
+
+
+class FakeVxm:
+    def __init__(self):
+        self.position = 0
+        self._motion = None
+
+    def set_speed(self, channel, speed): pass
+    def set_acceleration(self, channel, acc): pass
+    def disconnect(self): pass
+
+    def displace(self, channel, steps):
+        clock.sleep(0.35 + abs(steps) / 1000)
+        self.position += steps
+        return '^'
+
+    def displace_async(self, channel, steps):  # same as Vxm.displace_async()
+        self._motion = run_in_background(self.displace, channel, steps)
+        return self._motion
+
+    def is_moving(self):
+        return self._motion is not None and not self._motion.done()
+
+    def wait_motion(self):
+        motion, self._motion = self._motion, None
+        return None if motion is None else motion.result()
+
+
+def testing_recorded_scan():
+    f = load_coil_file('data_coils/medium2/22_07_06__18_33_37.txt')
+    amps = f.metadata['amps']
+    popt_full = fit_coil_field(f['pos'], f['b'], 'medium2', amps, p0=None, bounds=None, berr=f['berr'])[0]
+
+    fit = IncrementalCoilFit('medium2', amps, n_tolerance=0.01, z0_tolerance=20)
+    t0 = time.perf_counter()
+    converged_at = None
+    for pos, b, berr in f.data:
+        fit.add(pos, b, berr)
+        if converged_at is None and fit.is_converged():
+            converged_at = len(fit)
+            popt_early, errors_early = fit.popt.copy(), fit.errors
+            print('converged after', converged_at, 'of', len(f), 'points:', fit)
+    t = time.perf_counter() - t0
+    print('all points:', fit, ', full fit:', popt_full)
+    if np.any(np.abs(popt_early - popt_full) > 3 * errors_early):
+        print('the fit kept drifting after it converged: the model does not describe the whole scan within the noise')
+    print(round(1000 * t / len(f), 3), 'ms per point,', fit.fits, 'fits')
+    assert np.allclose(fit.popt, popt_full, rtol=1e-5)
+    assert converged_at is not None and converged_at < len(f)
+
+
+def testing_early_stop():
+    mcf.time = clock
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs('data_coils/large1')
+        try:
+            for name in ('full scan', 'early stop'):
+                fit = None
+                if name == 'early stop':
+                    fit = IncrementalCoilFit('large1', 2.3, n_tolerance=0.05, z0_tolerance=20)
+                vx = FakeVxm()
+                t0 = clock.time()
+                pos, b, berr = mcf.get_pos_b('large1', FakePowerSupply(), FakeGaussmeter(vx), vx, 2.3, 10, 100,
+                                             fit=fit)
+                popt, pcov, residuals = fit_coil_field(pos, b, 'large1', 2.3, p0=None, bounds=None, berr=berr)
+                results[name] = (len(pos), clock.time() - t0, popt, np.sqrt(np.diag(pcov)))
+        finally:
+            os.chdir(cwd)
+
+    for name, (points, t, popt, perr) in results.items():
+        print(name + ':', points, 'points,', round(t), 's, n =', round(popt[0], 3), '+-', round(perr[0], 3),
+              ', z0 =', round(popt[1], 1), '+-', round(perr[1], 1))
+    points, t, popt, perr = results['early stop']
+    assert points < results['full scan'][0]
+    assert abs(popt[0] - 60) < 4 * 0.05 and abs(popt[1] - 6260) < 4 * 20
+
+
+def main():
+    testing_recorded_scan()
+    testing_early_stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Runs the Model8742 driver against the simulated picomotor controller of instrument_simulation.py, served on a local TCP
+port. Compares a 4 channel alignment move done one channel at a time, with displace(), with the same move done by
+displace_axes(), which starts all the channels with one command line and polls them with one query.
+"""
+import time
+
+from automation.instrument_simulation import SimulatedModel8742, connect_driver
+
+
+def testing_queries():
+    sim = SimulatedModel8742()
+    pm = connect_driver(sim)
+    print(pm.idn.strip())
+    assert pm.are_motions_done() == {1: True, 2: True, 3: True, 4: True}
+    pm.move_axes({1: 300, 3: -200}, wait=False)
+    done = pm.are_motions_done([1, 2, 3])
+    print('right after the move:', done)
+    assert done == {1: False, 2: True, 3: False}
+    assert pm.wait_motions_done() is True
+    assert pm.get_instant_positions() == {1: 300, 2: 0, 3: -200, 4: 0}
+    assert pm.get_instant_positions([3]) == {3: -200}
+    assert not sim.errors
+    sim.stop()
+
+
+def testing_alignment_move(moves=None):
+    if moves is None:
+        moves = {1: 400, 2: -600, 3: 800, 4: -300}
+    sim = SimulatedModel8742()
+    pm = connect_driver(sim)
+
+    t0 = time.perf_counter()
+    for chan, steps in moves.items():
+        pm.displace(chan, steps)
+    t_old = time.perf_counter() - t0
+    lines_old = sim.lines
+
+    t0 = time.perf_counter()
+    assert pm.displace_axes({chan: -steps for chan, steps in moves.items()}) is True
+    t_new = time.perf_counter() - t0
+    lines_new = sim.lines - lines_old
+
+    slowest = max(abs(v) for v in moves.values()) / 2000
+    total = sum(abs(v) for v in moves.values()) / 2000
+    print('one channel at a time:', round(t_old, 2), 's,', lines_old, 'lines    all at once:', round(t_new, 2), 's,',
+          lines_new, 'lines')
+    print('slowest channel:', slowest, 's    sum of the channels:', total, 's')
+    assert pm.get_instant_positions() == {1: 0, 2: 0, 3: 0, 4: 0}
+    assert t_new < slowest + 0.3 < total
+    assert pm.wait_motions_done(timeout=1) is True
+
+    pm.displace_axes({1: 10000}, wait=False)
+    out = pm.wait_motions_done(timeout=0.5)
+    print(out)
+    assert out.startswith('ERROR')
+    pm.hard_stop_all()
+    sim.stop()
+
+
+def main():
+    testing_queries()
+    testing_alignment_move()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Checks the position tracking of the Model8742 driver against the simulated picomotor controller of
+instrument_simulation.py, and counts the command lines that a position display sends with and without it.
+"""
+import time
+
+import numpy as np
+
+from automation.instrument_simulation import SimulatedModel8742, connect_driver
+
+
+def refresh(read, duration, interval=0.02):
+    """
+    Read the position every interval seconds, like a position display does.
+    """
+    errors = []
+    t_end = time.time() + duration
+    while time.time() < t_end:
+        errors.append(read())
+        time.sleep(interval)
+    return errors
+
+
+def testing_display_refresh(steps=2000):
+    sim = SimulatedModel8742()
+    pm = connect_driver(sim)
+    assert pm.get_position(1) == 0  # the position is not known yet, so it is queried once
+    pm.get_velocity(1), pm.get_acceleration(1)  # also queried only once
+
+    lines = sim.lines
+    pm.displace_axes({1: steps}, wait=False)
+    errors = refresh(lambda: pm.position_ch1 - sim.position(1), 1.3)
+    lines_tracked = sim.lines - lines
+    print('tracked: {} reads, {} lines, largest error {} steps'.format(len(errors), lines_tracked,
+                                                                        max(np.abs(errors))))
+    assert max(np.abs(errors)) <= pm.position_tolerance
+    assert pm.position_ch1 == steps == sim.position(1)
+    lines = sim.lines
+    pm.position_ch1
+    assert sim.lines == lines  # stopped and confirmed, nothing is sent
+
+    lines = sim.lines
+    pm._send_line_('1PR' + str(-steps))
+    errors = refresh(lambda: int(pm._query_line_('1TP?')[0]) - sim.position(1), 1.3)  # TP? at every read
+    lines_queried = sim.lines - lines
+    print('queried: {} reads, {} lines'.format(len(errors), lines_queried))
+    assert lines_tracked < lines_queried / 5
+    sim.stop()
+
+
+def testing_tolerance_and_cache():
+    sim = SimulatedModel8742()
+    pm = connect_driver(sim)
+    pm.get_position(2), pm.get_velocity(2), pm.get_acceleration(2)
+    lines = sim.lines
+    pm.displace_axes({2: 1000}, wait=False)
+    position, uncertainty = pm.predict_position(2)
+    print('prediction:', position, '+-', uncertainty)
+    pm.get_position(2, tolerance=10)  # more precise than the prediction, so it is queried
+    assert sim.lines == lines + 2
+
+    lines = sim.lines
+    assert pm.wait_motions_done([2]) is True
+    print('wait_motions_done sent', sim.lines - lines, 'lines')
+    assert sim.lines - lines <= 3
+
+    lines = sim.lines
+    for i in range(5):
+        assert pm.velocity_ch3 == 2000
+    pm.set_velocity(3, 1500)
+    assert pm.velocity_ch3 == 1500
+    print('velocity read 6 times with', sim.lines - lines, 'lines')
+    assert sim.lines - lines == 2  # one VA? and one VA1500
+
+    sim.execute('2PA0')  # moved by someone else
+    pm.clear_cache()
+    assert pm.wait_motions_done([2]) is True and pm.position_ch2 == 0
+    sim.stop()
+
+
+def main():
+    testing_display_refresh()
+    testing_tolerance_and_cache()
+
+
+if __name__ == '__main__':
+    main()
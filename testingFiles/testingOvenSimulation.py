@@ -0,0 +1,44 @@
+"""
+Runs the regular HeaterAssembly + server_loop stack against a simulated oven using a virtual clock. Hours of oven time
+take a few seconds.
+"""
+import time
+
+import numpy as np
+
+from automation.oven_simulation import simulated_oven
+from automation.oven_simulation import run_server
+
+
+def testing_settling(number_of_assemblies=3, setpoint=60, hours=4, vectorized=False):
+    """
+    Regulates every zone of a simulated oven to setpoint and checks that the temperatures settle within half a degree.
+    """
+    asm_dict, clock, model = simulated_oven(number_of_assemblies, coupling_conductance=0.05, daq_noise=0.02, seed=0,
+                                            record=True)
+    for asm in asm_dict.values():
+        asm.ready_assembly()
+        asm.set_pid_setpoint(setpoint)
+        asm.set_pid_regulation(True)
+
+    t0 = time.time()
+    run_server(asm_dict, clock, run_time=hours*3600, vectorized=vectorized)
+    elapsed = time.time() - t0
+
+    history = model.history
+    temps = history[:, 1:1 + number_of_assemblies]
+    last_hour = history[:, 0] > clock.time() - 3600
+    print('vectorized:', vectorized)
+    print('simulated', hours, 'h of oven time in', round(elapsed, 2), 's')
+    print('final temperatures:', np.round(temps[-1], 3))
+    print('max error in the last hour:', np.round(np.max(np.abs(temps[last_hour] - setpoint)), 3))
+    assert np.all(np.abs(temps[last_hour] - setpoint) < 0.5)
+
+
+def main():
+    testing_settling()
+    testing_settling(vectorized=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Compares the vectorized PidBank against a list of simple_pid.PID objects running the same simulated ovens.
+"""
+import numpy as np
+import simple_pid
+
+from automation.assemblies import PidBank
+from automation.oven_simulation import simulated_oven
+from automation.pid_controller_server import update_heaters_bank
+
+
+def heating(P, rh, dt):
+    return rh*P*dt
+
+
+def cooling(T, T_env, rc, dt):
+    return rc*(T-T_env)*dt
+
+
+def testing_parity(n=16, steps=2000, differential_on_measurement=True, seed=0):
+    """
+    Runs n simulated ovens with random gains, setpoints, limits, and sample times. Every oven is regulated twice: once
+    by a simple_pid.PID object and once by a row of a PidBank. The time steps are random, so some calls fall inside
+    the sample time and must return the previous output.
+    """
+    rng = np.random.default_rng(seed)
+    kp = rng.uniform(0.05, 2, n)
+    ki = rng.uniform(0, 0.2, n)
+    kd = rng.uniform(0, 0.5, n)
+    setpoints = rng.uniform(40, 200, n)
+    sample_times = rng.uniform(0.5, 2, n)
+    out_max = rng.uniform(5, 30, n)
+
+    pids = []
+    for i in range(n):
+        pid = simple_pid.PID(kp[i], ki[i], kd[i], setpoint=setpoints[i], sample_time=sample_times[i],
+                             output_limits=(0, out_max[i]),
+                             differential_on_measurement=differential_on_measurement)
+        pids.append(pid)
+
+    bank = PidBank(n, kp, ki, kd, setpoints, sample_times, (0, None),
+                   differential_on_measurement=differential_on_measurement)
+    for i in range(n):
+        bank.set_output_limits(0, out_max[i], rows=i)
+
+    temp_pid = np.full(n, 25.0)
+    temp_bank = np.full(n, 25.0)
+    dt_since = np.zeros(n)  # simple_pid only moves its clock when it calculates a new output
+    max_diff = 0
+    for k in range(steps):
+        dt_since += rng.uniform(0.2, 1.5)
+        updated = (dt_since >= sample_times) | (k == 0)
+
+        out_pid = np.zeros(n)
+        for i in range(n):
+            out_pid[i] = pids[i](temp_pid[i], dt=dt_since[i])
+        out_bank = bank.step(temp_bank, dt_since)
+
+        dt_since = np.where(updated, 0, dt_since)
+
+        max_diff = max(max_diff, np.max(np.abs(out_pid - out_bank)))
+
+        temp_pid += heating(out_pid, 1, 0.5) - cooling(temp_pid, 25, 0.01, 0.5)
+        temp_bank += heating(out_bank, 1, 0.5) - cooling(temp_bank, 25, 0.01, 0.5)
+
+    print('max difference between simple_pid and PidBank outputs:', max_diff)
+    assert max_diff < 1e-9
+    assert np.allclose(bank.integral, [pid.components[1] for pid in pids])
+
+
+def testing_assemblies(steps=20):
+    """
+    Regulates a simulated oven with update_heaters_bank() and checks that the PIDs of the assemblies follow the bank,
+    and that a reset of an assembly clears its row.
+    """
+    asm_dict, clock, model = simulated_oven(3)
+    asm_list = list(asm_dict.values())
+    for asm in asm_list:
+        asm.ready_assembly()
+        asm.set_pid_setpoint(60)
+        asm.set_pid_regulation(True)
+    bank = PidBank.from_assemblies(asm_list)
+    t0_dict = {key: clock.time() for key in asm_dict}
+    for i in range(steps):
+        clock.sleep(2)
+        t0_dict, out = update_heaters_bank(asm_dict, t0_dict, bank, clock=clock, verbose=False)
+
+    integrals = [asm._pid.components[1] for asm in asm_list]
+    print('integrals of the bank:', bank.integral, ' of the assemblies:', integrals)
+    assert np.allclose(bank.integral, integrals) and np.all(bank.integral > 0)
+    assert np.allclose(bank.last_output, [asm._pid._last_output for asm in asm_list])
+
+    # the new PID may get the id of the old one, the reset counter does not repeat
+    asm_list[1].reset_pid()
+    asm_list[1].set_pid_setpoint(60)
+    bank.load_assemblies(asm_list)
+    assert bank.integral[1] == 0 and bank.integral[0] > 0
+
+    # back to regulating on its own, from where the bank left it. One step of 2 s, not one of the whole run
+    asm = asm_list[0]
+    before = asm._pid.components[1]
+    clock.sleep(2)
+    asm.update_supply()
+    print('integral before and after one step on its own:', before, asm._pid.components[1])
+    assert 0 < asm._pid.components[1] - before < asm.pid_ki * 2 * 60
+
+
+def main():
+    testing_parity()
+    testing_parity(differential_on_measurement=False)
+    testing_assemblies()
+
+
+if __name__ == '__main__':
+    main()
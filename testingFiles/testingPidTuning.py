@@ -0,0 +1,63 @@
+"""
+Autotunes the PID of a simulated oven: records a step response, fits a FOPDT model, searches the gains in parallel,
+and then regulates the simulated oven with the new gains.
+"""
+import time
+
+import numpy as np
+
+from automation.oven_simulation import simulated_oven
+from automation.oven_simulation import run_server
+from automation.pid_tuning import fit_fopdt
+from automation.pid_tuning import tune_pid
+
+
+def step_response(volts=12, duration=4*3600, period=2):
+    asm_dict, clock, model = simulated_oven(1, daq_noise=0.02, seed=0, sensor_time_constant=60)
+    asm = asm_dict['asm1']
+    asm.ready_assembly()
+
+    t_log, temp_log, volt_log = [], [], []
+    for i in range(int(duration/period)):
+        if i == 5:
+            asm.set_supply_voltage(volts)
+        t_log.append(clock.time())
+        temp_log.append(asm.temp)
+        volt_log.append(volts if i >= 5 else 0)
+        clock.sleep(period)
+    return np.array(t_log), np.array(temp_log), np.array(volt_log)
+
+
+def testing_tuning(setpoint=60, processes=None):
+    t, temps, volts = step_response()
+    model = fit_fopdt(t, temps, volts)
+    print(model)
+
+    t0 = time.time()
+    gains, table = tune_pid(model, setpoint, output_limits=(0, 30), processes=processes)
+    print('searched', len(table['score']), 'gain sets in', round(time.time() - t0, 2), 's with processes =',
+          processes)
+    print('best gains:', [round(float(k), 4) for k in gains], 'overshoot:', round(table['overshoot'][0], 2), '% settling time:',
+          round(table['settling_time'][0]), 's')
+
+    asm_dict, clock, oven_model = simulated_oven(1, record=True, sensor_time_constant=60)
+    asm = asm_dict['asm1']
+    asm.ready_assembly()
+    asm.pid_kp, asm.pid_ki, asm.pid_kd = gains
+    asm.set_pid_setpoint(setpoint)
+    asm.set_pid_regulation(True)
+    run_server(asm_dict, clock, run_time=3*3600)
+
+    history = oven_model.history
+    print('simulated oven final temperature:', round(history[-1, 1], 3), 'max temperature:',
+          round(np.max(history[:, 1]), 3))
+    assert abs(history[-1, 1] - setpoint) < 0.5
+
+
+def main():
+    testing_tuning(processes=1)
+    testing_tuning()
+
+
+if __name__ == '__main__':
+    main()
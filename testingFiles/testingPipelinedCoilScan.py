@@ -0,0 +1,136 @@
+"""
+Compares the sequential and the pipelined get_pos_b() scans using simulated instruments. The instrument timings are
+based on the Series9550 gaussmeter and the VXM motor controller. Time runs 20 times faster than real time.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+import automation.measure_coil_field as mcf
+from automation.acquisition import run_in_background
+
+
+class ScaledTime:
+    def __init__(self, scale):
+        import time
+        self._time = time
+        self._scale = scale
+
+    def time(self):
+        return self._time.time() / self._scale
+
+    def sleep(self, seconds):
+        self._time.sleep(seconds * self._scale)
+
+
+clock = ScaledTime(0.05)
+
+
+class FakePowerSupply:
+    def set_current_limit(self, channel, amps): pass
+    def set_voltage(self, channel, volts): pass
+    def set_current(self, channel, amps): pass
+    def set_channel_state(self, channel, state): pass
+    def get_actual_voltage(self, channel): return 20
+    def get_actual_current(self, channel): return 2.3
+    def zero_all_channels(self): pass
+
+
+class FakeGaussmeter:
+    def __init__(self, vx, query_time=0.03, noise=0.005):
+        self._vx = vx
+        self._query_time = query_time
+        self._noise = noise
+        self._rng = np.random.default_rng(0)
+        self.idn = 'Simulated gaussmeter'
+
+    def autozero(self): pass
+    def disconnect(self): pass
+
+    def get_zfield(self):
+        clock.sleep(self._query_time)
+        z = self._vx.position
+        ringing = 0.2 * np.exp(-(clock.time() - self._vx.t_stop) / 0.15)  # probe vibrates after every motion
+        return 10 * np.exp(-((z - 8000) / 5000) ** 2) + ringing + self._rng.normal(0, self._noise)
+
+    def get_avg_zfield(self, n=10):  # same as Series9550
+        f_l = []
+        for i in range(n + 4):
+            f_l.append(self.get_zfield())
+            clock.sleep(0.2)
+        f_l = np.sort(f_l)[2:-2]
+        return np.average(f_l), np.std(f_l) / np.sqrt(n)
+
+
+class FakeVxm:
+    def __init__(self, speed=1000):
+        self.position = 0
+        self.t_stop = 0
+        self._speed = speed
+        self._motion = None
+
+    def set_speed(self, channel, speed): self._speed = speed
+    def set_acceleration(self, channel, acc): pass
+    def disconnect(self): pass
+
+    def displace(self, channel, steps):
+        clock.sleep(0.05 + abs(steps) / self._speed)  # command and motion
+        self.position += steps
+        self.t_stop = clock.time()
+        return '^'
+
+    def displace_async(self, channel, steps):  # same as Vxm.displace_async()
+        self._motion = run_in_background(self.displace, channel, steps)
+        return self._motion
+
+    def is_moving(self):
+        return self._motion is not None and not self._motion.done()
+
+    def wait_motion(self):
+        motion, self._motion = self._motion, None
+        return None if motion is None else motion.result()
+
+
+def run_scan(pipelined, delta_step=400, n=10, file_format='txt'):
+    vx = FakeVxm()
+    gm = FakeGaussmeter(vx)
+    t0 = clock.time()
+    pos, b, berr = mcf.get_pos_b('large1', FakePowerSupply(), gm, vx, 2.3, n, delta_step, pipelined=pipelined,
+                                 file_format=file_format)
+    return clock.time() - t0, pos, b, berr
+
+
+def testing_pipeline():
+    mcf.time = clock
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs('data_coils/large1')
+        try:
+            t_seq, pos, b_seq, berr_seq = run_scan(False)
+            t_pipe, pos, b_pipe, berr_pipe = run_scan(True)
+            t_bin, pos, b_bin, berr_bin = run_scan(True, file_format='cdat')
+            names = os.listdir('data_coils/large1')
+            binary = [name for name in names if name.endswith('.cdat')]
+            assert len(names) == 3 and len(binary) == 1
+            for name in names:
+                pos_f, b_f, berr_f = mcf.process_file('data_coils/large1/' + name, 3)
+                assert len(pos_f) == len(pos)
+            assert np.array_equal(mcf.process_file('data_coils/large1/' + binary[0], 3)[1], b_bin)
+        finally:
+            os.chdir(cwd)
+
+    print('sequential scan:', round(t_seq), 's of instrument time for', len(pos), 'points')
+    print('pipelined scan: ', round(t_pipe), 's of instrument time for', len(pos), 'points')
+    print('pipelined scan to a binary file:', round(t_bin), 's of instrument time')
+    print('max difference in field:', np.max(np.abs(b_seq - b_pipe)), 'G')
+    assert np.max(np.abs(b_seq - b_pipe)) < 0.05
+
+
+def main():
+    testing_pipeline()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Runs the PD:TUNE relay experiment on one zone of a simulated oven while the other zone keeps regulating.
+"""
+import numpy as np
+
+from automation.assemblies import RelayTuner
+from automation.oven_simulation import simulated_oven
+from automation.oven_simulation import run_server
+from automation.pid_controller_server import process_command
+
+
+def testing_relay_tuning(rule='ZN', vectorized=False, setpoint=60):
+    asm_dict, clock, model = simulated_oven(2, daq_noise=0.02, seed=0, sensor_time_constant=60, record=True)
+    asm_dict = {key.upper(): asm for key, asm in asm_dict.items()}  # same as server_loop
+    for key in asm_dict:
+        print(key, process_command(key + ' PD:SETP ' + str(setpoint), asm_dict))
+        print(key, process_command(key + ' PD:REGT 1', asm_dict))
+
+    print('asm1 PD:TUNE', rule, process_command('ASM1 PD:TUNE ' + rule, asm_dict))
+    for hour in range(6):
+        run_server(asm_dict, clock, run_time=3600, vectorized=vectorized)
+        print('hour', hour + 1, 'asm1:', process_command('ASM1 PD:TUNE ?', asm_dict),
+              ' asm1 temp:', round(process_command('ASM1 DQ:TEMP', asm_dict), 2),
+              ' asm2 temp (default gains):', round(process_command('ASM2 DQ:TEMP', asm_dict), 2))
+    print('asm1:', process_command('ASM1 PD:IDN', asm_dict))
+
+    history = model.history
+    assert process_command('ASM1 PD:TUNE ?', asm_dict).startswith('DONE')
+    assert abs(history[-1, 1] - setpoint) < 0.5
+    assert abs(history[-1, 2] - setpoint) < 10  # asm2 kept regulating during the experiment
+
+
+def testing_amplitude(setpoint=60, high=30, hysteresis=0.2, cycles=4):
+    """
+    Steps a RelayTuner by hand on a simulated oven, and checks the amplitude and period that it measured against the
+    oscillation of the recorded temperatures. With the lag of the oven, the peaks come after the switches of the output.
+    """
+    asm_dict, clock, model = simulated_oven(1, sensor_time_constant=60)
+    asm = asm_dict['asm1']
+    asm.ready_assembly()
+    tuner = RelayTuner(setpoint, high, hysteresis=hysteresis, cycles=cycles)
+    t, temps = [], []
+    while tuner.state == 'RUNNING' and clock.time() < 12 * 3600:
+        temp = round(asm.temp, 2)
+        t.append(clock.time())
+        temps.append(temp)
+        asm.set_supply_voltage(tuner.step(temp, clock.time()))
+        clock.sleep(2)
+    assert tuner.state == 'DONE'
+
+    t, temps = np.array(t), np.array(temps)
+    switches = tuner.switch_times[-cycles - 1:]
+    amplitudes = []
+    for t0, t1 in zip(switches[:-1], switches[1:]):
+        cycle = temps[(t >= t0) & (t <= t1)]
+        amplitudes.append((cycle.max() - cycle.min()) / 2)
+    a = np.mean(amplitudes)
+    period = np.mean(np.diff(switches))
+    print('tuner: a =', round(tuner.amplitude, 3), ' Pu =', round(tuner.ultimate_period), 's    trace: a =',
+          round(a, 3), ' Pu =', round(period), 's    Ku =', round(tuner.ultimate_gain, 2))
+    assert abs(tuner.amplitude - a) < 0.02 * a + 0.01
+    assert abs(tuner.ultimate_period - period) < 1e-9
+    assert tuner.amplitude > 2 * hysteresis  # the peaks are well past the switching points
+
+
+def testing_stop(setpoint=60):
+    """
+    Aborts the experiment after 30 minutes. The PID goes back to regulating from a clean state, instead of
+    integrating the error of the whole experiment in its first step.
+    """
+    asm_dict, clock, model = simulated_oven(1, sensor_time_constant=60)
+    asm_dict = {key.upper(): asm for key, asm in asm_dict.items()}
+    asm = asm_dict['ASM1']
+    process_command('ASM1 PD:SETP ' + str(setpoint), asm_dict)
+    process_command('ASM1 PD:REGT 1', asm_dict)
+    process_command('ASM1 PD:TUNE ZN', asm_dict)
+    run_server(asm_dict, clock, run_time=1800)
+    process_command('ASM1 PD:TUNE STOP', asm_dict)
+    print('asm1 PD:TUNE', process_command('ASM1 PD:TUNE ?', asm_dict))
+
+    clock.sleep(asm.get_pid_sample_time())
+    asm.update_supply()
+    integral = asm._pid.components[1]
+    print('integral after the first step:', integral)
+    assert abs(integral) < asm.pid_ki * setpoint * asm.get_pid_sample_time()  # at most one step of error
+
+
+def main():
+    testing_relay_tuning('ZN')
+    testing_relay_tuning('TL', vectorized=True)
+    testing_amplitude()
+    testing_stop()
+
+
+if __name__ == '__main__':
+    main()
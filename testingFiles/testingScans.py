@@ -0,0 +1,79 @@
+"""
+Runs 2D scans with simulated axes and readouts, interrupts one, and resumes it.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from automation.scans import Scan
+from automation.scans import FunctionReadout
+from automation.scans import raster
+from automation.scans import snake
+from automation.scans import list_trajectory
+from automation.scans import load_scan
+
+
+class FakeAxis:
+    def __init__(self, name):
+        self.name = name
+        self.position = 0
+        self.moves = 0
+        self.travel = 0
+
+    def move_to(self, position):
+        self.moves += 1
+        self.travel += abs(position - self.position)
+        self.position = position
+
+
+def testing_trajectories():
+    x = np.arange(3)
+    y = np.arange(4)
+    print(raster(x, y))
+    print(snake(x, y))
+    assert len(snake(x, y, np.arange(2))) == 24
+    assert np.all(np.sort(snake(x, y), axis=0) == np.sort(raster(x, y), axis=0))
+    assert list_trajectory([1, 2, 3]).shape == (3, 1)
+
+
+def testing_resume(binary=False):
+    x_axis = FakeAxis('x')
+    y_axis = FakeAxis('y')
+    calls = {'n': 0}
+
+    def field():
+        calls['n'] += 1
+        if calls['n'] == 13:
+            raise KeyboardInterrupt  # the scan is interrupted in the middle
+        return x_axis.position ** 2 + y_axis.position, 0.1
+
+    readout = FunctionReadout(('b', 'berr'), field)
+    trajectory = snake(np.linspace(0, 10, 5), np.linspace(-1, 1, 6))
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'scan.cdat' if binary else 'scan.txt')
+        scan = Scan([x_axis, y_axis], [readout], trajectory, filename, notes='fake scan\nsecond line')
+        try:
+            scan.run(verbose=False)
+        except KeyboardInterrupt:
+            print('interrupted after', len(load_scan(filename)['index']), 'points')
+        with open(filename, 'ab') as f:  # partial point written during the interruption
+            f.write(np.array([12, 5.0, 0.6]).tobytes() if binary else b'12,5.0,0.6,2')
+
+        data = scan.run(verbose=False)
+        print('travel of y axis with snake:', y_axis.travel)
+        on_file = load_scan(filename)
+
+    assert len(on_file['index']) == len(trajectory)
+    assert np.allclose(on_file['b'], on_file['x'] ** 2 + on_file['y'])
+    assert np.allclose(data['b'], on_file['b'])
+
+
+def main():
+    testing_trajectories()
+    testing_resume()
+    testing_resume(binary=True)
+
+
+if __name__ == '__main__':
+    main()
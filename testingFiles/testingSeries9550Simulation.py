@@ -0,0 +1,56 @@
+"""
+Runs the Series9550 driver against the simulated gaussmeter of instrument_simulation.py, and compares the time taken
+by the different ways of averaging readings. Time is virtual, so the benchmark is instant and repeatable.
+"""
+
+from automation.instrument_simulation import SimulatedSeries9550, connect_driver
+from automation.oven_simulation import VirtualClock
+
+
+def testing_commands():
+    clock = VirtualClock()
+    meter = SimulatedSeries9550(clock=clock, seed=0)
+    gm = connect_driver(meter)  # the 0.2 s sleeps between readings and the autozero wait are virtual too
+    print(gm.idn.strip())
+    assert 'MODEL 9550' in gm.idn
+
+    before = gm.get_avg_zfield(10)[0]
+    t0 = clock.time()
+    gm.autozero()
+    print('autozero took', round(clock.time() - t0, 1), 's, offset removed:', round(before - gm.get_avg_zfield(10)[0], 4))
+    assert abs(gm.get_avg_zfield(10)[0] - 2.2615) < 0.001
+
+    gm.query(':BOGus?')
+    assert 'Undefined' in gm.query(':SYSTem:ERRor?')
+
+
+def testing_benchmark(n=10, target_sem=0.00005):
+    print('mode                        readings  queries  time (s)  average   error')
+    modes = {
+        'one query per reading': {},
+        'buffered text': {'buffered': True},
+        'buffered binary': {'buffered': True, 'binary': True},
+        'one query, target SEM': {'target_sem': target_sem},
+        'buffered binary, target': {'buffered': True, 'binary': True, 'target_sem': target_sem},
+    }
+    times = {}
+    for name, kwargs in modes.items():
+        clock = VirtualClock()
+        meter = SimulatedSeries9550(clock=clock, seed=0)
+        gm = connect_driver(meter)
+        t0 = clock.time()
+        out, sem = gm.get_avg_zfield(n, **kwargs)
+        times[name] = clock.time() - t0
+        print('{:<27} {:<9} {:<8} {:<9.3f} {:<9.5f} {:.6f}'.format(name, meter.readings, meter.queries,
+                                                                   times[name], out, sem))
+        assert abs(out - 2.2645) < 5 * max(sem, 0.0001)
+    assert times['buffered binary'] < times['one query per reading'] / 5
+
+
+def main():
+    testing_commands()
+    testing_benchmark()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Uploads a ramp and soak profile to a simulated oven with PF:LOAD and lets the server loop run it.
+"""
+import numpy as np
+
+from automation.assemblies import SetpointProfile
+from automation.oven_simulation import simulated_oven
+from automation.oven_simulation import run_server
+from automation.pid_controller_server import process_command
+
+
+def testing_profile_math():
+    profile = SetpointProfile.from_string('R,100,2;H,600;S,80;R,25,1')
+    print(profile.segments, profile.to_string())
+    profile.start(0, 20)
+    assert profile.duration == 40*60 + 600 + 0 + 55*60
+    assert profile.setpoint(0) == 20
+    assert profile.setpoint(20*60) == 60
+    assert profile.setpoint(40*60 + 300) == 100
+    assert profile.setpoint(40*60 + 600) == 80
+    assert profile.setpoint(40*60 + 600 + 55*30) == 52.5
+    assert profile.setpoint(1e9) == 25
+    assert profile.is_done(1e9)
+
+
+def testing_hold_only():
+    profile = SetpointProfile.from_string('H,600')
+    assert profile.max_setpoint is None
+    asm_dict, clock, model = simulated_oven(1)
+    asm_dict = {key.upper(): asm for key, asm in asm_dict.items()}
+    assert process_command('ASM1 PF:LOAD H,600', asm_dict) is None
+    profile.start(0, 35)
+    assert profile.setpoint(300) == 35
+
+
+def testing_setpoint_while_running():
+    asm_dict, clock, model = simulated_oven(1)
+    asm_dict = {key.upper(): asm for key, asm in asm_dict.items()}
+    asm = asm_dict['ASM1']
+    process_command('ASM1 PF:LOAD R,60,0.5', asm_dict)
+    process_command('ASM1 PF:STRT', asm_dict)
+    reply = process_command('ASM1 PD:SETP 80', asm_dict)
+    print(reply)
+    assert str(reply).startswith('ERROR')
+    assert asm.get_pid_setpoint() != 80
+    process_command('ASM1 PF:STOP', asm_dict)
+    assert process_command('ASM1 PD:SETP 50', asm_dict) is None
+    assert asm.get_pid_setpoint() == 50
+
+
+def testing_profile_on_oven(vectorized=False):
+    asm_dict, clock, model = simulated_oven(1, record=True)
+    asm_dict = {key.upper(): asm for key, asm in asm_dict.items()}  # same as server_loop
+    asm = asm_dict['ASM1']
+    asm.pid_kp, asm.pid_ki, asm.pid_kd = 2, 0.01, 0   # gains for the simulated oven
+
+    print(process_command('ASM1 PF:LOAD R,60,0.5;H,1800;R,40,0.25', asm_dict))
+    print(process_command('ASM1 PF:STRT', asm_dict))
+    print(process_command('ASM1 PF:STAT ?', asm_dict))
+    run_server(asm_dict, clock, run_time=3.5*3600, vectorized=vectorized)
+    print(process_command('ASM1 PF:STAT ?', asm_dict), ' temp:', round(asm.temp, 2))
+
+    history = model.history
+    t = history[:, 0] - history[0, 0]
+    temps = history[:, 1]
+    soak = (t > 70*60 + 300) & (t < 70*60 + 1800)  # ramp from 25 to 60 takes 70 min
+    print('max error during the soak:', round(np.max(np.abs(temps[soak] - 60)), 3))
+    assert process_command('ASM1 PF:STAT ?', asm_dict).startswith('DONE')
+    assert np.max(np.abs(temps[soak] - 60)) < 1
+
+
+def main():
+    testing_profile_math()
+    testing_hold_only()
+    testing_setpoint_while_running()
+    testing_profile_on_oven()
+    testing_profile_on_oven(vectorized=True)
+
+
+if __name__ == '__main__':
+    main()
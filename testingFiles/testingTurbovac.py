@@ -0,0 +1,146 @@
+"""
+Runs the Turbovac driver against the simulated pump of instrument_simulation.py: telegrams, parameters, starting and
+stopping the pump, and the status poller. Also compares how many telegrams per second can be built with bitarray, like
+testingTurbovacCommunication.py does, with struct, and from the cache of the driver.
+"""
+import time
+
+import numpy as np
+
+import automation.device_models as device_models
+from automation.device_models import Turbovac
+from automation.instrument_simulation import SimulatedTurbovac, connect_driver
+from automation.oven_simulation import VirtualClock
+
+
+def testing_telegrams():
+    sim = SimulatedTurbovac(clock=VirtualClock())
+    tv = connect_driver(sim)
+    frame = tv.encode(1, 150)
+    print(frame.hex(' '))
+    assert len(frame) == 24
+    assert frame[:5] == b'\x02\x16\x00\x10\x96'  # read parameter 150, like testingTurbovacCommunication.py
+    assert Turbovac._bcc_(frame) == 0
+    assert tv._frame_(1, 150) is tv._frame_(1, 150)  # cached
+
+    tv._control = 0x0401
+    assert tv._frame_(1, 150)[11:13] == b'\x04\x01'  # a new frame for the new control word
+
+    reply = bytearray(Turbovac._TELEGRAM.pack(2, 22, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+    print(tv.decode(bytes(reply)))
+    assert tv.decode(bytes(reply)).startswith('ERROR')  # bad checksum
+    assert tv.decode(b'\x02\x16').startswith('ERROR')
+
+
+def testing_parameters():
+    sim = SimulatedTurbovac(clock=VirtualClock())
+    tv = connect_driver(sim)
+    assert tv.get_parameter(1) == 350
+    assert tv.set_parameter(150, 1234) is True and tv.get_parameter(150) == 1234
+    assert tv.set_parameter(150, 2 ** 20, long=True) is True and tv.get_parameter(150) == 2 ** 20
+    print(tv.get_parameter(999))
+    assert tv.get_parameter(999).startswith('ERROR')
+    assert tv.set_parameter(3, 10).startswith('ERROR')  # measured values are read only
+
+    sim.address = 5  # nobody answers
+    assert tv.get_status().startswith('ERROR')
+
+
+def testing_start_stop():
+    clock = VirtualClock()
+    sim = SimulatedTurbovac(nominal_frequency=1000, acceleration=5, clock=clock)
+    tv = connect_driver(sim)
+    assert tv.get_frequency() == 0
+    assert tv.start_pump() is True
+    clock.sleep(100)
+    status = tv.get_status()
+    print('after 100 s:', status, tv.get_status_flags(status['status_word']))
+    assert 495 <= status['frequency'] <= 505 and status['current'] == 2.5
+    assert 'accelerating' in tv.get_status_flags()
+    clock.sleep(200)
+    assert tv.get_frequency() == 1000 and 'frequency reached' in tv.get_status_flags()
+    assert tv.get_motor_temperature() == 45
+
+    sim.error = True
+    assert 'error' in tv.get_status_flags()
+    tv.reset_error()
+    assert 'error' not in tv.get_status_flags() and sim.running
+
+    tv.stop_pump()
+    clock.sleep(100)
+    assert 795 <= tv.get_frequency() <= 805 and 'decelerating' in tv.get_status_flags()
+
+
+def testing_polling(interval=0.05, duration=0.5):
+    sim = SimulatedTurbovac(acceleration=200, clock=time)
+    tv = connect_driver(sim)
+    seen = []
+    tv.start_pump()
+    tv.start_polling(interval, callback=seen.append)
+    t0 = time.time()
+    while time.time() - t0 < duration:
+        assert tv.get_parameter(1) == 350  # takes turns with the poller
+    while not seen:  # the number of polls depends on the scheduling of the threads, at least one is needed
+        time.sleep(interval)
+    tv.stop_polling()
+    readings = tv.get_readings()
+    print('polled', len(readings), 'times in', round(time.time() - t0, 2), 's:', readings[-1])
+    assert len(readings) == len(seen) >= 1
+    assert np.array_equal(readings[:, 0], [status['time'] for status in seen])
+    assert np.array_equal(readings[:, 1], [status['frequency'] for status in seen])
+    assert np.all(np.diff(readings[:, 0]) > 0)  # in order
+    assert np.all(np.diff(readings[:, 1]) >= 0)  # accelerating
+    assert np.all(readings[:, 4] == 24.0) and np.all(readings[:, 5].astype(int) & 4)  # voltage, operation enabled
+    tv.disconnect()
+
+
+def encode_bitarray(param_num):
+    """
+    The telegram built bit by bit, as in testingTurbovacCommunication.py, without the parity bits.
+    """
+    from bitarray import bitarray
+    bytes_array = [bitarray() for i in range(24)]
+    bytes_array[0].frombytes(b'\x02')
+    bytes_array[1].frombytes(b'\x16')
+    bytes_array[2].frombytes(b'\x00')
+    word0 = bitarray('0001' + '0') + bitarray(format(param_num, '011b'))
+    bytes_array[3] = word0[:8]
+    bytes_array[4] = word0[8:]
+    bytes_array[11].frombytes(b'\x04')
+    bit_query = ''
+    for byte_i in bytes_array:
+        if len(byte_i) < 1:
+            byte_i.frombytes(b'\x00')
+        bit_query += byte_i.to01()
+    return bitarray(bit_query).tobytes()
+
+
+def benchmark(n=20000):
+    sim = SimulatedTurbovac(clock=VirtualClock())
+    tv = connect_driver(sim)
+    tv._control = 0x0400
+    assert encode_bitarray(150)[:23] == tv.encode(1, 150)[:23]
+
+    rates = {}
+    for name, build in (('bitarray', lambda: encode_bitarray(150)), ('struct', lambda: tv.encode(1, 150)),
+                        ('cached', lambda: tv._frame_(1, 150))):
+        t0 = time.perf_counter()
+        for i in range(n):
+            build()
+        rates[name] = n / (time.perf_counter() - t0)
+        print('{:10s}{:12.0f} telegrams/s'.format(name, rates[name]))
+    print('one exchange at 19200 baud takes', round(48 * sim.byte_time * 1000, 1), 'ms')
+    assert rates['cached'] > rates['struct'] > rates['bitarray']
+
+
+def main():
+    testing_telegrams()
+    testing_parameters()
+    testing_start_stop()
+    testing_polling()
+    device_models.time = time
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Runs the Vxm driver against the simulated controller of instrument_simulation.py. Compares a long displacement done as
+several blocking round trips, like displace() did before motion programs, with the same displacement uploaded as one
+program, and shows a measurement done while the motor moves.
+"""
+import time
+
+import automation.device_models as device_models
+from automation.device_models import Vxm
+from automation.instrument_simulation import SimulatedVxm, connect_driver
+from automation.oven_simulation import VirtualClock
+
+
+def testing_index_commands():
+    for steps in (0, 400, -400, 10000, 10001, 25000, -25001):
+        parts = [int(c.split('M')[1]) for c in Vxm._index_commands_(1, steps)]
+        assert sum(parts) == steps and max(abs(p) for p in parts) <= 10000, (steps, parts)
+        assert max(parts) - min(parts) <= 1
+    print(Vxm._index_commands_(1, -25001))
+
+
+def testing_program_vs_round_trips(steps=25000):
+    clock = VirtualClock()
+    controller = SimulatedVxm(clock=clock)
+    vx = connect_driver(controller)
+    vx.set_speed(1, 1000)
+    vx.set_acceleration(1, 1)
+
+    t0 = clock.time()
+    for part in (steps // 4,) * 4:  # what displace() did: halve until at most 10000 steps, one round trip each
+        vx._query_('I1M' + str(part))
+    t_old = clock.time() - t0
+
+    t0 = clock.time()
+    programs = controller.programs
+    assert vx.displace(1, -steps) == b'^'
+    t_new = clock.time() - t0
+    print(steps, 'steps: round trips', round(t_old, 2), 's    one program', round(t_new, 2), 's')
+    assert controller.positions[1] == 0 and controller.programs - programs == 1
+    assert t_new < t_old
+
+    t0 = clock.time()
+    vx.displace_sequence_async(1, [1000] * 16, pause=0.2).result()
+    vx.wait_motion()
+    print('16 displacements of 1000 steps in one program:', round(clock.time() - t0, 2), 's')
+    assert controller.positions[1] == 16000 and not controller.errors
+
+
+def testing_overlap(steps=3000, measurement=0.4):
+    controller = SimulatedVxm(speed=6000, acceleration=10, byte_time=1e-4, timeout=1, clock=time)
+    vx = connect_driver(controller)
+    move_time = controller.move_time(1, steps)
+
+    t0 = time.perf_counter()
+    move = vx.displace_async(1, steps)
+    returned = time.perf_counter() - t0
+    assert vx.is_moving()
+    time.sleep(measurement)  # stands for reading the gaussmeter
+    assert move.result() == b'^'
+    vx.wait_motion()
+    overlapped = time.perf_counter() - t0
+    print('move', round(move_time, 2), 's, measurement', measurement, 's, together', round(overlapped, 2),
+          's, returned after', round(returned * 1000, 1), 'ms')
+    assert returned < 0.05 and overlapped < move_time + measurement
+
+    vx.displace_async(1, -steps)
+    vx.set_speed(1, 2000)  # waits for the motion
+    assert not vx.is_moving() and controller.positions[1] == 0 and controller.speed[1] == 2000
+
+
+def main():
+    testing_index_commands()
+    testing_program_vs_round_trips()
+    testing_overlap()
+    device_models.time = time
+
+
+if __name__ == '__main__':
+    main()
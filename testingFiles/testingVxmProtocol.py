@@ -0,0 +1,95 @@
+"""
+Benchmark of the Vxm commands against the simulated controller of instrument_simulation.py: the fixed delays that the
+driver used before polling the controller with V, the commands per second now, and the limit set by the serial line.
+Time is virtual, so the benchmark is instant and repeatable.
+"""
+import time
+
+import automation.device_models as device_models
+from automation.instrument_simulation import SimulatedVxm, connect_driver
+from automation.oven_simulation import VirtualClock
+
+
+def initialize_with_delays(ser, clock):  # Vxm.initialize() before readiness polling
+    for c in 'FNCC':
+        ser.write(c.encode('utf-8'))
+        clock.sleep(0.1)
+
+
+def query_with_delays(ser, clock, qry):  # Vxm._query_() before readiness polling
+    ser.write((qry + ',R').encode('utf-8'))
+    out = ser.read_until(b'^')
+    clock.sleep(0.3)
+    ser.write('C'.encode('utf-8'))
+    return out
+
+
+def testing_startup():
+    clock = VirtualClock()
+    controller = SimulatedVxm(clock=clock)
+    t0 = clock.time()
+    initialize_with_delays(controller, clock)
+    t_old = clock.time() - t0
+
+    clock = VirtualClock()
+    controller = SimulatedVxm(clock=clock)
+    t0 = clock.time()
+    vx = connect_driver(controller)
+    t_new = clock.time() - t0
+    print('startup: fixed delays', round(t_old, 3), 's    polling', round(t_new, 3), 's')
+    assert controller.online and t_new < t_old
+
+
+def testing_commands_per_second(n=50):
+    clock = VirtualClock()
+    controller = SimulatedVxm(clock=clock)
+    t0 = clock.time()
+    for i in range(n):
+        query_with_delays(controller, clock, 'S1M' + str(1000 + i))
+    rate_old = n / (clock.time() - t0)
+
+    clock = VirtualClock()
+    controller = SimulatedVxm(clock=clock)
+    vx = connect_driver(controller)
+    t0 = clock.time()
+    for i in range(n):
+        assert vx.set_speed(1, 1000 + i) == b'^'
+    rate_new = n / (clock.time() - t0)
+    assert controller.speed[1] == 1000 + n - 1
+
+    line_bytes = len('S1M1000,R') + len('^') + len('C')
+    rate_line = 1 / (line_bytes * controller.byte_time + controller.command_time)
+    print('set_speed: fixed delays', round(rate_old, 1), 'commands/s    polling', round(rate_new, 1),
+          'commands/s    serial line limit', round(rate_line, 1), 'commands/s')
+    assert rate_new > 10 * rate_old and rate_new > 0.9 * rate_line
+
+    for key, (count, mean, std, low, high) in vx.get_command_stats().items():
+        print('  {:<3} {:>4} commands, {:.2f} ms mean, {:.2f} to {:.2f} ms'.format(key, count, 1000 * mean,
+                                                                                    1000 * low, 1000 * high))
+
+
+def testing_busy():
+    clock = VirtualClock()
+    controller = SimulatedVxm(clock=clock)
+    vx = connect_driver(controller)
+    controller.write(b'C,I1M4000,R')  # started by someone else, e.g. from the front panel
+    controller.read_until(b'^')
+    assert vx.wait_ready() is True
+    controller.write(b'C,I1M4000,R')
+    t0 = clock.time()
+    assert vx.wait_ready() is True
+    print('waited', round(clock.time() - t0, 2), 's for a move of', round(controller.move_time(1, 4000), 2), 's')
+
+    controller.write(b'C,I1M40000,R')
+    assert vx.wait_ready(timeout=1).startswith('ERROR')
+
+
+def main():
+    testing_startup()
+    testing_commands_per_second()
+    testing_busy()
+    device_models.time = time
+
+
+if __name__ == '__main__':
+    main()